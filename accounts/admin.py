@@ -1,9 +1,42 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
-from .models import FriendShip, User
+from core.admin import LargeTableAdmin
+from jobs.actions import batched_action
+
+from . import tasks
+from .models import Block, FriendShip, Mute, User
 
 # Register your models here.
 
 admin.site.register(User, UserAdmin)
-admin.site.register(FriendShip)
+
+
+@admin.register(FriendShip)
+class FriendShipAdmin(LargeTableAdmin):
+    list_display = ("id", "follower", "following", "created_date")
+    list_select_related = ("follower", "following")
+    autocomplete_fields = ("follower", "following")
+    search_fields = ("=follower__username", "=following__username")
+    date_hierarchy = "created_date"
+    actions = [
+        batched_action(
+            tasks.delete_friendships, "delete_friendships", "選択したフォローを削除"
+        ),
+    ]
+
+
+@admin.register(Block)
+class BlockAdmin(LargeTableAdmin):
+    list_display = ("id", "blocker", "blocked", "created_date")
+    list_select_related = ("blocker", "blocked")
+    autocomplete_fields = ("blocker", "blocked")
+    search_fields = ("=blocker__username", "=blocked__username")
+
+
+@admin.register(Mute)
+class MuteAdmin(LargeTableAdmin):
+    list_display = ("id", "muter", "muted", "created_date")
+    list_select_related = ("muter", "muted")
+    autocomplete_fields = ("muter", "muted")
+    search_fields = ("=muter__username", "=muted__username")
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from core import invalidation
+
+from .models import FriendShip
+
+
+@dataclass(frozen=True)
+class Relationship:
+    follows: bool  # viewer がこのユーザーをフォローしている
+    followed_by: bool  # このユーザーが viewer をフォローしている
+    is_self: bool = False
+
+    @property
+    def mutual(self):
+        return self.follows and self.followed_by
+
+
+class AdjacencyCache:
+    # user_id -> フォローしている (またはされている) ユーザー id の frozenset
+    # プロセスごとに持ち、TTL と件数上限で古いものを捨てる
+    def __init__(self, column, key_column):
+        self.column = column
+        self.key_column = key_column
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, user_ids):
+        now = time.monotonic()
+        ttl = settings.RELATIONSHIP_CACHE_TTL
+        found = {}
+        missing = []
+        with self.lock:
+            for user_id in user_ids:
+                entry = self.entries.get(user_id)
+                if entry is not None and now - entry[1] < ttl:
+                    self.entries.move_to_end(user_id)
+                    found[user_id] = entry[0]
+                else:
+                    missing.append(user_id)
+        if missing:
+            found.update(self.load(missing, now))
+        return found
+
+    def get(self, user_id):
+        return self.get_many([user_id])[user_id]
+
+    def load(self, user_ids, now):
+        # 足りない分は 1 クエリでまとめて読む
+        loaded = {user_id: set() for user_id in user_ids}
+        rows = FriendShip.objects.filter(**{f"{self.key_column}__in": user_ids})
+        for key, value in rows.values_list(self.key_column, self.column).iterator():
+            loaded[key].add(value)
+        loaded = {user_id: frozenset(ids) for user_id, ids in loaded.items()}
+        with self.lock:
+            for user_id, ids in loaded.items():
+                self.entries[user_id] = (ids, now)
+                self.entries.move_to_end(user_id)
+            while len(self.entries) > settings.RELATIONSHIP_CACHE_MAX_ENTRIES:
+                self.entries.popitem(last=False)
+        return loaded
+
+    def invalidate(self, *user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+followings = AdjacencyCache("following_id", "follower_id")
+followers = AdjacencyCache("follower_id", "following_id")
+
+
+def relationships(viewer_id, user_ids):
+    # viewer と user_ids それぞれの関係を、キャッシュ 2 件分の読み出しで返す
+    viewer_followings = followings.get(viewer_id)
+    viewer_followers = followers.get(viewer_id)
+    return {
+        user_id: Relationship(
+            follows=user_id in viewer_followings,
+            followed_by=user_id in viewer_followers,
+            is_self=user_id == viewer_id,
+        )
+        for user_id in user_ids
+    }
+
+
+def common_followings(viewer_id, user_ids):
+    # viewer と各ユーザーが共通してフォローしている人の id
+    viewer_followings = followings.get(viewer_id)
+    return {
+        user_id: viewer_followings & ids
+        for user_id, ids in followings.get_many(list(user_ids)).items()
+    }
+
+
+def invalidate_edge(follower_id, following_id):
+    invalidation.publish("graph.followings", follower_id)
+    invalidation.publish("graph.followers", following_id)
+
+
+def invalidate_user(user_id):
+    invalidation.publish("graph.followings", user_id)
+    invalidation.publish("graph.followers", user_id)
+
+
+def clear():
+    followings.clear()
+    followers.clear()
+
+
+invalidation.subscribe("graph.followings", followings.invalidate, followings.clear)
+invalidation.subscribe("graph.followers", followers.invalidate, followers.clear)
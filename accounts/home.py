@@ -0,0 +1,43 @@
+from django.template.loader import render_to_string
+
+from core.overload import store_stale
+from notifications.inbox import unread_count
+from tweets import impressions, ranking, shards, timeline
+from tweets.models import Like, Retweet
+
+from . import visibility
+
+# ホームの中身。HomeView と、過負荷のときにキャッシュを作り直すジョブの両方が使う
+
+TEMPLATE_NAME = "accounts/home.html"
+
+
+def stale_key(user_id, order, page):
+    return f"home_page:{user_id}:{order}:{page}"
+
+
+def get_context(user, order, page, record_impressions=True):
+    if order == ranking.RANKED:
+        tweets = ranking.ranked_page(user, page)
+    else:
+        # 同じツイートのリツイートは 1 件にまとめる
+        tweets = timeline.home(viewer_filter=visibility.for_viewer(user.pk))
+    if record_impressions:
+        impressions.record([tweet.pk for tweet in tweets], user.pk)
+    impressions.attach_counts(tweets)
+    return {
+        "tweets": tweets,
+        "feed_order": order,
+        # いいね・リツイートはツイートのシャードにあるので、全シャードから集める
+        "liked_list": shards.values(Like.objects.filter(user=user), "target_tweet"),
+        "retweeted_list": shards.values(Retweet.objects.filter(user=user), "tweet"),
+        "unread_count": unread_count(user),
+    }
+
+
+def refresh(user, order, page):
+    # リクエストなしで描いてキャッシュに入れ直す (表示したことにはしない)
+    context = get_context(user, order, page, record_impressions=False)
+    context["user"] = user
+    content = render_to_string(TEMPLATE_NAME, context).encode()
+    store_stale(stale_key(user.pk, order, page), content)
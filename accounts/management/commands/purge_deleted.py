@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from accounts.purge import purge_deleted_tweets, purge_deleted_users
+
+
+class Command(BaseCommand):
+    help = "削除済みのツイートと退会したユーザーを少しずつ消す"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        tweets = purge_deleted_tweets(options["batch_size"])
+        users = purge_deleted_users(options["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"ツイート {tweets} 件、ユーザー {users} 人を削除しました"
+            )
+        )
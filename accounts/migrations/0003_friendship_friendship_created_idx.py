@@ -0,0 +1,17 @@
+# Generated by Django 4.0.10 on 2026-10-19 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['created_date'], name='friendship_created_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.10 on 2026-10-19 17:59
+
+import core.snowflake
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_friendship_friendship_created_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='friendship',
+            name='id',
+            field=models.BigIntegerField(default=core.snowflake.next_id, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
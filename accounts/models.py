@@ -1,5 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
+
+from core.snowflake import next_id
 
 
 class User(AbstractUser):
@@ -12,9 +15,17 @@ class User(AbstractUser):
         related_name="followings",
         through_fields=("following", "follower"),
     )
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    def soft_delete(self):
+        # ログインできなくして、ツイートなどは purge_deleted コマンドが後で消す
+        self.deleted_at = timezone.now()
+        self.is_active = False
+        self.save(update_fields=["deleted_at", "is_active"])
 
 
 class FriendShip(models.Model):
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
     follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
     following = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
     created_date = models.DateTimeField(auto_now_add=True)
@@ -25,3 +36,30 @@ class FriendShip(models.Model):
                 fields=["follower", "following"], name="follow_unique"
             )
         ]
+        indexes = [models.Index(fields=["created_date"], name="friendship_created_idx")]
+
+
+class Block(models.Model):
+    # ブロックするとお互いのツイートが見えなくなり、フォローも外れる
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
+    blocker = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    blocked = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["blocker", "blocked"], name="block_unique")
+        ]
+
+
+class Mute(models.Model):
+    # ミュートは自分のタイムラインから消すだけで、相手には何も変わらない
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
+    muter = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    muted = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    created_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["muter", "muted"], name="mute_unique")
+        ]
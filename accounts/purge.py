@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, QuerySet
+
+from notifications import inbox
+from notifications.models import Notification
+from outbox import events
+from tweets import shards
+from tweets.models import (
+    ArchivedLike,
+    ArchivedRetweet,
+    ArchivedTweet,
+    Like,
+    Retweet,
+    ScheduledTweet,
+    Tweet,
+)
+
+from .models import Block, FriendShip, Mute, User
+
+# 消すときに同じトランザクションで outbox にイベントを書くモデル
+DELETE_WITH_EVENTS = {
+    Like: events.delete_likes,
+    Retweet: events.delete_retweets,
+    FriendShip: events.delete_follows,
+}
+
+
+def delete_in_batches(queryset, batch_size):
+    # 1 トランザクションで消すのは batch_size 件まで
+    total = 0
+    delete = DELETE_WITH_EVENTS.get(queryset.model, QuerySet.delete)
+    while True:
+        ids = list(queryset.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return total
+        with transaction.atomic(using=queryset.db):
+            delete(queryset.model._base_manager.using(queryset.db).filter(pk__in=ids))
+        total += len(ids)
+
+
+def delete_retweets(queryset, batch_size):
+    # リツイート数を戻しながら消す (1 人が同じツイートをリツイートするのは 1 回だけ)
+    # リツイートは元のツイートと同じシャードにあるので、数も queryset と同じ DB で直す
+    alias = queryset.db
+    while True:
+        rows = list(queryset.values_list("pk", "tweet_id")[:batch_size])
+        if not rows:
+            return
+        with transaction.atomic(using=alias):
+            events.delete_retweets(
+                Retweet.objects.using(alias).filter(pk__in=[pk for pk, _ in rows])
+            )
+            Tweet.all_objects.using(alias).filter(
+                pk__in=[tweet_id for _, tweet_id in rows], retweet_count__gt=0
+            ).update(retweet_count=F("retweet_count") - 1)
+
+
+def purge_tweet(alias, tweet_id, batch_size):
+    # いいね・リツイートはツイートと同じシャード (alias)、通知は default にある
+    delete_in_batches(
+        Like.objects.using(alias).filter(target_tweet_id=tweet_id), batch_size
+    )
+    delete_in_batches(
+        Retweet.objects.using(alias).filter(tweet_id=tweet_id), batch_size
+    )
+    inbox.delete_in_batches(
+        Notification.objects.filter(target_tweet_id=tweet_id), batch_size
+    )
+    with transaction.atomic(using=alias):
+        events.delete_tweets(Tweet.all_objects.using(alias).filter(pk=tweet_id))
+
+
+def purge_tweets(queryset, batch_size):
+    # queryset のツイートをシャードごとに batch_size 件ずつ消す
+    purged = 0
+    for tweets in shards.scatter(queryset.order_by("pk")):
+        while True:
+            ids = list(tweets.values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                break
+            for tweet_id in ids:
+                purge_tweet(tweets.db, tweet_id, batch_size)
+            purged += len(ids)
+    return purged
+
+
+def purge_deleted_tweets(batch_size):
+    return purge_tweets(Tweet.all_objects.filter(deleted_at__isnull=False), batch_size)
+
+
+def purge_user(user, batch_size):
+    # シャードにある行は最後の user.delete() の連鎖削除 (delete_replicated_user)
+    # に任せず、ここで先にシャードごとに batch_size 件ずつ消しておく
+    for likes in shards.scatter(Like.objects.filter(user=user)):
+        delete_in_batches(likes, batch_size)
+    for retweets in shards.scatter(Retweet.objects.filter(user=user)):
+        delete_retweets(retweets, batch_size)
+    delete_in_batches(FriendShip.objects.filter(follower=user), batch_size)
+    delete_in_batches(FriendShip.objects.filter(following=user), batch_size)
+    delete_in_batches(Block.objects.filter(blocker=user), batch_size)
+    delete_in_batches(Block.objects.filter(blocked=user), batch_size)
+    delete_in_batches(Mute.objects.filter(muter=user), batch_size)
+    delete_in_batches(Mute.objects.filter(muted=user), batch_size)
+    delete_in_batches(ScheduledTweet.objects.filter(user=user), batch_size)
+    purge_tweets(Tweet.all_objects.filter(user=user), batch_size)
+
+    archive_db = settings.TWEET_ARCHIVE_DATABASE
+    delete_in_batches(
+        ArchivedLike.objects.using(archive_db).filter(user_id=user.pk), batch_size
+    )
+    delete_in_batches(
+        ArchivedRetweet.objects.using(archive_db).filter(user_id=user.pk), batch_size
+    )
+    archived = ArchivedTweet.objects.using(archive_db).filter(user_id=user.pk)
+    delete_in_batches(
+        ArchivedLike.objects.using(archive_db).filter(target_tweet__in=archived),
+        batch_size,
+    )
+    delete_in_batches(
+        ArchivedRetweet.objects.using(archive_db).filter(tweet__in=archived),
+        batch_size,
+    )
+    delete_in_batches(archived, batch_size)
+
+    inbox.delete_in_batches(Notification.objects.filter(recipient=user), batch_size)
+    actor_of = Notification.objects.filter(last_actor=user)
+    while True:
+        ids = list(actor_of.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            break
+        Notification.objects.filter(pk__in=ids).update(last_actor=None)
+    user.delete()
+
+
+def purge_deleted_users(batch_size):
+    users = User.objects.filter(deleted_at__isnull=False).order_by("pk")
+    purged = 0
+    for user in users.iterator(chunk_size=batch_size):
+        purge_user(user, batch_size)
+        purged += 1
+    return purged
@@ -0,0 +1,95 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from tweets import ranking, shards
+from tweets.models import Like, Tweet
+
+from . import graph, stats, visibility
+from .models import Block, FriendShip, Mute, User
+
+
+@receiver(post_save, sender=FriendShip)
+@receiver(post_delete, sender=FriendShip)
+def invalidate_relationships(sender, instance, **kwargs):
+    graph.invalidate_edge(instance.follower_id, instance.following_id)
+    stats.invalidate(instance.follower_id, instance.following_id)
+
+
+@receiver(post_save, sender=Block)
+@receiver(post_delete, sender=Block)
+def invalidate_block(sender, instance, **kwargs):
+    # ブロックは両方の見え方が変わる
+    visibility.invalidate(instance.blocker_id, instance.blocked_id)
+    ranking.invalidate(instance.blocker_id, instance.blocked_id)
+
+
+@receiver(post_save, sender=Mute)
+@receiver(post_delete, sender=Mute)
+def invalidate_mute(sender, instance, **kwargs):
+    visibility.invalidate(instance.muter_id)
+    ranking.invalidate(instance.muter_id)
+
+
+@receiver(post_save, sender=Tweet)
+@receiver(post_delete, sender=Tweet)
+def invalidate_tweet_stats(sender, instance, **kwargs):
+    stats.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def invalidate_like_stats(sender, instance, **kwargs):
+    if Like._meta.get_field("target_tweet").is_cached(instance):
+        author_id = instance.target_tweet.user_id
+    else:
+        author_id = (
+            Tweet.all_objects.using(instance._state.db)
+            .filter(pk=instance.target_tweet_id)
+            .values_list("user_id", flat=True)
+            .first()
+        )
+    if author_id is not None:
+        stats.invalidate(author_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_new_user(sender, instance, created, **kwargs):
+    # 新しいユーザーにはまだ関係がないので、同じ id の古いキャッシュを捨てる
+    if created:
+        invalidate_user(instance)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    invalidate_user(instance)
+
+
+def invalidate_user(user):
+    graph.invalidate_user(user.pk)
+    stats.invalidate(user.pk)
+    visibility.invalidate(user.pk)
+
+
+@receiver(post_save, sender=User)
+def replicate_user(sender, instance, using, **kwargs):
+    # ツイートのシャードでも select_related("user") や外部キーが使えるよう、
+    # default に書いたユーザーを他のシャードへ複製する
+    if using != "default" or not shards.is_sharded():
+        return
+    fields = {
+        field.attname: getattr(instance, field.attname)
+        for field in User._meta.concrete_fields
+        if not field.primary_key
+    }
+    for alias in shards.aliases():
+        if alias != using:
+            User.objects.using(alias).update_or_create(pk=instance.pk, defaults=fields)
+
+
+@receiver(post_delete, sender=User)
+def delete_replicated_user(sender, instance, using, **kwargs):
+    if using != "default" or not shards.is_sharded():
+        return
+    for alias in shards.aliases():
+        if alias != using:
+            User.objects.using(alias).filter(pk=instance.pk).delete()
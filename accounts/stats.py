@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from core import invalidation
+from tweets import shards
+from tweets.models import ArchivedTweet, Like, Tweet
+
+from .models import FriendShip, User
+
+STAT_FIELDS = ("tweet_count", "follower_count", "following_count", "likes_received")
+TWEET_FIELDS = ("tweet_count", "likes_received")
+FOLLOW_FIELDS = ("follower_count", "following_count")
+
+# clear() で上げると、それより前に書いたキーは読まれなくなる
+generation = 0
+
+
+def count_subquery(queryset, column, aggregate=None):
+    # 相関サブクエリで件数を数える (0 件のときは 0)
+    aggregate = aggregate or Count("pk")
+    counted = queryset.order_by().values(column).annotate(n=aggregate).values("n")
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def tweet_counts(with_archive=False):
+    # with_archive=True ならアーカイブに移したツイートといいねも同じクエリで足す
+    # (アーカイブが同じ DB にあるときだけ)
+    counts = {
+        "tweet_count": count_subquery(
+            Tweet.objects.filter(user=OuterRef("pk")), "user"
+        ),
+        "likes_received": count_subquery(
+            Like.objects.filter(
+                target_tweet__user=OuterRef("pk"),
+                target_tweet__deleted_at__isnull=True,
+            ),
+            "target_tweet__user",
+        ),
+    }
+    if with_archive:
+        archived = ArchivedTweet.objects.filter(user=OuterRef("pk"))
+        counts["tweet_count"] += count_subquery(archived, "user")
+        counts["likes_received"] += count_subquery(archived, "user", Sum("like_count"))
+    return counts
+
+
+def archive_counts(user_id):
+    counted = (
+        ArchivedTweet.objects.using(settings.TWEET_ARCHIVE_DATABASE)
+        .filter(user_id=user_id)
+        .aggregate(tweet_count=Count("pk"), likes_received=Sum("like_count"))
+    )
+    return {field: counted[field] or 0 for field in TWEET_FIELDS}
+
+
+def follow_counts():
+    return {
+        "follower_count": count_subquery(
+            FriendShip.objects.filter(
+                following=OuterRef("pk"), follower__deleted_at__isnull=True
+            ),
+            "following",
+        ),
+        "following_count": count_subquery(
+            FriendShip.objects.filter(
+                follower=OuterRef("pk"), following__deleted_at__isnull=True
+            ),
+            "follower",
+        ),
+    }
+
+
+def load(user_id):
+    users = User.objects.filter(pk=user_id, deleted_at__isnull=True)
+    shard = shards.for_user(user_id)
+    with_archive = settings.TWEET_ARCHIVE_DATABASE == shard
+    if shard == users.db:
+        # 4 つの件数を 1 クエリで取る
+        stats = (
+            users.annotate(**tweet_counts(with_archive), **follow_counts())
+            .values(*STAT_FIELDS)
+            .first()
+        )
+    else:
+        # ツイートといいねは投稿者のシャードにあるので、そちらで別に数える
+        stats = users.annotate(**follow_counts()).values(*FOLLOW_FIELDS).first()
+        if stats is None:
+            return None
+        counted = (
+            users.using(shard)
+            .annotate(**tweet_counts(with_archive))
+            .values(*TWEET_FIELDS)
+        )
+        stats.update(counted.first() or dict.fromkeys(TWEET_FIELDS, 0))
+    if stats is not None and not with_archive:
+        for field, n in archive_counts(user_id).items():
+            stats[field] += n
+    return stats
+
+
+def cache_key(user_id):
+    return f"profile_stats:{generation}:{user_id}"
+
+
+def get(user_id):
+    stats = cache.get(cache_key(user_id))
+    if stats is None:
+        stats = load(user_id)
+        if stats is None:
+            return None
+        cache.set(cache_key(user_id), stats, settings.PROFILE_STATS_CACHE_TTL)
+    return stats
+
+
+def evict(*user_ids):
+    cache.delete_many([cache_key(user_id) for user_id in user_ids])
+
+
+def clear():
+    global generation
+    generation += 1
+
+
+def invalidate(*user_ids):
+    invalidation.publish("stats", *user_ids)
+
+
+invalidation.subscribe("stats", evict, clear)
@@ -0,0 +1,131 @@
+import csv
+import json
+import zipfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
+
+STREAM_MARKER = "<!-- stream-rows -->"
+DEFAULT_CHUNK_SIZE = 500
+ZIP_CHUNK_BYTES = 64 * 1024
+
+
+def iter_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    # .iterator() で chunk_size 件ずつ取り出し、リストにまとめて返す
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_template(
+    request,
+    template_name,
+    context,
+    rows_template_name,
+    rows_name,
+    queryset,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    prepare_rows=None,
+):
+    # ページ本体は STREAM_MARKER の前後に分けて先頭・末尾として送り、
+    # 一覧部分だけ chunk ごとに rows_template_name で描画して流す。
+    # prepare_rows を渡すと、描画前に chunk ごとに呼ぶ
+    page = render_to_string(
+        template_name,
+        {**context, "streaming": True, "stream_marker": STREAM_MARKER},
+        request,
+    )
+    head, tail = page.split(STREAM_MARKER, 1)
+    rows_template = get_template(rows_template_name)
+
+    def generate():
+        yield head
+        for chunk in iter_chunks(queryset, chunk_size):
+            if prepare_rows is not None:
+                prepare_rows(chunk)
+            yield rows_template.render({**context, rows_name: chunk}, request)
+        yield tail
+
+    return StreamingHttpResponse(generate())
+
+
+class Echo:
+    # csv.writer の書き込み先。書いた行をそのまま返す
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+EXPORT_FORMATS = {
+    "csv": (csv_lines, "text/csv"),
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+}
+
+
+def stream_export(fmt, filename, header, rows):
+    lines, content_type = EXPORT_FORMATS[fmt]
+    response = StreamingHttpResponse(lines(header, rows), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+class ZipBuffer:
+    # zipfile の書き込み先。seek できないので zipfile はデータ記述子付きで書く。
+    # 書かれた分を溜めておき、take() で取り出す
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def zip_chunks(members, chunk_bytes=ZIP_CHUNK_BYTES):
+    # members は (ファイル名, 行のイテレータ) の並び。行を 1 つずつ圧縮しながら書き、
+    # chunk_bytes 溜まるごとに返すので、全体の大きさによらずメモリは一定
+    buffer = ZipBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, lines in members:
+            # 大きさが前もって分からないので、4 GiB を超えてもよいように zip64 で書く
+            with archive.open(name, "w", force_zip64=True) as f:
+                for line in lines:
+                    f.write(line.encode())
+                    if buffer.size >= chunk_bytes:
+                        yield buffer.take()
+    yield buffer.take()
+
+
+def stream_zip(filename, members):
+    response = StreamingHttpResponse(
+        zip_chunks(members), content_type="application/zip"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}.zip"'
+    return response
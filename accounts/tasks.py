@@ -0,0 +1,26 @@
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+
+from jobs.models import Job
+from jobs.queue import task
+from outbox import events
+
+from . import home
+from .models import FriendShip, User
+
+
+@task(name="accounts.delete_friendships", priority=Job.Priority.LOW)
+def delete_friendships(ids):
+    with transaction.atomic():
+        events.delete_follows(FriendShip.objects.filter(pk__in=ids))
+
+
+@task(name="accounts.refresh_home_page", priority=Job.Priority.HIGH)
+def refresh_home_page(user_id, order, page):
+    # 過負荷で古いホームを返したときに、キャッシュしてあるページを作り直す
+    user = AnonymousUser()
+    if user_id is not None:
+        user = User.objects.filter(pk=user_id, is_active=True).first()
+        if user is None:
+            return
+    home.refresh(user, order, page)
@@ -1,12 +1,22 @@
+import json
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+
 from django.contrib.auth import SESSION_KEY, get_user_model
 from django.contrib.messages import get_messages
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
 from mysite import settings
-from tweets.models import Tweet
+from notifications import inbox
+from notifications.models import Notification
+from tweets.models import ArchivedTweet, Like, Tweet
 
-from .models import FriendShip
+from . import graph, stats, streaming, visibility
+from .models import FriendShip, Mute
 
 User = get_user_model()
 
@@ -464,3 +474,394 @@ class TestFollowerListView(TestCase):
         )
         self.assertEqual(response.context["followings_num"], 1)
         self.assertEqual(FriendShip.objects.all().count(), 1)
+
+
+class TestFriendShipListStreaming(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.client.force_login(self.user)
+        for i in range(5):
+            follower = User.objects.create_user(
+                username=f"follower{i}", email=f"follower{i}@example.com"
+            )
+            FriendShip.objects.create(following=self.user, follower=follower)
+
+    @override_settings(FRIENDSHIP_LIST_CHUNK_SIZE=2)
+    def test_success_get_streaming(self):
+        response = self.client.get(
+            reverse("accounts:follower_list", kwargs={"username": "sample"})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode()
+        for i in range(5):
+            self.assertIn(f"follower{i}", content)
+        self.assertIn("</html>", content)
+
+    @override_settings(FRIENDSHIP_LIST_STREAMING=False)
+    def test_success_get_without_streaming(self):
+        response = self.client.get(
+            reverse("accounts:follower_list", kwargs={"username": "sample"})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(response.context["my_followers"]), 5)
+        self.assertContains(response, "follower4")
+
+
+class TestGraphExportView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="sample2", email="sample2@example.com", password="testpassword2"
+        )
+        FriendShip.objects.create(following=self.user2, follower=self.user)
+        self.client.force_login(self.user)
+
+    def test_success_get_csv(self):
+        response = self.client.get(reverse("accounts:graph_export", args=["csv"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "relation,user_id,username,created_date")
+        self.assertTrue(lines[1].startswith(f"following,{self.user2.pk},sample2,"))
+        self.assertEqual(len(lines), 2)
+
+    def test_success_get_ndjson(self):
+        FriendShip.objects.create(following=self.user, follower=self.user2)
+        response = self.client.get(reverse("accounts:graph_export", args=["ndjson"]))
+        self.assertEqual(response.status_code, 200)
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(
+            [(row["relation"], row["username"]) for row in rows],
+            [("following", "sample2"), ("follower", "sample2")],
+        )
+
+    def test_failure_get_with_unknown_format(self):
+        response = self.client.get(reverse("accounts:graph_export", args=["xml"]))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestDataExportView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="sample2", email="sample2@example.com", password="testpassword2"
+        )
+        self.tweet = Tweet.objects.create(user=self.user, content="hello")
+        self.other = Tweet.objects.create(user=self.user2, content="world")
+        Like.objects.create(target_tweet=self.other, user=self.user)
+        Like.objects.create(target_tweet=self.tweet, user=self.user2)
+        FriendShip.objects.create(following=self.user2, follower=self.user)
+        ArchivedTweet.objects.create(
+            id=1, user=self.user, content="old", created_at=self.tweet.created_at
+        )
+        self.client.force_login(self.user)
+
+    def read(self, archive, name):
+        return [json.loads(line) for line in archive.read(name).splitlines()]
+
+    def test_success_get(self):
+        response = self.client.get(reverse("accounts:data_export"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertIn("sample_data.zip", response["Content-Disposition"])
+        archive = zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(
+            archive.namelist(),
+            [
+                "tweets.ndjson",
+                "archived_tweets.ndjson",
+                "likes.ndjson",
+                "following.ndjson",
+                "followers.ndjson",
+            ],
+        )
+        self.assertEqual(
+            [row["content"] for row in self.read(archive, "tweets.ndjson")], ["hello"]
+        )
+        self.assertEqual(
+            [row["content"] for row in self.read(archive, "archived_tweets.ndjson")],
+            ["old"],
+        )
+        self.assertEqual(
+            [row["tweet_id"] for row in self.read(archive, "likes.ndjson")],
+            [self.other.pk],
+        )
+        self.assertEqual(
+            [row["username"] for row in self.read(archive, "following.ndjson")],
+            ["sample2"],
+        )
+        self.assertEqual(self.read(archive, "followers.ndjson"), [])
+
+    def test_export_is_rate_limited(self):
+        url = reverse("accounts:data_export")
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "1200")
+
+    def test_zip_is_written_in_chunks(self):
+        lines = (f"{i}\n" for i in range(20_000))
+        chunks = list(streaming.zip_chunks([("numbers.txt", lines)], chunk_bytes=1024))
+        self.assertGreater(len(chunks), 2)
+        archive = zipfile.ZipFile(BytesIO(b"".join(chunks)))
+        self.assertEqual(archive.read("numbers.txt").splitlines()[-1], b"19999")
+
+
+class TestSoftDelete(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="sample2", email="sample2@example.com", password="testpassword2"
+        )
+        self.tweet = Tweet.objects.create(user=self.user, content="example_tweet")
+        Like.objects.create(target_tweet=self.tweet, user=self.user2)
+        FriendShip.objects.create(following=self.user, follower=self.user2)
+        inbox.record(
+            [
+                {
+                    "recipient_id": self.user.pk,
+                    "verb": "like",
+                    "tweet_id": self.tweet.pk,
+                    "actor_id": self.user2.pk,
+                }
+            ]
+        )
+
+    def test_tweet_delete_is_deferred(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("tweets:delete", kwargs={"pk": self.tweet.pk})
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Tweet.objects.exists())
+        self.assertTrue(Tweet.all_objects.filter(pk=self.tweet.pk).exists())
+        self.assertTrue(Like.objects.exists())
+
+        call_command("purge_deleted", batch_size=1, stdout=StringIO())
+        self.assertFalse(Tweet.all_objects.exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(inbox.unread_count(self.user), 0)
+
+    def test_account_delete_hides_content(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("accounts:delete"))
+        self.assertRedirects(response, reverse("accounts:login"))
+        self.assertNotIn(SESSION_KEY, self.client.session)
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Tweet.objects.exists())
+
+        self.client.force_login(self.user2)
+        response = self.client.get(
+            reverse("accounts:user_profile", args=[self.user.pk])
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse("accounts:user_profile", args=[self.user2.pk])
+        )
+        self.assertEqual(response.context["followings_num"], 0)
+
+        call_command("purge_deleted", batch_size=1, stdout=StringIO())
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Tweet.all_objects.exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(FriendShip.objects.exists())
+
+
+class TestRelationshipIndex(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(4)
+        ]
+        me, a, b, c = self.users
+        FriendShip.objects.create(follower=me, following=a)
+        FriendShip.objects.create(follower=a, following=me)
+        FriendShip.objects.create(follower=me, following=b)
+        FriendShip.objects.create(follower=c, following=me)
+        FriendShip.objects.create(follower=a, following=b)
+
+    def test_relationships(self):
+        me, a, b, c = self.users
+        relations = graph.relationships(me.pk, [me.pk, a.pk, b.pk, c.pk])
+        self.assertTrue(relations[me.pk].is_self)
+        self.assertTrue(relations[a.pk].mutual)
+        self.assertTrue(relations[b.pk].follows)
+        self.assertFalse(relations[b.pk].followed_by)
+        self.assertTrue(relations[c.pk].followed_by)
+        self.assertFalse(relations[c.pk].follows)
+
+    def test_common_followings(self):
+        me, a, b, c = self.users
+        common = graph.common_followings(me.pk, [a.pk, c.pk])
+        self.assertEqual(common[a.pk], {b.pk})
+        self.assertEqual(common[c.pk], set())
+
+    def test_cached_lookup_and_invalidation(self):
+        me, a, b, c = self.users
+        graph.relationships(me.pk, [c.pk])
+        with self.assertNumQueries(0):
+            graph.relationships(me.pk, [a.pk, b.pk, c.pk])
+        FriendShip.objects.create(follower=me, following=c)
+        self.assertTrue(graph.relationships(me.pk, [c.pk])[c.pk].mutual)
+        FriendShip.objects.filter(follower=me, following=c).delete()
+        self.assertFalse(graph.relationships(me.pk, [c.pk])[c.pk].follows)
+
+    def test_list_shows_badges(self):
+        me, a, b, c = self.users
+        self.client.force_login(me)
+        response = self.client.get(
+            reverse("accounts:follower_list", kwargs={"username": me.username})
+        )
+        content = b"".join(response.streaming_content).decode()
+        self.assertIn("相互フォロー", content)
+        self.assertIn("フォローされています", content)
+
+
+class TestProfileStats(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="sample2", email="sample2@example.com", password="testpassword2"
+        )
+        self.tweet = Tweet.objects.create(user=self.user, content="example_tweet")
+        Tweet.objects.create(user=self.user, content="example_tweet2")
+        Like.objects.create(target_tweet=self.tweet, user=self.user2)
+        FriendShip.objects.create(following=self.user, follower=self.user2)
+        self.client.force_login(self.user2)
+
+    def test_stats_in_one_query(self):
+        stats.invalidate(self.user.pk)
+        with self.assertNumQueries(1):
+            result = stats.get(self.user.pk)
+        self.assertEqual(
+            result,
+            {
+                "tweet_count": 2,
+                "follower_count": 1,
+                "following_count": 0,
+                "likes_received": 1,
+            },
+        )
+        with self.assertNumQueries(0):
+            stats.get(self.user.pk)
+
+    def test_stats_include_archived_tweets(self):
+        Tweet.objects.filter(pk=self.tweet.pk).update(
+            created_at=timezone.now() - timedelta(days=400)
+        )
+        call_command("archive_tweets", stdout=None)
+        self.assertEqual(Tweet.objects.filter(user=self.user).count(), 1)
+        stats.invalidate(self.user.pk)
+        result = stats.get(self.user.pk)
+        self.assertEqual(result["tweet_count"], 2)
+        self.assertEqual(result["likes_received"], 1)
+
+    def test_stats_are_invalidated_by_writes(self):
+        self.assertEqual(stats.get(self.user.pk)["likes_received"], 1)
+        self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(stats.get(self.user.pk)["likes_received"], 0)
+        self.tweet.soft_delete()
+        self.assertEqual(stats.get(self.user.pk)["tweet_count"], 1)
+
+    def test_success_get_json(self):
+        response = self.client.get(
+            reverse("accounts:user_profile_stats", args=[self.user.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["tweet_count"], 2)
+        self.assertEqual(data["follower_count"], 1)
+        self.assertTrue(data["relationship"]["follows"])
+        self.assertFalse(data["relationship"]["mutual"])
+
+    def test_failure_get_with_not_exist_user(self):
+        response = self.client.get(reverse("accounts:user_profile_stats", args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestBlockMute(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="sample2", email="sample2@example.com", password="testpassword2"
+        )
+        FriendShip.objects.create(follower=self.user, following=self.user2)
+        FriendShip.objects.create(follower=self.user2, following=self.user)
+        self.tweet = Tweet.objects.create(user=self.user, content="mine")
+        self.tweet2 = Tweet.objects.create(user=self.user2, content="theirs")
+        self.client.force_login(self.user)
+
+    def home_tweets(self):
+        return list(self.client.get(reverse("accounts:home")).context["tweets"])
+
+    def test_viewer_filter(self):
+        viewer_filter = visibility.ViewerFilter(blocked=[5, 3], muted=[9])
+        self.assertIn(3, viewer_filter)
+        self.assertIn(9, viewer_filter)
+        self.assertNotIn(4, viewer_filter)
+        self.assertTrue(viewer_filter.is_blocked(5))
+        self.assertFalse(viewer_filter.is_blocked(9))
+        self.assertFalse(visibility.EMPTY)
+
+    def test_block_hides_both_ways_and_unfollows(self):
+        self.client.post(reverse("accounts:block", kwargs={"username": "sample2"}))
+        self.assertFalse(FriendShip.objects.exists())
+        self.assertEqual(self.home_tweets(), [self.tweet])
+
+        self.client.force_login(self.user2)
+        self.assertEqual(self.home_tweets(), [self.tweet2])
+        response = self.client.get(reverse("tweets:detail", args=[self.tweet.pk]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse("accounts:user_profile", args=[self.user.pk])
+        )
+        self.assertTrue(response.context["blocked"])
+        self.assertEqual(response.context["tweets"], [])
+        self.client.post(reverse("accounts:follow", kwargs={"username": "sample"}))
+        self.assertFalse(FriendShip.objects.exists())
+
+    def test_unblock_restores_timeline(self):
+        self.client.post(reverse("accounts:block", kwargs={"username": "sample2"}))
+        self.client.post(reverse("accounts:unblock", kwargs={"username": "sample2"}))
+        self.assertEqual(self.home_tweets(), [self.tweet2, self.tweet])
+
+    def test_mute_hides_only_for_muter(self):
+        self.client.post(reverse("accounts:mute", kwargs={"username": "sample2"}))
+        self.assertEqual(self.home_tweets(), [self.tweet])
+        response = self.client.get(reverse("accounts:follower_list", args=["sample"]))
+        self.assertNotContains(response, "sample2")
+        response = self.client.get(reverse("tweets:detail", args=[self.tweet2.pk]))
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_login(self.user2)
+        self.assertEqual(self.home_tweets(), [self.tweet2, self.tweet])
+
+    @override_settings(FEED_CANDIDATE_LIMIT=2)
+    def test_home_overfetches_to_fill_page(self):
+        Tweet.objects.create(user=self.user2, content="theirs2")
+        Tweet.objects.create(user=self.user2, content="theirs3")
+        mine2 = Tweet.objects.create(user=self.user, content="mine2")
+        Tweet.objects.create(user=self.user2, content="theirs4")
+        Mute.objects.create(muter=self.user, muted=self.user2)
+        # 新しい 2 件のうち見えるのは 1 件だけなので、読み足して 2 件にする
+        self.assertEqual(self.home_tweets(), [mine2, self.tweet])
@@ -20,7 +20,17 @@ urlpatterns = [
     ),
     # path('', include('django.contrib.auth.urls')),
     path("profile/<int:pk>/", views.UserProfileView.as_view(), name="user_profile"),
+    path(
+        "profile/<int:pk>/stats/",
+        views.ProfileStatsView.as_view(),
+        name="user_profile_stats",
+    ),
     # path('profile/edit/', views.UserProfileEditView.as_view(), name='user_profile_edit'),
+    path("delete/", views.AccountDeleteView.as_view(), name="delete"),
+    path(
+        "export/graph.<str:fmt>", views.GraphExportView.as_view(), name="graph_export"
+    ),
+    path("export/data.zip", views.DataExportView.as_view(), name="data_export"),
     path(
         "<str:username>/following_list/",
         views.FollowingListView.as_view(),
@@ -33,4 +43,8 @@ urlpatterns = [
     ),
     path("<str:username>/follow/", views.FollowView.as_view(), name="follow"),
     path("<str:username>/unfollow/", views.UnFollowView.as_view(), name="unfollow"),
+    path("<str:username>/block/", views.BlockView.as_view(), name="block"),
+    path("<str:username>/unblock/", views.UnBlockView.as_view(), name="unblock"),
+    path("<str:username>/mute/", views.MuteView.as_view(), name="mute"),
+    path("<str:username>/unmute/", views.UnMuteView.as_view(), name="unmute"),
 ]
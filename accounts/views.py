@@ -1,15 +1,34 @@
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import login
+from django.contrib.auth import login, logout
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseRedirect
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Q, Value
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse_lazy
-from django.views.generic import CreateView, DetailView, ListView, TemplateView
-
-from tweets.models import Tweet
-
+from django.views import View
+from django.views.generic import CreateView, DetailView, TemplateView
+
+from core.overload import StaleWhileRevalidateMixin
+from jobs import queue
+from notifications.tasks import notify
+from outbox import events
+from tweets import ranking, shards, timeline
+from tweets.archive import UserTimeline
+from tweets.models import ArchivedLike, ArchivedTweet, Like, Tweet
+
+from . import graph, home, stats, visibility
 from .forms import SignupForm
-from .models import FriendShip, User
+from .models import Block, FriendShip, Mute, User
+from .streaming import (
+    EXPORT_FORMATS,
+    ndjson_lines,
+    stream_export,
+    stream_template,
+    stream_zip,
+)
 
 
 class SignupView(CreateView):
@@ -28,17 +47,47 @@ class SignupView(CreateView):
         return response
 
 
-class HomeView(ListView):
-    template_name = "accounts/home.html"
-    context_object_name = "tweets"
-    model = Tweet
-    # queryset = Tweet.objects.select_related("user").order_by("-created_at")
+class HomeView(StaleWhileRevalidateMixin, TemplateView):
+    template_name = home.TEMPLATE_NAME
+
+    def get_feed_order(self):
+        # ?order= で切り替えて、選んだ並び順はセッションに覚えておく
+        order = self.request.GET.get("order")
+        if order in ranking.ORDERS:
+            self.request.session["feed_order"] = order
+        return self.request.session.get("feed_order", ranking.CHRONOLOGICAL)
+
+    def get_page_number(self):
+        # ページを分けるのはおすすめ順だけ
+        if self.get_feed_order() != ranking.RANKED:
+            return 1
+        try:
+            return max(int(self.request.GET.get("page", 1)), 1)
+        except ValueError:
+            raise Http404
+
+    def get_stale_key(self):
+        return home.stale_key(
+            self.request.user.pk, self.get_feed_order(), self.get_page_number()
+        )
+
+    def refresh_stale(self):
+        queue.enqueue(
+            "accounts.refresh_home_page",
+            {
+                "user_id": self.request.user.pk,
+                "order": self.get_feed_order(),
+                "page": self.get_page_number(),
+            },
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_list"] = self.request.user.like_set.values_list(
-            "target_tweet", flat=True
-        )  # fllatでリスト化している
+        context.update(
+            home.get_context(
+                self.request.user, self.get_feed_order(), self.get_page_number()
+            )
+        )
         return context
 
 
@@ -53,18 +102,29 @@ class FollowView(LoginRequiredMixin, TemplateView):
     def post(self, request, *args, **kwargs):
 
         follower = self.request.user
-        following = get_object_or_404(User, username=self.kwargs["username"])
+        following = get_object_or_404(
+            User, username=self.kwargs["username"], deleted_at__isnull=True
+        )
 
         if following == follower:
             messages.warning(request, "自分自身はフォローできません。")
             return render(request, "accounts/follow.html")
+        elif visibility.is_blocked(follower.pk, following.pk):
+            messages.warning(request, "このユーザーはフォローできません。")
+            return render(request, "accounts/follow.html")
         elif FriendShip.objects.filter(following=following, follower=follower).exists():
             messages.warning(request, "すでにフォローしています。")
             return render(request, "accounts/follow.html")
 
-        created = FriendShip.objects.create(following=following, follower=follower)
+        with transaction.atomic():
+            created = FriendShip.objects.create(following=following, follower=follower)
+            events.follow_changed(events.FOLLOW_CREATED, created)
         if not created:
             messages.warning(request, "すでにフォローしています。")
+        else:
+            notify.enqueue(
+                recipient_id=following.pk, verb="follow", actor_id=follower.pk
+            )
         return HttpResponseRedirect(reverse_lazy("accounts:home"))
 
 
@@ -75,9 +135,10 @@ class UnFollowView(LoginRequiredMixin, TemplateView):
 
         follower = User.objects.get(username=request.user.username)
         following = get_object_or_404(User, username=self.kwargs["username"])
-        deleted = FriendShip.objects.filter(
-            following=following, follower=follower
-        ).delete()
+        with transaction.atomic():
+            deleted = events.delete_follows(
+                FriendShip.objects.filter(following=following, follower=follower)
+            )
 
         if deleted[1].get("accounts.FriendShip") == 1:
             return HttpResponseRedirect(reverse_lazy("accounts:home"))
@@ -85,47 +146,319 @@ class UnFollowView(LoginRequiredMixin, TemplateView):
         return render(request, "accounts/unfollow.html")
 
 
-class FollowingListView(LoginRequiredMixin, TemplateView):
-    template_name = "accounts/following_list.html"
+class FriendShipListMixin:
+    # フォロー/フォロワーが大量でも全件をメモリに載せないよう、一覧部分を分割して流す
+    rows_template_name = None
+    context_object_name = None
+    # 一覧に並べる相手の側 ("following" / "follower") と、URL の username の側
+    user_field = None
+    owner_field = None
+
+    @property
+    def user_id_field(self):
+        return f"{self.user_field}_id"
+
+    def get_queryset(self):
+        # 退会した人は出さない。並びは FriendShip の id 順 (ストリーミングで分割するため)
+        return (
+            FriendShip.objects.select_related(self.user_field)
+            .filter(
+                **{
+                    f"{self.owner_field}__username": self.kwargs["username"],
+                    f"{self.user_field}__deleted_at__isnull": True,
+                }
+            )
+            .order_by("pk")
+        )
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx["my_followings"] = FriendShip.objects.select_related("following").filter(
-            follower__username=self.kwargs["username"]
-        )
-        # 自分のフォローしている人を取得
+        ctx[self.context_object_name] = self.get_queryset()
         return ctx
 
+    def prepare_rows(self, rows):
+        # ブロック・ミュートした人の行はその場で除く (ストリーミング時は chunk ごと)
+        hidden = visibility.for_viewer(self.request.user.pk)
+        if hidden:
+            rows[:] = [
+                row for row in rows if getattr(row, self.user_id_field) not in hidden
+            ]
+        self.attach_relationships(rows)
+
+    def attach_relationships(self, rows):
+        # 各行に閲覧者との関係 (フォロー中・相互など) を付ける。クエリは増えない
+        relations = graph.relationships(
+            self.request.user.pk, [getattr(row, self.user_id_field) for row in rows]
+        )
+        for row in rows:
+            row.relationship = relations[getattr(row, self.user_id_field)]
+
+    def render_to_response(self, context, **response_kwargs):
+        if not settings.FRIENDSHIP_LIST_STREAMING:
+            rows = list(context[self.context_object_name])
+            self.prepare_rows(rows)
+            context[self.context_object_name] = rows
+            return super().render_to_response(context, **response_kwargs)
+        queryset = context.pop(self.context_object_name)
+        return stream_template(
+            self.request,
+            self.template_name,
+            context,
+            self.rows_template_name,
+            self.context_object_name,
+            queryset,
+            chunk_size=settings.FRIENDSHIP_LIST_CHUNK_SIZE,
+            prepare_rows=self.prepare_rows,
+        )
 
-class FollowerListView(LoginRequiredMixin, TemplateView):
+
+class FollowingListView(LoginRequiredMixin, FriendShipListMixin, TemplateView):
+    template_name = "accounts/following_list.html"
+    rows_template_name = "accounts/following_rows.html"
+    context_object_name = "my_followings"
+    # 自分のフォローしている人を取得
+    user_field = "following"
+    owner_field = "follower"
+
+
+class FollowerListView(LoginRequiredMixin, FriendShipListMixin, TemplateView):
     template_name = "accounts/follower_list.html"
+    rows_template_name = "accounts/follower_rows.html"
+    context_object_name = "my_followers"
+    user_field = "follower"
+    owner_field = "following"
+
+
+class GraphExportView(LoginRequiredMixin, View):
+    # 自分のフォロー/フォロワーを CSV か NDJSON で書き出す
+    header = ("relation", "user_id", "username", "created_date")
+
+    def get(self, request, *args, **kwargs):
+        fmt = kwargs["fmt"]
+        if fmt not in EXPORT_FORMATS:
+            raise Http404
+        return stream_export(
+            fmt, f"{request.user.username}_graph", self.header, self.rows()
+        )
 
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx["my_followers"] = FriendShip.objects.select_related("follower").filter(
-            following__username=self.kwargs["username"]
+    def rows(self):
+        user = self.request.user
+        chunk_size = settings.FRIENDSHIP_LIST_CHUNK_SIZE
+        followings = (
+            FriendShip.objects.filter(follower=user)
+            .order_by("pk")
+            .values_list(
+                Value("following"),
+                "following_id",
+                "following__username",
+                "created_date",
+            )
         )
-        return ctx
+        followers = (
+            FriendShip.objects.filter(following=user)
+            .order_by("pk")
+            .values_list(
+                Value("follower"), "follower_id", "follower__username", "created_date"
+            )
+        )
+        yield from followings.iterator(chunk_size=chunk_size)
+        yield from followers.iterator(chunk_size=chunk_size)
+
+
+class DataExportView(LoginRequiredMixin, View):
+    # 自分のツイート・いいね・フォロー/フォロワーを NDJSON にまとめた zip で書き出す。
+    # どれも .iterator() で少しずつ読み、zip も少しずつ組み立てて流す
+    def get(self, request, *args, **kwargs):
+        return stream_zip(f"{request.user.username}_data", self.members())
+
+    def rows(self, *querysets):
+        chunk_size = settings.DATA_EXPORT_CHUNK_SIZE
+        for queryset in querysets:
+            yield from queryset.iterator(chunk_size=chunk_size)
+
+    def members(self):
+        user = self.request.user
+        archive_db = settings.TWEET_ARCHIVE_DATABASE
+        header = (
+            "id",
+            "content",
+            "created_at",
+            "parent_id",
+            "reply_count",
+            "retweet_count",
+        )
+        tweets = (
+            Tweet.objects.using(shards.for_user(user.pk))
+            .filter(user=user)
+            .order_by("pk")
+            .values_list(*header)
+        )
+        yield "tweets.ndjson", ndjson_lines(header, self.rows(tweets))
+        # アーカイブは移したときの件数をそのまま持っている
+        header += ("like_count",)
+        archived = (
+            ArchivedTweet.objects.using(archive_db)
+            .filter(user_id=user.pk)
+            .order_by("pk")
+            .values_list(*header)
+        )
+        yield "archived_tweets.ndjson", ndjson_lines(header, self.rows(archived))
+        # いいねは対象のツイートのシャードにあるので全シャードから集める
+        likes = Like.objects.filter(user=user).order_by("pk")
+        archived_likes = ArchivedLike.objects.using(archive_db).filter(user_id=user.pk)
+        yield "likes.ndjson", ndjson_lines(
+            ("tweet_id", "created_at"),
+            self.rows(
+                *shards.scatter(likes.values_list("target_tweet_id", "created_at")),
+                archived_likes.order_by("pk").values_list(
+                    "target_tweet_id", "created_at"
+                ),
+            ),
+        )
+        followings = (
+            FriendShip.objects.filter(follower=user)
+            .order_by("pk")
+            .values_list("following_id", "following__username", "created_date")
+        )
+        followers = (
+            FriendShip.objects.filter(following=user)
+            .order_by("pk")
+            .values_list("follower_id", "follower__username", "created_date")
+        )
+        header = ("user_id", "username", "created_date")
+        yield "following.ndjson", ndjson_lines(header, self.rows(followings))
+        yield "followers.ndjson", ndjson_lines(header, self.rows(followers))
 
 
 class UserProfileView(LoginRequiredMixin, DetailView):
     template_name = "accounts/profile.html"
-    model = User
+    queryset = User.objects.filter(deleted_at__isnull=True)
     context_object_name = "profile"
 
     def get_context_data(self, **kwargs):
         user = self.object
 
         ctx = super().get_context_data(**kwargs)
-        ctx["tweets"] = (
-            Tweet.objects.select_related("user")
-            .filter(user=user)
-            .order_by("-created_at")
-        )
-        ctx["followings_num"] = FriendShip.objects.filter(follower=user).count()
-        ctx["followers_num"] = FriendShip.objects.filter(following=user).count()
-        ctx["connected"] = FriendShip.objects.filter(
-            following=user, follower=self.request.user
+        viewer_filter = visibility.for_viewer(self.request.user.pk)
+        ctx["blocking"] = Block.objects.filter(
+            blocker=self.request.user, blocked=user
+        ).exists()
+        ctx["muting"] = Mute.objects.filter(
+            muter=self.request.user, muted=user
         ).exists()
+        ctx["relationship"] = graph.relationships(self.request.user.pk, [user.pk])[
+            user.pk
+        ]
+        ctx["connected"] = ctx["relationship"].follows
+        ctx["stats"] = stats.get(user.pk)
+        ctx["followings_num"] = ctx["stats"]["following_count"]
+        ctx["followers_num"] = ctx["stats"]["follower_count"]
+        # ブロックしている (されている) 相手のツイートは出さない
+        ctx["blocked"] = viewer_filter.is_blocked(user.pk)
+        if ctx["blocked"]:
+            ctx["tweets"] = []
+            return ctx
+        # 古いツイートはアーカイブから続けて表示する
+        paginator = Paginator(UserTimeline(user), settings.PROFILE_TWEETS_PER_PAGE)
+        page_obj = paginator.get_page(self.request.GET.get("page"))
+        tweets = list(page_obj.object_list)
+        # 前のページの最後のツイートからこのページの最後のツイートまでの間の
+        # リツイートを差し込む (ページの境目で重なったり抜けたりしない)
+        newer_than = older_than = None
+        if page_obj.has_next():
+            newer_than = tweets[-1].created_at
+        if page_obj.has_previous():
+            previous = paginator.object_list[page_obj.start_index() - 2]
+            older_than = previous.created_at
+        ctx["page_obj"] = page_obj
+        ctx["tweets"] = timeline.with_retweets(
+            user, tweets, newer_than, older_than, viewer_filter
+        )
 
         return ctx
+
+
+class BlockView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        blocker = request.user
+        blocked = get_object_or_404(
+            User, username=self.kwargs["username"], deleted_at__isnull=True
+        )
+        if blocked == blocker:
+            messages.warning(request, "自分自身はブロックできません。")
+            return render(request, "accounts/follow.html")
+        # ブロックしたらお互いのフォローも外す
+        with transaction.atomic():
+            Block.objects.get_or_create(blocker=blocker, blocked=blocked)
+            events.delete_follows(
+                FriendShip.objects.filter(
+                    Q(follower=blocker, following=blocked)
+                    | Q(follower=blocked, following=blocker)
+                )
+            )
+        return HttpResponseRedirect(
+            reverse_lazy("accounts:user_profile", kwargs={"pk": blocked.pk})
+        )
+
+
+class UnBlockView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        blocked = get_object_or_404(User, username=self.kwargs["username"])
+        Block.objects.filter(blocker=request.user, blocked=blocked).delete()
+        return HttpResponseRedirect(
+            reverse_lazy("accounts:user_profile", kwargs={"pk": blocked.pk})
+        )
+
+
+class MuteView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        muted = get_object_or_404(
+            User, username=self.kwargs["username"], deleted_at__isnull=True
+        )
+        if muted == request.user:
+            messages.warning(request, "自分自身はミュートできません。")
+            return render(request, "accounts/follow.html")
+        Mute.objects.get_or_create(muter=request.user, muted=muted)
+        return HttpResponseRedirect(
+            reverse_lazy("accounts:user_profile", kwargs={"pk": muted.pk})
+        )
+
+
+class UnMuteView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        muted = get_object_or_404(User, username=self.kwargs["username"])
+        Mute.objects.filter(muter=request.user, muted=muted).delete()
+        return HttpResponseRedirect(
+            reverse_lazy("accounts:user_profile", kwargs={"pk": muted.pk})
+        )
+
+
+class ProfileStatsView(LoginRequiredMixin, View):
+    def get(self, request, *args, **kwargs):
+        profile_stats = stats.get(kwargs["pk"])
+        if profile_stats is None:
+            raise Http404
+        relationship = graph.relationships(request.user.pk, [kwargs["pk"]])[
+            kwargs["pk"]
+        ]
+        return JsonResponse(
+            {
+                "user_id": kwargs["pk"],
+                **profile_stats,
+                "relationship": {
+                    "follows": relationship.follows,
+                    "followed_by": relationship.followed_by,
+                    "mutual": relationship.mutual,
+                },
+            }
+        )
+
+
+class AccountDeleteView(LoginRequiredMixin, TemplateView):
+    # 退会はフラグを立てるだけにして、データは purge_deleted コマンドで消す
+    template_name = "accounts/account_delete.html"
+
+    def post(self, request, *args, **kwargs):
+        request.user.soft_delete()
+        logout(request)
+        return HttpResponseRedirect(reverse_lazy("accounts:login"))
@@ -0,0 +1,132 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core import invalidation
+
+from .models import Block, Mute
+
+
+class SortedIds:
+    # ソート済みの int64 の配列。in は二分探索で、1 件 8 バイトしか使わない
+    __slots__ = ("ids",)
+
+    def __init__(self, ids=()):
+        self.ids = array("q", sorted(set(ids)))
+
+    def __contains__(self, user_id):
+        i = bisect_left(self.ids, user_id)
+        return i < len(self.ids) and self.ids[i] == user_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+
+class ViewerFilter:
+    # 閲覧者から見えないユーザー。hidden はブロック (どちら向きでも) とミュート、
+    # blocked はブロックだけ
+    __slots__ = ("hidden", "blocked")
+
+    def __init__(self, blocked=(), muted=()):
+        self.blocked = SortedIds(blocked)
+        self.hidden = SortedIds([*blocked, *muted])
+
+    def __contains__(self, user_id):
+        return user_id in self.hidden
+
+    def __bool__(self):
+        return len(self.hidden) > 0
+
+    def is_blocked(self, user_id):
+        return user_id in self.blocked
+
+    def keep_tweet(self, tweet):
+        return tweet.user_id not in self.hidden
+
+    def keep_retweet(self, retweet):
+        return (
+            retweet.user_id not in self.hidden
+            and retweet.tweet.user_id not in self.hidden
+        )
+
+
+EMPTY = ViewerFilter()
+
+
+class FilterCache:
+    # viewer_id -> ViewerFilter。graph.AdjacencyCache と同じく
+    # プロセスごとに持ち、TTL と件数上限で古いものを捨てる
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, viewer_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(viewer_id)
+            if entry is not None and now - entry[1] < settings.RELATIONSHIP_CACHE_TTL:
+                self.entries.move_to_end(viewer_id)
+                return entry[0]
+        viewer_filter = self.load(viewer_id)
+        with self.lock:
+            self.entries[viewer_id] = (viewer_filter, now)
+            self.entries.move_to_end(viewer_id)
+            while len(self.entries) > settings.RELATIONSHIP_CACHE_MAX_ENTRIES:
+                self.entries.popitem(last=False)
+        return viewer_filter
+
+    def load(self, viewer_id):
+        blocking = Block.objects.filter(blocker_id=viewer_id).values_list(
+            "blocked_id", flat=True
+        )
+        blocked_by = Block.objects.filter(blocked_id=viewer_id).values_list(
+            "blocker_id", flat=True
+        )
+        muting = Mute.objects.filter(muter_id=viewer_id).values_list(
+            "muted_id", flat=True
+        )
+        blocked = [*blocking.iterator(), *blocked_by.iterator()]
+        muted = list(muting.iterator())
+        if not blocked and not muted:
+            return EMPTY
+        return ViewerFilter(blocked, muted)
+
+    def invalidate(self, *viewer_ids):
+        with self.lock:
+            for viewer_id in viewer_ids:
+                self.entries.pop(viewer_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+filters = FilterCache()
+
+
+def for_viewer(viewer_id):
+    if viewer_id is None:
+        return EMPTY
+    return filters.get(viewer_id)
+
+
+def is_blocked(user_id, other_id):
+    return for_viewer(user_id).is_blocked(other_id)
+
+
+def invalidate(*viewer_ids):
+    invalidation.publish("visibility", *viewer_ids)
+
+
+def clear():
+    filters.clear()
+
+
+invalidation.subscribe("visibility", filters.invalidate, filters.clear)
@@ -0,0 +1,37 @@
+from django.contrib import admin
+
+from .models import TweetRollup, UserRollup, Watermark
+
+# 管理画面は集計テーブルだけを読む (元のテーブルは数えない)
+
+
+class RollupAdmin(admin.ModelAdmin):
+    date_hierarchy = "bucket"
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(UserRollup)
+class UserRollupAdmin(RollupAdmin):
+    list_display = ("bucket", "period", "user_id", "metric", "count")
+    list_filter = ("period", "metric")
+    search_fields = ("=user_id",)
+    ordering = ("-bucket", "-count")
+
+
+@admin.register(TweetRollup)
+class TweetRollupAdmin(RollupAdmin):
+    list_display = ("bucket", "period", "tweet_id", "author_id", "likes")
+    list_filter = ("period",)
+    search_fields = ("=tweet_id", "=author_id")
+    ordering = ("-bucket", "-likes")
+
+
+@admin.register(Watermark)
+class WatermarkAdmin(admin.ModelAdmin):
+    list_display = ("source", "last_time", "last_id")
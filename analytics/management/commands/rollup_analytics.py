@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from analytics import rollup
+
+
+class Command(BaseCommand):
+    help = "前回の続きからツイート・いいね・フォローを時間別/日別に集計する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lag-seconds",
+            type=int,
+            default=settings.ANALYTICS_ROLLUP_LAG_SECONDS,
+            help="直近この秒数の分は次回に回す",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.ANALYTICS_ROLLUP_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        totals = rollup.run(
+            lag=timedelta(seconds=options["lag_seconds"]),
+            batch_size=options["batch_size"],
+        )
+        for source, total in totals.items():
+            self.stdout.write(f"{source}: {total} 件")
+        self.stdout.write(self.style.SUCCESS("完了"))
@@ -0,0 +1,109 @@
+# Generated by Django 4.0.10 on 2026-10-19 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="TweetRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("hour", "1時間"), ("day", "1日")], max_length=4
+                    ),
+                ),
+                ("bucket", models.DateTimeField()),
+                ("tweet_id", models.BigIntegerField()),
+                ("author_id", models.BigIntegerField()),
+                ("likes", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="UserRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("hour", "1時間"), ("day", "1日")], max_length=4
+                    ),
+                ),
+                ("bucket", models.DateTimeField()),
+                ("user_id", models.BigIntegerField()),
+                (
+                    "metric",
+                    models.CharField(
+                        choices=[
+                            ("tweets", "ツイート"),
+                            ("likes_given", "いいねした"),
+                            ("likes_received", "いいねされた"),
+                            ("follows_given", "フォローした"),
+                            ("follows_gained", "フォローされた"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Watermark",
+            fields=[
+                (
+                    "source",
+                    models.CharField(max_length=20, primary_key=True, serialize=False),
+                ),
+                ("last_time", models.DateTimeField()),
+                ("last_id", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="userrollup",
+            index=models.Index(
+                fields=["user_id", "period", "bucket"], name="user_rollup_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="userrollup",
+            constraint=models.UniqueConstraint(
+                fields=("period", "bucket", "user_id", "metric"),
+                name="user_rollup_unique",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tweetrollup",
+            index=models.Index(
+                fields=["period", "bucket", "-likes"], name="tweet_rollup_top_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="tweetrollup",
+            constraint=models.UniqueConstraint(
+                fields=("period", "bucket", "tweet_id"), name="tweet_rollup_unique"
+            ),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import models
+
+# 集計済みの件数。元のツイートやユーザーが消えても残すので、外部キーにはしない
+
+
+class Period(models.TextChoices):
+    HOUR = "hour", "1時間"
+    DAY = "day", "1日"
+
+
+class UserRollup(models.Model):
+    class Metric(models.TextChoices):
+        TWEETS = "tweets", "ツイート"
+        LIKES_GIVEN = "likes_given", "いいねした"
+        LIKES_RECEIVED = "likes_received", "いいねされた"
+        FOLLOWS_GIVEN = "follows_given", "フォローした"
+        FOLLOWS_GAINED = "follows_gained", "フォローされた"
+
+    period = models.CharField(max_length=4, choices=Period.choices)
+    bucket = models.DateTimeField()
+    user_id = models.BigIntegerField()
+    metric = models.CharField(max_length=20, choices=Metric.choices)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["period", "bucket", "user_id", "metric"],
+                name="user_rollup_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user_id", "period", "bucket"], name="user_rollup_idx"
+            ),
+        ]
+
+
+class TweetRollup(models.Model):
+    period = models.CharField(max_length=4, choices=Period.choices)
+    bucket = models.DateTimeField()
+    tweet_id = models.BigIntegerField()
+    author_id = models.BigIntegerField()
+    likes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["period", "bucket", "tweet_id"], name="tweet_rollup_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["period", "bucket", "-likes"], name="tweet_rollup_top_idx"
+            ),
+        ]
+
+
+class Watermark(models.Model):
+    # どこまで集計したか。(created_at, id) の組で持ち、同じ時刻の行も取りこぼさない
+    source = models.CharField(max_length=20, primary_key=True)
+    last_time = models.DateTimeField()
+    last_id = models.BigIntegerField(default=0)
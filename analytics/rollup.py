@@ -0,0 +1,154 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from tweets import shards
+from tweets.models import Like, Tweet
+
+from .models import Period, TweetRollup, UserRollup, Watermark
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+Metric = UserRollup.Metric
+
+
+def buckets(created):
+    local = timezone.localtime(created)
+    hour = local.replace(minute=0, second=0, microsecond=0)
+    return ((Period.HOUR, hour), (Period.DAY, hour.replace(hour=0)))
+
+
+def tweet_events(row):
+    yield Metric.TWEETS, row["user_id"]
+
+
+def like_events(row):
+    yield Metric.LIKES_GIVEN, row["user_id"]
+    yield Metric.LIKES_RECEIVED, row["target_tweet__user_id"]
+
+
+def follow_events(row):
+    yield Metric.FOLLOWS_GIVEN, row["follower_id"]
+    yield Metric.FOLLOWS_GAINED, row["following_id"]
+
+
+# source 名 -> (クエリセット, 時刻の列, 取り出す列, イベント)
+SOURCES = {
+    "tweets": (
+        lambda: Tweet.all_objects.all(),
+        "created_at",
+        ("user_id",),
+        tweet_events,
+    ),
+    "likes": (
+        lambda: Like.objects.all(),
+        "created_at",
+        ("user_id", "target_tweet_id", "target_tweet__user_id"),
+        like_events,
+    ),
+    "follows": (
+        lambda: FriendShip.objects.all(),
+        "created_date",
+        ("follower_id", "following_id"),
+        follow_events,
+    ),
+}
+
+
+# ツイートといいねはシャードごとに読む。集計と watermark は default に置く
+SHARDED_SOURCES = {"tweets", "likes"}
+
+
+def source_aliases(source):
+    return shards.aliases() if source in SHARDED_SOURCES else ["default"]
+
+
+def watermark_key(source, alias):
+    # default の分は今までどおり source 名だけ
+    return source if alias == "default" else f"{source}:{alias}"
+
+
+def add_counts(model, counts, field, defaults=None):
+    defaults = defaults or {}
+    for key, n in counts.items():
+        updated = model.objects.filter(**dict(key)).update(**{field: F(field) + n})
+        if not updated:
+            model.objects.create(**dict(key), **defaults.get(key, {}), **{field: n})
+
+
+def rollup_batch(source, until, batch_size, alias="default"):
+    # watermark より後で until 以前の行を最大 batch_size 件だけ集計する
+    # 集計と watermark の更新は同じトランザクションなので、二重に数えない
+    queryset, time_field, columns, events = SOURCES[source]
+    with transaction.atomic():
+        watermark, _ = Watermark.objects.select_for_update().get_or_create(
+            source=watermark_key(source, alias), defaults={"last_time": EPOCH}
+        )
+        rows = list(
+            queryset()
+            .using(alias)
+            .filter(
+                Q(**{f"{time_field}__gt": watermark.last_time})
+                | Q(**{time_field: watermark.last_time, "pk__gt": watermark.last_id}),
+                **{f"{time_field}__lte": until},
+            )
+            .order_by(time_field, "pk")
+            .values("pk", time_field, *columns)[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        user_counts = Counter()
+        tweet_counts = Counter()
+        authors = {}
+        for row in rows:
+            for period, bucket in buckets(row[time_field]):
+                for metric, user_id in events(row):
+                    key = (
+                        ("period", period),
+                        ("bucket", bucket),
+                        ("user_id", user_id),
+                        ("metric", metric),
+                    )
+                    user_counts[key] += 1
+                if source == "likes":
+                    key = (
+                        ("period", period),
+                        ("bucket", bucket),
+                        ("tweet_id", row["target_tweet_id"]),
+                    )
+                    tweet_counts[key] += 1
+                    authors[key] = {"author_id": row["target_tweet__user_id"]}
+
+        add_counts(UserRollup, user_counts, "count")
+        add_counts(TweetRollup, tweet_counts, "likes", authors)
+        last = rows[-1]
+        watermark.last_time = last[time_field]
+        watermark.last_id = last["pk"]
+        watermark.save()
+    return len(rows)
+
+
+def run(lag=None, batch_size=None, now=None):
+    # 書き込み中のトランザクションが後からコミットされても拾えるよう、
+    # 直近 lag の分は次回に回す
+    if lag is None:
+        lag = timedelta(seconds=settings.ANALYTICS_ROLLUP_LAG_SECONDS)
+    batch_size = batch_size or settings.ANALYTICS_ROLLUP_BATCH_SIZE
+    until = (now or timezone.now()) - lag
+    totals = {}
+    for source in SOURCES:
+        total = 0
+        for alias in source_aliases(source):
+            while True:
+                done = rollup_batch(source, until, batch_size, alias)
+                total += done
+                if done < batch_size:
+                    break
+        totals[source] = total
+    return totals
@@ -0,0 +1,111 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from tweets.models import Like, Tweet
+
+from . import rollup
+from .models import Period, TweetRollup, UserRollup, Watermark
+
+User = get_user_model()
+
+
+class TestAnalyticsRollup(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.fan = User.objects.create_user(
+            username="fan", email="fan@example.com", password="testpassword"
+        )
+        self.tweet = Tweet.objects.create(user=self.user, content="example_tweet")
+        Like.objects.create(user=self.fan, target_tweet=self.tweet)
+        FriendShip.objects.create(follower=self.fan, following=self.user)
+        self.later = timezone.now() + timedelta(minutes=5)
+
+    def count(self, user, metric, period=Period.DAY):
+        return sum(
+            UserRollup.objects.filter(
+                user_id=user.pk, metric=metric, period=period
+            ).values_list("count", flat=True)
+        )
+
+    def test_rollup_counts_events(self):
+        totals = rollup.run(now=self.later)
+        self.assertEqual(totals, {"tweets": 1, "likes": 1, "follows": 1})
+        Metric = UserRollup.Metric
+        for period in Period.values:
+            self.assertEqual(self.count(self.user, Metric.TWEETS, period), 1)
+            self.assertEqual(self.count(self.user, Metric.LIKES_RECEIVED, period), 1)
+            self.assertEqual(self.count(self.user, Metric.FOLLOWS_GAINED, period), 1)
+            self.assertEqual(self.count(self.fan, Metric.LIKES_GIVEN, period), 1)
+            self.assertEqual(self.count(self.fan, Metric.FOLLOWS_GIVEN, period), 1)
+        tweet_rollup = TweetRollup.objects.get(period=Period.DAY)
+        self.assertEqual(tweet_rollup.tweet_id, self.tweet.pk)
+        self.assertEqual(tweet_rollup.author_id, self.user.pk)
+        self.assertEqual(tweet_rollup.likes, 1)
+
+    def test_rerun_only_adds_new_rows(self):
+        rollup.run(now=self.later)
+        self.assertEqual(
+            rollup.run(now=self.later), {"tweets": 0, "likes": 0, "follows": 0}
+        )
+        other = User.objects.create_user(username="other", email="other@example.com")
+        Like.objects.create(user=other, target_tweet=self.tweet)
+        self.assertEqual(rollup.run(now=self.later)["likes"], 1)
+        self.assertEqual(self.count(self.user, UserRollup.Metric.LIKES_RECEIVED), 2)
+        self.assertEqual(TweetRollup.objects.get(period=Period.DAY).likes, 2)
+        watermark = Watermark.objects.get(source="likes")
+        self.assertEqual(watermark.last_id, Like.objects.latest("pk").pk)
+
+    def test_recent_rows_wait_for_lag(self):
+        totals = rollup.run(lag=timedelta(minutes=1), now=timezone.now())
+        self.assertEqual(totals["tweets"], 0)
+        self.assertEqual(rollup.run(now=self.later)["tweets"], 1)
+
+    def test_small_batches(self):
+        for i in range(4):
+            Tweet.objects.create(user=self.user, content=f"tweet{i}")
+        self.assertEqual(rollup.run(batch_size=2, now=self.later)["tweets"], 5)
+        self.assertEqual(self.count(self.user, UserRollup.Metric.TWEETS), 5)
+
+    def test_command(self):
+        call_command("rollup_analytics", "--lag-seconds=0", stdout=StringIO())
+        self.assertTrue(UserRollup.objects.exists())
+
+    def test_admin_reads_rollups(self):
+        rollup.run(now=self.later)
+        User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="testpassword"
+        )
+        self.client.login(username="admin", password="testpassword")
+        response = self.client.get(reverse("admin:analytics_userrollup_changelist"))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("admin:analytics_tweetrollup_changelist"))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(TWEET_SHARDS=["default", "shard1"], TWEET_SHARD_BUCKETS=2)
+class TestShardedRollup(TestCase):
+    databases = {"default", "shard1"}
+
+    def test_each_shard_has_its_own_watermark(self):
+        users = [
+            User.objects.create_user(username=f"user{i}", email=f"user{i}@example.com")
+            for i in range(2)
+        ]
+        even, odd = sorted(users, key=lambda user: user.pk % 2)
+        later = timezone.now() + timedelta(minutes=5)
+        tweet = Tweet.objects.create(user=odd, content="on shard1")
+        Like.objects.create(user=even, target_tweet=tweet)
+        Tweet.objects.create(user=even, content="on default")
+        self.assertEqual(rollup.run(now=later), {"tweets": 2, "likes": 1, "follows": 0})
+        self.assertEqual(rollup.run(now=later), {"tweets": 0, "likes": 0, "follows": 0})
+        self.assertTrue(Watermark.objects.filter(source="likes:shard1").exists())
+        self.assertEqual(TweetRollup.objects.get(period=Period.DAY).author_id, odd.pk)
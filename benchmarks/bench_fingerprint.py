@@ -0,0 +1,67 @@
+# 重複判定 (指紋の計算 + インデックス検索 + 追加) の 1 件あたりのコストを測る
+#   python benchmarks/bench_fingerprint.py [件数 (既定 1,000,000)]
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from tweets import fingerprint  # noqa: E402
+
+WORDS = [
+    "".join(random.choices(string.ascii_lowercase + "あいうえおかきくけこ", k=5))
+    for _ in range(5000)
+]
+
+
+def synthetic_posts(n, spam_ratio=0.1):
+    # 1 割は少しだけ書き換えたスパムの使い回し
+    random.seed(0)
+    spam = [" ".join(random.choices(WORDS, k=12)) for _ in range(50)]
+    for i in range(n):
+        if random.random() < spam_ratio:
+            yield random.choice(spam) + f" #{random.randint(0, 9)}"
+        else:
+            yield " ".join(random.choices(WORDS, k=random.randint(4, 20)))
+
+
+def main(n):
+    posts = list(synthetic_posts(n))
+    index = fingerprint.RecentContentIndex(capacity=100_000, threshold=0.8)
+    hits = 0
+    started = time.perf_counter()
+    for text in posts:
+        fp = fingerprint.fingerprint(text)
+        if fp is None:
+            continue
+        if index.find(fp):
+            hits += 1
+        index.add(fp)
+    elapsed = time.perf_counter() - started
+
+    # メモリはインデックスを作り直して別に測る (tracemalloc は遅くなるため)
+    tracemalloc.start()
+    index = fingerprint.RecentContentIndex(capacity=100_000, threshold=0.8)
+    for text in posts[:100_000]:
+        fp = fingerprint.fingerprint(text)
+        if fp is not None:
+            index.add(fp)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"posts:       {n:,}")
+    print(f"duplicates:  {hits:,}")
+    print(f"per post:    {elapsed / n * 1e6:.2f} us")
+    print(f"peak memory: {peak / 2**20:.1f} MiB (index of {len(index):,})")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
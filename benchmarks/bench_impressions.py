@@ -0,0 +1,50 @@
+# インプレッション集計の取り込み速度と、ツイート 1 件あたりのスケッチの大きさ・誤差を測る
+#   python benchmarks/bench_impressions.py [イベント数 (既定 1,000,000)]
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.utils import timezone  # noqa: E402
+
+from tweets import hll  # noqa: E402
+from tweets.impressions import ImpressionBuffer  # noqa: E402
+
+
+def ingest(n):
+    buffer = ImpressionBuffer()
+    day = timezone.localdate()
+    start = time.perf_counter()
+    for i in range(n):
+        buffer.add(i % 1000, i, day)
+    elapsed = time.perf_counter() - start
+    print(f"バッファ取り込み: {n:,} 件 {elapsed:.2f} 秒 ({n / elapsed:,.0f} 件/秒)")
+
+
+def sizes():
+    dense = 1 << hll.DEFAULT_PRECISION
+    for cardinality in (10, 1_000, 100_000, 1_000_000):
+        sketch = hll.HyperLogLog()
+        for i in range(cardinality):
+            sketch.add(i)
+        error = abs(sketch.count() - cardinality) / cardinality
+        print(
+            f"{cardinality:>9,} 人: 保存 {len(sketch.to_bytes()):>6,} バイト"
+            f" (非圧縮 {dense:,}) 誤差 {error:.2%}"
+        )
+
+
+def main(n):
+    ingest(n)
+    sizes()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,41 @@
+# おすすめ順のスコア計算 (候補 1,000 件) にかかる時間を測る
+#   python benchmarks/bench_ranking.py
+import os
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from tweets import ranking  # noqa: E402
+
+CANDIDATES = 1000
+NUMBER = 200
+
+
+def bench(label):
+    random.seed(0)
+    ages = [random.uniform(0, 24 * 7) for _ in range(CANDIDATES)]
+    likes = [random.randint(0, 5000) for _ in range(CANDIDATES)]
+    affinities = [random.randint(0, 30) for _ in range(CANDIDATES)]
+    rows = list(range(CANDIDATES))
+
+    def run():
+        scores = ranking.score(ages, likes, affinities)
+        sorted(zip(scores, rows), key=lambda x: -x[0])
+
+    seconds = timeit.timeit(run, number=NUMBER)
+    print(f"{label:<12} {seconds / NUMBER * 1e3:8.3f} ms / {CANDIDATES} candidates")
+
+
+if __name__ == "__main__":
+    if ranking.numpy is not None:
+        bench("numpy")
+    ranking.numpy = None
+    bench("pure python")
@@ -0,0 +1,48 @@
+# レート制限 1 回あたりのコストを測る
+#   python benchmarks/bench_ratelimit.py
+import os
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import AnonymousUser  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from core.ratelimit import CacheStore, LocalMemoryStore, check  # noqa: E402
+
+RULES = {"user": "1000000/s", "ip": "1000000/s"}
+NUMBER = 200_000
+
+
+def bench(label, store, addresses):
+    factory = RequestFactory()
+    requests = []
+    for i in range(addresses):
+        request = factory.post(
+            "/tweets/1/like/", REMOTE_ADDR=f"10.0.{i // 256}.{i % 256}"
+        )
+        request.user = AnonymousUser()
+        requests.append(request)
+
+    state = {"i": 0}
+
+    def run():
+        state["i"] += 1
+        check(store, "tweets:like", requests[state["i"] % addresses], RULES)
+
+    seconds = timeit.timeit(run, number=NUMBER)
+    print(f"{label:<40} {seconds / NUMBER * 1e6:8.2f} us/check")
+
+
+if __name__ == "__main__":
+    bench("LocalMemoryStore (1 ip)", LocalMemoryStore(), 1)
+    bench("LocalMemoryStore (10,000 ips)", LocalMemoryStore(), 10_000)
+    bench("LocalMemoryStore (evicting, 1,000 slots)", LocalMemoryStore(1_000), 10_000)
+    bench("CacheStore (locmem, 10,000 ips)", CacheStore(), 10_000)
@@ -0,0 +1,56 @@
+# ID 生成のスループットを測る (1 スレッド / 複数スレッドで同じ生成器を共有)
+#   python benchmarks/bench_snowflake.py [件数 (既定 1,000,000)] [スレッド数 (既定 4)]
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+from core.snowflake import SnowflakeGenerator  # noqa: E402
+
+
+def run(n, threads):
+    generator = SnowflakeGenerator(worker_id=1, epoch_ms=settings.SNOWFLAKE_EPOCH_MS)
+    results = [[] for _ in range(threads)]
+
+    def work(out):
+        next_id = generator.next_id
+        for _ in range(n // threads):
+            out.append(next_id())
+
+    workers = [threading.Thread(target=work, args=(out,)) for out in results]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    ids = [i for out in results for i in out]
+    assert len(set(ids)) == len(ids), "重複した ID がある"
+    assert all(out == sorted(out) for out in results), "スレッド内で順番が逆転した"
+    print(
+        f"{threads} スレッド: {len(ids):,} 件 {elapsed:.2f} 秒"
+        f" ({len(ids) / elapsed:,.0f} 件/秒, 上限 4,096,000 件/秒)"
+    )
+
+
+def main(n, threads):
+    run(n, 1)
+    run(n, threads)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+    )
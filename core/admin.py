@@ -0,0 +1,16 @@
+from django.contrib import admin
+
+from .paginator import EstimatedCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    # 行数の多いテーブル用。件数は見積もり、一括操作はジョブで行う
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+    def get_actions(self, request):
+        # 標準の「削除」は確認画面で全件を読み込むので使わない
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
@@ -0,0 +1,288 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import InvalidationBatch
+
+logger = logging.getLogger(__name__)
+
+# topic -> (evict(*keys), clear())。キャッシュを持つモジュールが subscribe で登録する
+subscribers = {}
+
+
+def subscribe(topic, evict, clear):
+    subscribers[topic] = (evict, clear)
+
+
+class Behind(Exception):
+    # transport がもう途中の分を返せない (消えた・番号が振り直された)
+    pass
+
+
+class DatabaseTransport:
+    # 共有のテーブルに書いて、各ワーカーが id 順に読みに行く
+    def __init__(self, using="default"):
+        self.using = using
+
+    def publish(self, origin, messages):
+        InvalidationBatch.objects.using(self.using).create(
+            origin=origin, messages=messages
+        )
+
+    def latest(self):
+        last = (
+            InvalidationBatch.objects.using(self.using)
+            .order_by("-pk")
+            .values_list("pk", flat=True)
+            .first()
+        )
+        return last or 0
+
+    def read(self, after, limit):
+        # after より後を最大 limit 件。(行, どこまで見たか, 続きがあるか) を返す
+        rows = (
+            InvalidationBatch.objects.using(self.using)
+            .filter(pk__gt=after)
+            .order_by("pk")
+            .values_list("pk", "origin", "messages")
+        )
+        rows = list(rows[:limit])
+        return rows, rows[-1][0] if rows else after, len(rows) == limit
+
+    def read_many(self, seqs):
+        rows = InvalidationBatch.objects.using(self.using).filter(pk__in=seqs)
+        return list(rows.order_by("pk").values_list("pk", "origin", "messages"))
+
+    def prune(self, older_than):
+        batches = InvalidationBatch.objects.using(self.using)
+        return batches.filter(created_at__lt=older_than).delete()[0]
+
+
+class CacheTransport:
+    # memcached / Redis など、複数のサーバーで共有しているキャッシュを使う。
+    # 通し番号は incr で振り、各バッチは INVALIDATION_RETENTION_SECONDS だけ置いておく
+    def __init__(self, alias="default", prefix="invalidation"):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def key(self, seq):
+        return f"{self.prefix}:{seq}"
+
+    def counter(self):
+        # 番号のキーが消えて作り直されても前の番号と重ならないよう、
+        # 時刻 (ミリ秒) * 1000 から始める。読む側からは大きく飛んだように見える
+        seq_key = self.key("seq")
+        self.cache.add(seq_key, int(time.time() * 1000) * 1000, timeout=None)
+        return seq_key
+
+    def publish(self, origin, messages):
+        seq = self.cache.incr(self.counter())
+        self.cache.set(
+            self.key(seq), (origin, messages), settings.INVALIDATION_RETENTION_SECONDS
+        )
+
+    def latest(self):
+        return self.cache.get(self.counter(), 0)
+
+    def read(self, after, limit):
+        latest = self.latest()
+        if latest < after or latest - after > limit * 10:
+            raise Behind
+        upto = min(latest, after + limit)
+        return self.read_many(range(after + 1, upto + 1)), upto, upto < latest
+
+    def read_many(self, seqs):
+        found = self.cache.get_many([self.key(seq) for seq in seqs])
+        rows = []
+        for seq in seqs:
+            batch = found.get(self.key(seq))
+            if batch is not None:
+                rows.append((seq, *batch))
+        return rows
+
+    def prune(self, older_than):
+        # 期限切れで自然に消える
+        return 0
+
+
+class Bus:
+    # 書き込んだワーカーは自分のキャッシュをすぐ消し、同じ内容を transport に流す。
+    # 他のワーカーは poll() で読んで消す。通し番号に抜けがあれば INVALIDATION_GAP_SECONDS
+    # だけ待ち、それでも来なければ (あるいはしばらく読めていなければ) 全部捨てる
+    def __init__(self, transport, origin=None, clock=time.monotonic):
+        self.transport = transport
+        self.origin = origin or uuid.uuid4().hex
+        self.clock = clock
+        self.cursor = None
+        self.missing = {}  # まだ読めていない通し番号 -> 気付いた時刻
+        self.last_success = None
+        self.last_poll = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def apply(self, messages):
+        for topic, keys in messages.items():
+            if topic in subscribers:
+                subscribers[topic][0](*keys)
+
+    def clear_all(self):
+        for _, clear in subscribers.values():
+            clear()
+
+    def publish(self, topic, *keys):
+        # 自分の分はその場で消し、他のワーカー向けにはコミットされてから送る
+        if topic in subscribers:
+            subscribers[topic][0](*keys)
+        pending = getattr(self.local, "pending", None)
+        if pending is None:
+            transaction.on_commit(partial(self.send, {topic: sorted(set(keys))}))
+        else:
+            pending.setdefault(topic, set()).update(keys)
+
+    def send(self, messages):
+        try:
+            self.transport.publish(self.origin, messages)
+        except DatabaseError:
+            # 届かなかった分は他のワーカーの TTL で消える
+            logger.exception("キャッシュの無効化を送れませんでした")
+
+    @contextmanager
+    def batch(self):
+        # この中の publish は抜けるときに 1 つにまとめて送る (リクエスト単位など)
+        if getattr(self.local, "pending", None) is not None:
+            yield
+            return
+        self.local.pending = pending = {}
+        try:
+            yield
+        finally:
+            self.local.pending = None
+            if pending:
+                self.send({topic: sorted(keys) for topic, keys in pending.items()})
+
+    def poll(self, force=False):
+        now = self.clock()
+        if (
+            not force
+            and self.last_poll is not None
+            and now - self.last_poll < settings.INVALIDATION_POLL_SECONDS
+        ):
+            return
+        if not self.lock.acquire(blocking=False):
+            return  # 他のスレッドが読んでいる
+        try:
+            self.last_poll = now
+            self.receive(now)
+        except DatabaseError:
+            logger.exception("キャッシュの無効化を読めませんでした")
+        finally:
+            self.lock.release()
+
+    def reset(self, now):
+        # 何を逃したか分からないので、今の最新から読み直してキャッシュは全部捨てる
+        self.cursor = self.transport.latest()
+        self.missing.clear()
+        self.clear_all()
+        self.last_success = now
+
+    def receive(self, now):
+        if self.cursor is None or (
+            now - self.last_success > settings.INVALIDATION_MAX_LAG_SECONDS
+        ):
+            # 初回、または長く読めていなかった
+            self.reset(now)
+            return
+
+        if self.missing:
+            for seq, origin, messages in self.transport.read_many(list(self.missing)):
+                self.missing.pop(seq, None)
+                if origin != self.origin:
+                    self.apply(messages)
+            if any(
+                now - seen > settings.INVALIDATION_GAP_SECONDS
+                for seen in self.missing.values()
+            ):
+                logger.warning(
+                    "キャッシュの無効化を %d 件取りこぼしました", len(self.missing)
+                )
+                self.missing.clear()
+                self.clear_all()
+
+        more = True
+        while more:
+            try:
+                rows, upto, more = self.transport.read(
+                    self.cursor, settings.INVALIDATION_READ_LIMIT
+                )
+            except Behind:
+                logger.warning("キャッシュの無効化に追いつけないので全部捨てます")
+                self.reset(now)
+                return
+            received = set()
+            for seq, origin, messages in rows:
+                received.add(seq)
+                if origin != self.origin:
+                    self.apply(messages)
+            for seq in range(self.cursor + 1, upto + 1):
+                if seq not in received:
+                    self.missing.setdefault(seq, now)
+            self.cursor = upto
+        self.last_success = now
+
+    def prune(self, now=None):
+        now = now or timezone.now()
+        retention = timedelta(seconds=settings.INVALIDATION_RETENTION_SECONDS)
+        return self.transport.prune(now - retention)
+
+
+class InvalidationMiddleware:
+    # リクエストの前に他のワーカーの無効化を読み、リクエスト中の分はまとめて送る
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        bus = get_bus()
+        bus.poll()
+        with bus.batch():
+            return self.get_response(request)
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    global _bus
+    if _bus is None:
+        with _bus_lock:
+            if _bus is None:
+                _bus = Bus(import_string(settings.INVALIDATION_TRANSPORT)())
+    return _bus
+
+
+def reset_bus():
+    global _bus
+    _bus = None
+
+
+# fork したプロセスは別のワーカーとして読み直す
+os.register_at_fork(after_in_child=reset_bus)
+
+
+def publish(topic, *keys):
+    get_bus().publish(topic, *keys)
+
+
+def poll(force=False):
+    get_bus().poll(force)
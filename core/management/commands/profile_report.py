@@ -0,0 +1,67 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import profiling
+
+
+class Command(BaseCommand):
+    help = "PROFILING_DIRECTORY のプロファイルを URL 名ごとにまとめ、重い関数を表示する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory", help="既定は PROFILING_DIRECTORY")
+        parser.add_argument(
+            "--view",
+            action="append",
+            dest="views",
+            help="URL 名 (複数指定可、既定はすべて)",
+        )
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument("--sort", choices=["tottime", "cumtime"], default="tottime")
+        parser.add_argument(
+            "--collapsed-out",
+            help="URL 名ごとにまとめた .collapsed をここに書く (flamegraph 用)",
+        )
+
+    def handle(self, *args, **options):
+        directory = Path(options["directory"] or settings.PROFILING_DIRECTORY)
+        if options["views"]:
+            view_dirs = [directory / v.replace(":", ".") for v in options["views"]]
+        else:
+            view_dirs = sorted(d for d in directory.glob("*") if d.is_dir())
+        for view_dir in view_dirs:
+            pstats_files = sorted(view_dir.glob("*.pstats"))
+            collapsed_files = sorted(view_dir.glob("*.collapsed"))
+            if pstats_files:
+                self.write_pstats(view_dir.name, pstats_files, options)
+            if collapsed_files:
+                self.write_collapsed(view_dir.name, collapsed_files, options)
+
+    def write_pstats(self, view, paths, options):
+        self.stdout.write(self.style.SUCCESS(f"{view} (cProfile, {len(paths)} 件)"))
+        self.stdout.write("  tottime(ms)  cumtime(ms)     calls  function")
+        for row in profiling.pstats_report(paths, options["sort"], options["limit"]):
+            self.stdout.write(
+                f"  {row['tottime'] * 1000:11.2f}  {row['cumtime'] * 1000:11.2f}"
+                f"  {row['calls']:8d}  {row['function']}"
+            )
+
+    def write_collapsed(self, view, paths, options):
+        merged = profiling.merge_collapsed(paths)
+        samples = sum(merged.values())
+        self.stdout.write(
+            self.style.SUCCESS(f"{view} (sampler, {len(paths)} 件, {samples} サンプル)")
+        )
+        self.stdout.write("   self%  total%  function")
+        for row in profiling.collapsed_report(merged, options["limit"]):
+            self.stdout.write(
+                f"  {row['self'] * 100:5.1f}  {row['total'] * 100:6.1f}"
+                f"  {row['function']}"
+            )
+        if options["collapsed_out"]:
+            out = Path(options["collapsed_out"])
+            out.mkdir(parents=True, exist_ok=True)
+            with open(out / f"{view}.collapsed", "w", encoding="utf-8") as f:
+                for stack, count in merged.most_common():
+                    f.write(f"{stack} {count}\n")
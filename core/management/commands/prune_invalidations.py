@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import invalidation
+
+
+class Command(BaseCommand):
+    help = "INVALIDATION_RETENTION_SECONDS より古いキャッシュの無効化を消す"
+
+    def handle(self, *args, **options):
+        deleted = invalidation.get_bus().prune()
+        self.stdout.write(self.style.SUCCESS(f"{deleted} 件削除しました"))
@@ -0,0 +1,18 @@
+from django.db import models
+
+
+class InvalidationBatch(models.Model):
+    # プロセス内キャッシュの無効化メッセージ。1 行に 1 回の書き込み分をまとめる
+    # id が通し番号 (バージョン) で、各ワーカーはどこまで読んだかを覚えておく
+    id = models.BigAutoField(primary_key=True)
+    origin = models.CharField(max_length=32)
+    messages = models.JSONField()  # {"topic": [key, ...]}
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class SnowflakeWorker(models.Model):
+    # core.snowflake のワーカー番号の貸し出し。各プロセスは起動後に空いている
+    # (期限の切れた) 番号を 1 つ借り、生きている間は expires_at を延ばし続ける
+    worker_id = models.PositiveSmallIntegerField(primary_key=True)
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+
+STALE_MARKER = "<!-- stale-banner -->"
+STALE_BANNER = '<p class="stale">混み合っているため、少し前の表示です。</p>'
+
+
+def store_stale(key, content):
+    cache.set(key, content, settings.OVERLOAD_STALE_TTL)
+
+
+def shed():
+    response = HttpResponse(
+        "混み合っています。しばらくしてからお試しください。", status=503
+    )
+    response["Retry-After"] = str(settings.OVERLOAD_RETRY_AFTER)
+    return response
+
+
+class QueryTimer:
+    # execute_wrapper に渡して、1 リクエストで DB を待った時間を足していく
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+
+class ViewLoad:
+    # URL 名ごとの処理中の件数と、1 リクエストあたりの DB 時間 (指数移動平均, ミリ秒)
+    def __init__(self):
+        self.in_flight = 0
+        self.db_ms = None
+        self.last_probe = None
+
+    def overloaded(self, rules, now):
+        if self.in_flight >= rules["max_in_flight"]:
+            return True
+        if self.db_ms is not None and self.db_ms > rules["max_db_ms"]:
+            # 遅いままでも OVERLOAD_PROBE_SECONDS に 1 件は通して測り直す
+            if (
+                self.last_probe is not None
+                and now - self.last_probe < settings.OVERLOAD_PROBE_SECONDS
+            ):
+                return True
+            self.last_probe = now
+        return False
+
+    def record(self, db_ms):
+        if self.db_ms is None:
+            self.db_ms = db_ms
+        else:
+            alpha = settings.OVERLOAD_LATENCY_ALPHA
+            self.db_ms = alpha * db_ms + (1 - alpha) * self.db_ms
+
+
+class OverloadMiddleware:
+    # settings.OVERLOAD_VIEWS に書いた重いビューだけ見張る。書き込み系は書かないので
+    # 重いビューが詰まっても削られない。上限を超えたら、StaleWhileRevalidateMixin の
+    # ビューは古いページを返し、それ以外は 503 で断る
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.loads = defaultdict(ViewLoad)
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            if hasattr(request, "overload_view"):
+                self.finish(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = request.resolver_match.view_name
+        rules = settings.OVERLOAD_VIEWS.get(view_name)
+        if not rules:
+            return None
+        with self.lock:
+            load = self.loads[view_name]
+            if load.overloaded(rules, time.monotonic()):
+                view_class = getattr(view_func, "view_class", None)
+                if view_class is not None and issubclass(
+                    view_class, StaleWhileRevalidateMixin
+                ):
+                    request.overloaded = True
+                    return None
+                return shed()
+            load.in_flight += 1
+        request.overload_view = view_name
+        request.overload_timer = QueryTimer()
+        request.overload_stack = ExitStack()
+        for alias in settings.DATABASES:
+            request.overload_stack.enter_context(
+                connections[alias].execute_wrapper(request.overload_timer)
+            )
+        return None
+
+    def finish(self, request):
+        request.overload_stack.close()
+        with self.lock:
+            load = self.loads[request.overload_view]
+            load.in_flight -= 1
+            load.record(request.overload_timer.seconds * 1000)
+
+
+class StaleWhileRevalidateMixin:
+    # 返したページを get_stale_key() ごとにキャッシュしておき、過負荷のときは
+    # DB を使わずにそれを返す。作り直し (refresh_stale) はキーごとに 1 回だけ頼む
+    def get_stale_key(self):
+        # 既定は URL 名・ユーザー・クエリ文字列ごと
+        request = self.request
+        query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()
+        return f"stale:{request.resolver_match.view_name}:{request.user.pk}:{query}"
+
+    def refresh_stale(self):
+        # 既定では裏で作り直さない。過負荷が収まった後のリクエストで入れ替わる
+        pass
+
+    def dispatch(self, request, *args, **kwargs):
+        if getattr(request, "overloaded", False):
+            return self.serve_stale()
+        response = super().dispatch(request, *args, **kwargs)
+        if request.method == "GET" and response.status_code == 200:
+            key = self.get_stale_key()
+            response.add_post_render_callback(
+                lambda rendered: store_stale(key, rendered.content)
+            )
+        return response
+
+    def serve_stale(self):
+        key = self.get_stale_key()
+        content = cache.get(key)
+        if content is None:
+            return shed()
+        if cache.add(f"{key}:refresh", 1, settings.OVERLOAD_REFRESH_LOCK_SECONDS):
+            self.refresh_stale()
+        response = HttpResponse(
+            content.replace(STALE_MARKER.encode(), STALE_BANNER.encode())
+        )
+        response["Warning"] = '110 - "Response is Stale"'
+        return response
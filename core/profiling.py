@@ -0,0 +1,177 @@
+import cProfile
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+
+def frame_name(frame):
+    # co_qualname は Python 3.11 から
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{frame.f_globals.get('__name__', '?')}:{name}"
+
+
+def collapse(frame):
+    # 呼び出し元から順に ";" でつなぐ (flamegraph.pl / speedscope の collapsed 形式)
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class CProfiler:
+    suffix = ".pstats"
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+class StackSampler:
+    # 別のスレッドから、対象のスレッドのスタックを interval 秒ごとに覗いて数える。
+    # 対象のスレッドには何も仕掛けないので、cProfile より軽い
+    suffix = ".collapsed"
+
+    def __init__(self, interval=None, thread_id=None):
+        self.interval = interval or settings.PROFILING_SAMPLE_INTERVAL
+        self.thread_id = thread_id or threading.get_ident()
+        self.counts = Counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse(frame)] += 1
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+PROFILERS = {"cprofile": CProfiler, "sampler": StackSampler}
+
+
+def view_directory(view_name):
+    return Path(settings.PROFILING_DIRECTORY) / view_name.replace(":", ".")
+
+
+def should_profile(request, view_name):
+    if view_name in settings.PROFILING_VIEWS:
+        return True
+    # ヘッダーで頼めるのはスタッフだけ
+    header = settings.PROFILING_HEADER
+    if header and request.headers.get(header) and request.user.is_staff:
+        return True
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+class ProfilingMiddleware:
+    # PROFILING_ENABLED のときだけ有効。選んだリクエストのビューと描画を測り、
+    # PROFILING_DIRECTORY/<URL 名>/ に 1 リクエスト 1 ファイルで書く
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            if hasattr(request, "profiler"):
+                self.finish(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = request.resolver_match.view_name
+        if not view_name or not should_profile(request, view_name):
+            return None
+        profiler = PROFILERS[settings.PROFILING_MODE]()
+        try:
+            profiler.start()
+        except ValueError:
+            return None  # 別のスレッドで cProfile が動いている
+        request.profiler = profiler
+        request.profile_view = view_name
+        return None
+
+    def finish(self, request):
+        profiler = request.profiler
+        profiler.stop()
+        directory = view_directory(request.profile_view)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{int(time.time() * 1000)}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        profiler.write(directory / f"{name}{profiler.suffix}")
+
+
+def pstats_report(paths, sort="tottime", limit=20):
+    # 複数リクエストの pstats をまとめ、関数ごとの (1 リクエストあたりの秒数, 呼び出し回数)
+    stats = pstats.Stats(*map(str, paths))
+    rows = []
+    for (filename, line, func), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append(
+            {
+                "function": f"{filename}:{line}({func})",
+                "calls": calls,
+                "tottime": tottime / len(paths),
+                "cumtime": cumtime / len(paths),
+            }
+        )
+    rows.sort(key=lambda row: row[sort], reverse=True)
+    return rows[:limit]
+
+
+def merge_collapsed(paths):
+    merged = Counter()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                merged[stack] += int(count)
+    return merged
+
+
+def collapsed_report(merged, limit=20):
+    # 関数ごとのサンプル数。self は一番上 (実行中) だったとき、total はスタックにあったとき
+    total = sum(merged.values()) or 1
+    self_counts = Counter()
+    total_counts = Counter()
+    for stack, count in merged.items():
+        frames = stack.split(";")
+        self_counts[frames[-1]] += count
+        for name in set(frames):
+            total_counts[name] += count
+    return [
+        {
+            "function": name,
+            "self": count / total,
+            "total": total_counts[name] / total,
+        }
+        for name, count in self_counts.most_common(limit)
+    ]
@@ -0,0 +1,129 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+# 既定で制限するメソッド。ルールに "methods" を書けば GET なども制限できる
+LIMITED_METHODS = frozenset(["POST", "PUT", "PATCH", "DELETE"])
+SCOPES = ("user", "ip")
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    # "60/m" -> (バケツの容量, 1 秒あたりの補充量)
+    count, period = rate.split("/")
+    return int(count), int(count) / PERIODS[period]
+
+
+class LocalMemoryStore:
+    # プロセス内のトークンバケツ。古いキーから捨てて max_entries 件に抑える
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate, now):
+        # トークンを 1 つ使う。足りなければ次に使えるまでの秒数を返す
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+                if len(self.buckets) >= self.max_entries:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return (1 - tokens) / refill_rate
+            self.buckets[key] = (tokens - 1, now)
+            return 0.0
+
+
+class CacheStore:
+    # 複数プロセスで共有する場合。Django のキャッシュに時間枠ごとのカウンタを置く。
+    # add / incr だけで数えるので、同時に来ても数え漏れない (トークンバケツではなく固定の時間枠)
+    # プロセスをまたいで時刻を比べるので、時計は time.time() を使う
+    clock = staticmethod(time.time)
+
+    def __init__(self, alias="default"):
+        self.cache = caches[alias]
+
+    def consume(self, key, capacity, refill_rate, now):
+        window = capacity / refill_rate  # "60/m" なら 60 秒
+        start = now - now % window
+        cache_key = f"ratelimit:{key}:{int(start)}"
+        timeout = math.ceil(window) + 1
+        while True:
+            self.cache.add(cache_key, 0, timeout)
+            try:
+                used = self.cache.incr(cache_key)
+                break
+            except ValueError:
+                # add と incr の間で期限が切れたらやり直す
+                continue
+        if used > capacity:
+            return start + window - now
+        return 0.0
+
+
+def client_ip(request):
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def check(store, view_name, request, rules, now=None):
+    # user / ip それぞれのバケツを確認し、最も長い待ち時間を返す
+    now = store.clock() if now is None else now
+    wait = 0.0
+    for scope in SCOPES:
+        rate = rules.get(scope)
+        if rate is None:
+            continue
+        if scope == "user":
+            if not request.user.is_authenticated:
+                continue
+            ident = request.user.pk
+        else:
+            ident = client_ip(request)
+        capacity, refill_rate = parse_rate(rate)
+        wait = max(
+            wait,
+            store.consume(f"{view_name}:{scope}:{ident}", capacity, refill_rate, now),
+        )
+    return wait
+
+
+class RateLimitMiddleware:
+    # settings.RATELIMITS に URL 名ごとの上限を書く
+    # 例: {"tweets:like": {"user": "60/m", "ip": "120/m"}}
+    # GET も制限するなら {"user": "3/h", "methods": ["GET"]} のように書く
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.store = import_string(settings.RATELIMIT_STORE)()
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_name = request.resolver_match.view_name
+        rules = settings.RATELIMITS.get(view_name)
+        if not rules or request.method not in rules.get("methods", LIMITED_METHODS):
+            return None
+        wait = check(self.store, view_name, request, rules)
+        if not wait:
+            return None
+        response = HttpResponse(
+            "リクエストが多すぎます。しばらくしてからお試しください。", status=429
+        )
+        response["Retry-After"] = str(math.ceil(wait))
+        return response
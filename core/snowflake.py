@@ -0,0 +1,175 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone as django_timezone
+
+# 64 bit の ID = 時刻 (ミリ秒, 41 bit) | ワーカー番号 (10 bit) | 連番 (12 bit)。
+# 生成した順にほぼ並ぶので、主キーだけで新しい順に並べたりページ送りしたりできる
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+TIMESTAMP_SHIFT = WORKER_BITS + SEQUENCE_BITS
+
+
+def now_ms():
+    return time.time_ns() // 1_000_000
+
+
+class SnowflakeGenerator:
+    # lease を渡すと、ID を作るたびに lease.current() のワーカー番号を使う
+    def __init__(self, worker_id, epoch_ms, clock=now_ms, lease=None):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id は 0 から {MAX_WORKER_ID} まで: {worker_id}")
+        self.worker_id = worker_id
+        self.epoch_ms = epoch_ms
+        self.clock = clock
+        self.lease = lease
+        self.last_ms = -1
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            if self.lease is not None:
+                self.worker_id = self.lease.current()
+            ms = self.clock()
+            if ms < self.last_ms:
+                # 時計が戻ったら、追いつくまで前の時刻のまま連番を進める
+                ms = self.last_ms
+            if ms == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    # この 1 ミリ秒の分を使い切ったので次のミリ秒を待つ
+                    while ms <= self.last_ms:
+                        ms = self.clock()
+            else:
+                self.sequence = 0
+            self.last_ms = ms
+            return (
+                (ms - self.epoch_ms) << TIMESTAMP_SHIFT
+                | self.worker_id << SEQUENCE_BITS
+                | self.sequence
+            )
+
+
+def timestamp_ms(snowflake_id, epoch_ms=None):
+    if epoch_ms is None:
+        epoch_ms = settings.SNOWFLAKE_EPOCH_MS
+    return (snowflake_id >> TIMESTAMP_SHIFT) + epoch_ms
+
+
+def to_datetime(snowflake_id):
+    return datetime.fromtimestamp(timestamp_ms(snowflake_id) / 1000, tz=timezone.utc)
+
+
+def min_id_for(dt):
+    # dt 以降に作られた ID はすべてこれ以上になる (主キーで期間を絞るとき用)
+    ms = int(dt.timestamp() * 1000) - settings.SNOWFLAKE_EPOCH_MS
+    return max(ms, 0) << TIMESTAMP_SHIFT
+
+
+class WorkerLease:
+    # ワーカー番号を DB (core.SnowflakeWorker) から SNOWFLAKE_LEASE_SECONDS だけ借りる。
+    # 期限の 1/3 ごとに延ばし、延ばせなかった (期限が切れて他に取られた) ら借り直す。
+    # 延長はトランザクションの外でだけ行う (巻き戻されると延ばしたつもりになるので)
+    def __init__(self, using="default"):
+        self.using = using
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.worker_id = None
+        self.renew_at = None
+
+    def workers(self):
+        from .models import SnowflakeWorker
+
+        return SnowflakeWorker.objects.using(self.using)
+
+    def current(self):
+        now = django_timezone.now()
+        if self.worker_id is None:
+            self.worker_id = self.claim(now)
+            if connections[self.using].in_atomic_block:
+                # 外のトランザクションごと巻き戻されるかもしれないので、早めに確かめる
+                self.renew_at = now
+        elif now >= self.renew_at and not connections[self.using].in_atomic_block:
+            if not self.renew(now):
+                self.worker_id = self.claim(now)
+        return self.worker_id
+
+    def lease_until(self, now):
+        ttl = timedelta(seconds=settings.SNOWFLAKE_LEASE_SECONDS)
+        self.renew_at = now + ttl / 3
+        return now + ttl
+
+    def claim(self, now):
+        # 期限切れの番号を乗っ取る。条件付きの UPDATE なので取り合っても勝つのは 1 つ
+        expired = self.workers().filter(expires_at__lt=now)
+        for worker_id in expired.values_list("worker_id", flat=True)[:10]:
+            if expired.filter(worker_id=worker_id).update(
+                owner=self.owner, expires_at=self.lease_until(now)
+            ):
+                return worker_id
+        # まだ誰も使っていない番号を作る
+        used = set(self.workers().values_list("worker_id", flat=True))
+        for worker_id in range(MAX_WORKER_ID + 1):
+            if worker_id in used:
+                continue
+            try:
+                with transaction.atomic(using=self.using):
+                    self.workers().create(
+                        worker_id=worker_id,
+                        owner=self.owner,
+                        expires_at=self.lease_until(now),
+                    )
+            except IntegrityError:
+                continue
+            return worker_id
+        raise RuntimeError("空いている Snowflake のワーカー番号がありません")
+
+    def renew(self, now):
+        return (
+            self.workers()
+            .filter(worker_id=self.worker_id, owner=self.owner)
+            .update(expires_at=self.lease_until(now))
+        )
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_generator():
+    # SNOWFLAKE_WORKER_ID は 1 プロセスだけで動かすとき用。未設定なら DB から番号を借りる
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                worker_id = settings.SNOWFLAKE_WORKER_ID
+                if worker_id is not None:
+                    _generator = SnowflakeGenerator(
+                        worker_id, settings.SNOWFLAKE_EPOCH_MS
+                    )
+                else:
+                    _generator = SnowflakeGenerator(
+                        0, settings.SNOWFLAKE_EPOCH_MS, lease=WorkerLease()
+                    )
+    return _generator
+
+
+def reset_generator():
+    global _generator
+    _generator = None
+
+
+# fork したプロセスが親と同じワーカー番号・連番を使わないようにする
+os.register_at_fork(after_in_child=reset_generator)
+
+
+def next_id():
+    return get_generator().next_id()
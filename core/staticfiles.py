@@ -0,0 +1,45 @@
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # brotli は任意。無ければ gzip だけ作る
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = (".js", ".css", ".svg", ".txt", ".json", ".map", ".html")
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # collectstatic でハッシュ付きのファイル名に加えて .gz / .br を書き出す
+
+    def stored_name(self, name):
+        # collectstatic 前(開発時やテスト時)は manifest が無いので元の名前を使う
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = []
+        for name, hashed_name, processed in super().post_process(
+            paths, dry_run=dry_run, **options
+        ):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.append(hashed_name)
+            yield name, hashed_name, processed
+
+        if dry_run:
+            return
+        for hashed_name in hashed_names:
+            if hashed_name.endswith(COMPRESSIBLE_EXTENSIONS):
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, "rb") as f:
+            content = f.read()
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + ".br", "wb") as f:
+                f.write(brotli.compress(content))
@@ -0,0 +1,505 @@
+import gzip
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from tweets.models import Like, Tweet
+
+from . import invalidation
+from .models import InvalidationBatch, SnowflakeWorker
+from .overload import (
+    STALE_BANNER,
+    OverloadMiddleware,
+    StaleWhileRevalidateMixin,
+    ViewLoad,
+)
+from .paginator import EstimatedCountPaginator
+from .profiling import StackSampler, collapsed_report
+from .ratelimit import CacheStore, LocalMemoryStore
+from .snowflake import SnowflakeGenerator, WorkerLease, min_id_for, to_datetime
+from .views import accepted_encodings
+
+User = get_user_model()
+
+
+class TestStaticBundle(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.client.force_login(user)
+
+    def test_script_is_not_inlined(self):
+        response = self.client.get(reverse("accounts:home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "function getCookie")
+        self.assertContains(response, 'src="/static/tweets/like.js"')
+
+
+class TestServeStatic(TestCase):
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+        self.settings_override = override_settings(STATIC_ROOT=self.static_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        call_command("collectstatic", interactive=False, verbosity=0)
+
+    def get_hashed_name(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+
+        return staticfiles_storage.stored_name("tweets/like.js")
+
+    def test_collectstatic_writes_precompressed_variant(self):
+        name = self.get_hashed_name()
+        self.assertNotEqual(name, "tweets/like.js")
+        with open(f"{self.static_root}/{name}", "rb") as f:
+            original = f.read()
+        with open(f"{self.static_root}/{name}.gz", "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), original)
+
+    def test_hashed_file_is_immutable_and_gzipped(self):
+        name = self.get_hashed_name()
+        response = self.client.get(
+            "/static/" + name, HTTP_ACCEPT_ENCODING="gzip, deflate"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertIn("immutable", response["Cache-Control"])
+
+    def test_encoding_with_zero_q_is_not_used(self):
+        name = self.get_hashed_name()
+        for header in ("gzip;q=0, deflate", "*;q=0", "gzip;q=0.0, *;q=1"):
+            response = self.client.get("/static/" + name, HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header("Content-Encoding"), header)
+        response = self.client.get("/static/" + name, HTTP_ACCEPT_ENCODING="*;q=0.5")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(
+            accepted_encodings("br;q=0.8, GZIP ; q=1, identity;q=bad"),
+            {"br": 0.8, "gzip": 1.0},
+        )
+
+    def test_unhashed_file_is_not_immutable(self):
+        response = self.client.get("/static/tweets/like.js")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertNotIn("immutable", response["Cache-Control"])
+
+    def test_failure_get_with_not_exist_file(self):
+        response = self.client.get("/static/tweets/not_exist.js")
+        self.assertEqual(response.status_code, 404)
+
+
+class TestTokenBucket(TestCase):
+    def test_bucket_refills_over_time(self):
+        store = LocalMemoryStore()
+        self.assertEqual(store.consume("key", 2, 1.0, now=0.0), 0.0)
+        self.assertEqual(store.consume("key", 2, 1.0, now=0.0), 0.0)
+        self.assertAlmostEqual(store.consume("key", 2, 1.0, now=0.0), 1.0)
+        self.assertEqual(store.consume("key", 2, 1.0, now=1.0), 0.0)
+
+    def test_cache_store_counts_per_window(self):
+        store = CacheStore()
+        self.assertIs(CacheStore.clock, time.time)
+        self.assertEqual(store.consume("key", 2, 2 / 60, now=600.0), 0.0)
+        self.assertEqual(store.consume("key", 2, 2 / 60, now=610.0), 0.0)
+        self.assertAlmostEqual(store.consume("key", 2, 2 / 60, now=630.0), 30.0)
+        self.assertEqual(store.consume("key", 2, 2 / 60, now=660.0), 0.0)
+
+    def test_oldest_key_is_evicted(self):
+        store = LocalMemoryStore(max_entries=2)
+        for key in ("a", "b", "c"):
+            store.consume(key, 1, 1.0, now=0.0)
+        self.assertEqual(list(store.buckets), ["b", "c"])
+
+
+@override_settings(RATELIMITS={"tweets:like": {"user": "2/m"}})
+class TestRateLimitMiddleware(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.client.force_login(self.user)
+        self.tweet = Tweet.objects.create(user=self.user, content="example_tweet")
+        self.url = reverse("tweets:like", kwargs={"pk": self.tweet.pk})
+
+    def test_too_many_requests(self):
+        self.assertEqual(self.client.post(self.url).status_code, 200)
+        self.assertEqual(self.client.post(self.url).status_code, 200)
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_other_view_is_not_limited(self):
+        for _ in range(3):
+            response = self.client.post(
+                reverse("tweets:unlike", kwargs={"pk": self.tweet.pk})
+            )
+            self.assertEqual(response.status_code, 200)
+
+
+class TestEstimatedCountPaginator(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="sample", email="sample@example.com")
+        for i in range(5):
+            Tweet.objects.create(user=user, content=f"tweet{i}")
+
+    def test_small_table_is_counted(self):
+        paginator = EstimatedCountPaginator(Tweet.objects.order_by("pk"), 2)
+        self.assertEqual(paginator.count, 5)
+        self.assertEqual(paginator.num_pages, 3)
+
+    @override_settings(ADMIN_COUNT_LIMIT=3)
+    def test_count_stops_at_limit(self):
+        paginator = EstimatedCountPaginator(Tweet.objects.order_by("pk"), 2)
+        self.assertEqual(paginator.count, 3)
+
+
+class TestSnowflake(TestCase):
+    def test_ids_are_unique_and_increasing(self):
+        generator = SnowflakeGenerator(worker_id=5, epoch_ms=0)
+        ids = [generator.next_id() for _ in range(10_000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(all(0 < i < 2**63 for i in ids))
+
+    def test_sequence_overflow_waits_for_next_millisecond(self):
+        ticks = iter([100] * 4097 + [100, 101])
+        generator = SnowflakeGenerator(
+            worker_id=1, epoch_ms=0, clock=lambda: next(ticks)
+        )
+        ids = [generator.next_id() for _ in range(4097)]
+        self.assertEqual(ids[-1] >> 22, 101)
+        self.assertEqual(len(set(ids)), 4097)
+
+    def test_clock_going_backwards_keeps_order(self):
+        ticks = iter([200, 150, 150])
+        generator = SnowflakeGenerator(
+            worker_id=1, epoch_ms=0, clock=lambda: next(ticks)
+        )
+        first, second = generator.next_id(), generator.next_id()
+        self.assertGreater(second, first)
+
+    def test_workers_do_not_collide(self):
+        a = SnowflakeGenerator(worker_id=1, epoch_ms=0, clock=lambda: 100)
+        b = SnowflakeGenerator(worker_id=2, epoch_ms=0, clock=lambda: 100)
+        self.assertNotEqual(a.next_id(), b.next_id())
+
+    def test_leases_give_each_process_its_own_worker_id(self):
+        a, b = WorkerLease(), WorkerLease()
+        self.assertNotEqual(a.current(), b.current())
+        self.assertEqual(SnowflakeWorker.objects.count(), 2)
+
+        # 期限の切れた番号は他のプロセスが引き継ぐ
+        SnowflakeWorker.objects.filter(worker_id=a.worker_id).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        c = WorkerLease()
+        self.assertEqual(c.current(), a.worker_id)
+
+        # 取られた側は延長に失敗するので、別の番号を借り直す
+        now = timezone.now()
+        self.assertFalse(a.renew(now))
+        self.assertNotIn(a.claim(now), (b.worker_id, c.worker_id))
+
+    def test_models_get_time_ordered_ids(self):
+        user = User.objects.create_user(username="sample", email="sample@example.com")
+        tweets = [
+            Tweet.objects.create(user=user, content=f"tweet{i}") for i in range(3)
+        ]
+        self.assertEqual(list(Tweet.objects.order_by("-pk")), tweets[::-1])
+        created = tweets[0].created_at
+        self.assertLess(abs((to_datetime(tweets[0].pk) - created).total_seconds()), 1)
+        self.assertGreaterEqual(
+            tweets[0].pk, min_id_for(created.replace(microsecond=0))
+        )
+
+
+@override_settings(INVALIDATION_GAP_SECONDS=5, INVALIDATION_MAX_LAG_SECONDS=60)
+class TestInvalidationBus(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.evicted = []
+        self.cleared = 0
+        invalidation.subscribe("test", self.evict, self.clear)
+        self.addCleanup(invalidation.subscribers.pop, "test")
+        self.a = self.worker(invalidation.DatabaseTransport())
+        self.b = self.worker(invalidation.DatabaseTransport())
+
+    def evict(self, *keys):
+        self.evicted.append(keys)
+
+    def clear(self):
+        self.cleared += 1
+
+    def worker(self, transport):
+        bus = invalidation.Bus(transport, clock=lambda: self.now)
+        bus.poll(force=True)
+        return bus
+
+    def poll(self, bus, seconds=1):
+        self.now += seconds
+        self.evicted = []
+        self.cleared = 0
+        bus.poll(force=True)
+
+    def test_other_worker_evicts_batched_messages(self):
+        with self.a.batch():
+            self.a.publish("test", 1)
+            self.a.publish("test", 2, 1)
+        self.assertEqual(self.evicted, [(1,), (2, 1)])
+        self.assertEqual(InvalidationBatch.objects.count(), 1)
+        self.poll(self.b)
+        self.assertEqual(self.evicted, [(1, 2)])
+        # 自分の送った分は読み飛ばす
+        self.poll(self.a)
+        self.assertEqual(self.evicted, [])
+
+    def test_publish_waits_for_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.a.publish("test", 3)
+            self.assertFalse(InvalidationBatch.objects.exists())
+        self.poll(self.b)
+        self.assertEqual(self.evicted, [(3,)])
+
+    def test_late_batch_is_applied(self):
+        # 先に採番されたトランザクションが後からコミットされた場合
+        first = self.b.cursor + 1
+        InvalidationBatch.objects.create(
+            id=first + 1, origin="x", messages={"test": [2]}
+        )
+        self.poll(self.b)
+        self.assertEqual(self.evicted, [(2,)])
+        InvalidationBatch.objects.create(id=first, origin="x", messages={"test": [1]})
+        self.poll(self.b)
+        self.assertEqual(self.evicted, [(1,)])
+        self.assertEqual(self.cleared, 0)
+
+    def test_missing_batch_clears_everything(self):
+        first = self.b.cursor + 1
+        InvalidationBatch.objects.create(
+            id=first + 1, origin="x", messages={"test": [2]}
+        )
+        self.poll(self.b)
+        self.poll(self.b, seconds=3)
+        self.assertEqual(self.cleared, 0)
+        self.poll(self.b, seconds=3)
+        self.assertEqual(self.cleared, 1)
+
+    def test_long_lag_clears_everything(self):
+        self.a.send({"test": [1]})
+        self.poll(self.b, seconds=61)
+        self.assertEqual(self.evicted, [])
+        self.assertEqual(self.cleared, 1)
+
+    def test_cache_transport(self):
+        prefix = f"invalidation-test-{self.id()}"
+        self.addCleanup(cache.clear)
+        a = self.worker(invalidation.CacheTransport(prefix=prefix))
+        b = self.worker(invalidation.CacheTransport(prefix=prefix))
+        a.send({"test": [1]})
+        a.send({"test": [2]})
+        self.poll(b)
+        self.assertEqual(self.evicted, [(1,), (2,)])
+        # 番号が振り直されたら、何を逃したか分からないので全部捨てる
+        cache.set(f"{prefix}:seq", 0, timeout=None)
+        a.send({"test": [3]})
+        self.poll(b)
+        self.assertEqual(self.cleared, 1)
+
+    def test_prune(self):
+        self.a.send({"test": [1]})
+        InvalidationBatch.objects.update(created_at=timezone.now() - timedelta(days=1))
+        self.a.send({"test": [2]})
+        out = StringIO()
+        call_command("prune_invalidations", stdout=out)
+        self.assertEqual(InvalidationBatch.objects.count(), 1)
+
+    def test_follow_publishes_one_batch(self):
+        follower = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        following = User.objects.create_user(
+            username="sample2", email="sample2@example.com", password="testpassword2"
+        )
+        self.client.force_login(follower)
+        InvalidationBatch.objects.all().delete()
+        self.client.post(reverse("accounts:follow", kwargs={"username": "sample2"}))
+        batch = InvalidationBatch.objects.get()
+        self.assertEqual(batch.messages["graph.followings"], [follower.pk])
+        self.assertEqual(batch.messages["graph.followers"], [following.pk])
+        self.assertEqual(
+            sorted(batch.messages["stats"]), sorted([follower.pk, following.pk])
+        )
+
+
+OVERLOADED = {"max_in_flight": 0, "max_db_ms": 1000}
+
+
+@override_settings(JOBS_EAGER=True)
+class TestOverload(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.client.force_login(self.user)
+        self.url = reverse("accounts:home")
+
+    def test_view_load(self):
+        rules = {"max_in_flight": 2, "max_db_ms": 100}
+        load = ViewLoad()
+        load.in_flight = 2
+        self.assertTrue(load.overloaded(rules, 0))
+        load.in_flight = 0
+        load.record(500)
+        load.record(0)
+        self.assertEqual(load.db_ms, 400)
+        # 遅くても 1 件は通して測り直し、その後しばらくは断る
+        with override_settings(OVERLOAD_PROBE_SECONDS=1):
+            self.assertFalse(load.overloaded(rules, 10))
+            self.assertTrue(load.overloaded(rules, 10.5))
+            self.assertFalse(load.overloaded(rules, 11))
+
+    def test_middleware_measures_db_time(self):
+        request = RequestFactory().get(self.url)
+        request.resolver_match = resolve(self.url)
+        middleware = OverloadMiddleware(lambda request: None)
+        middleware.process_view(request, None, (), {})
+        self.assertEqual(middleware.loads["accounts:home"].in_flight, 1)
+        list(User.objects.all())
+        middleware.finish(request)
+        load = middleware.loads["accounts:home"]
+        self.assertEqual(load.in_flight, 0)
+        self.assertGreater(load.db_ms, 0)
+
+    def test_home_serves_stale_page_and_refreshes(self):
+        Tweet.objects.create(user=self.user, content="old tweet")
+        self.client.get(self.url)
+        Tweet.objects.create(user=self.user, content="new tweet")
+        with override_settings(OVERLOAD_VIEWS={"accounts:home": OVERLOADED}):
+            response = self.client.get(self.url)
+            self.assertContains(response, STALE_BANNER)
+            self.assertContains(response, "old tweet")
+            self.assertNotContains(response, "new tweet")
+            self.assertIn("Stale", response["Warning"])
+            # 裏で作り直したページが次から返る
+            response = self.client.get(self.url)
+            self.assertContains(response, "new tweet")
+            self.assertContains(response, "ログアウト")
+        response = self.client.get(self.url)
+        self.assertNotContains(response, STALE_BANNER)
+
+    def test_default_stale_key(self):
+        def key(query):
+            view = StaleWhileRevalidateMixin()
+            view.request = RequestFactory().get(self.url, query)
+            view.request.resolver_match = resolve(self.url)
+            view.request.user = self.user
+            self.assertIsNone(view.refresh_stale())
+            return view.get_stale_key()
+
+        self.assertTrue(key({}).startswith(f"stale:accounts:home:{self.user.pk}:"))
+        self.assertNotEqual(key({"page": 1}), key({"page": 2}))
+
+    def test_sheds_without_stale_page(self):
+        overloaded = {"accounts:home": OVERLOADED, "accounts:user_profile": OVERLOADED}
+        with override_settings(OVERLOAD_VIEWS=overloaded):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "5")
+            response = self.client.get(
+                reverse("accounts:user_profile", args=[self.user.pk])
+            )
+            self.assertEqual(response.status_code, 503)
+            # 書き込みは削られない
+            tweet = Tweet.objects.create(user=self.user, content="hello")
+            response = self.client.post(reverse("tweets:like", args=[tweet.pk]))
+            self.assertEqual(response.status_code, 200)
+
+
+def spin(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.settings_override = override_settings(
+            PROFILING_ENABLED=True,
+            PROFILING_DIRECTORY=self.directory,
+            PROFILING_VIEWS=["accounts:home"],
+            PROFILING_MODE="cprofile",
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.client.force_login(self.user)
+
+    def files(self, view):
+        return sorted(p.name for p in (Path(self.directory) / view).glob("*"))
+
+    def test_profiles_selected_views(self):
+        self.client.get(reverse("accounts:home"))
+        self.client.get(reverse("accounts:user_profile", args=[self.user.pk]))
+        files = self.files("accounts.home")
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].endswith(".pstats"))
+        self.assertEqual(self.files("accounts.user_profile"), [])
+
+        out = StringIO()
+        call_command("profile_report", "--sort", "cumtime", stdout=out)
+        self.assertIn("accounts.home (cProfile, 1 件)", out.getvalue())
+        self.assertIn("accounts/views.py", out.getvalue())
+
+    def test_header_only_for_staff(self):
+        url = reverse("accounts:user_profile", args=[self.user.pk])
+        self.client.get(url, HTTP_X_PROFILE="1")
+        self.assertEqual(self.files("accounts.user_profile"), [])
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(url, HTTP_X_PROFILE="1")
+        self.assertEqual(len(self.files("accounts.user_profile")), 1)
+
+    def test_sampler(self):
+        sampler = StackSampler(interval=0.001)
+        sampler.start()
+        spin(0.05)
+        sampler.stop()
+        self.assertGreater(sum(sampler.counts.values()), 0)
+        rows = collapsed_report(sampler.counts)
+        self.assertEqual(rows[0]["function"], "core.tests:spin")
+        self.assertGreater(rows[0]["total"], 0.5)
+
+    @override_settings(PROFILING_MODE="sampler", PROFILING_SAMPLE_INTERVAL=0.001)
+    def test_sampler_report(self):
+        self.client.get(reverse("accounts:home"))
+        self.assertTrue(self.files("accounts.home")[0].endswith(".collapsed"))
+        out = StringIO()
+        call_command(
+            "profile_report",
+            "--view",
+            "accounts:home",
+            "--collapsed-out",
+            self.directory,
+            stdout=out,
+        )
+        self.assertIn("accounts.home (sampler, 1 件", out.getvalue())
+        self.assertIn("accounts.home.collapsed", os.listdir(self.directory))
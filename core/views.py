@@ -0,0 +1,82 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+
+# ManifestStaticFilesStorage が付ける 12 桁のハッシュ (例: like.3f2a9c0e1b7d.js)
+HASHED_NAME_RE = re.compile(r"\.[0-9a-f]{12}\.[^/.]+$")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=60"
+
+# 優先度順。ブラウザが対応していて、事前圧縮ファイルがあればそちらを返す
+PRECOMPRESSED_VARIANTS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def accepted_encodings(header):
+    # "br;q=1.0, gzip;q=0.5, *;q=0" -> {"br": 1.0, "gzip": 0.5, "*": 0.0}
+    # q が読めないものは無視する
+    codings = {}
+    for item in header.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = None
+        if q is not None:
+            codings[name] = q
+    return codings
+
+
+def choose_variant(fullpath, header):
+    # q が一番大きいもの (同じなら PRECOMPRESSED_VARIANTS の順)。q=0 は使わない
+    codings = accepted_encodings(header)
+    best = None
+    for encoding, suffix in PRECOMPRESSED_VARIANTS:
+        q = codings.get(encoding, codings.get("*", 0.0))
+        if q <= 0 or (best is not None and q <= best[0]):
+            continue
+        if os.path.isfile(fullpath + suffix):
+            best = (q, encoding, suffix)
+    return (None, "") if best is None else best[1:]
+
+
+def serve_static(request, path):
+    # collectstatic 済みの STATIC_ROOT からファイルを返す (DEBUG 時は runserver が配信する)
+    if not settings.STATIC_ROOT:
+        raise Http404
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    encoding, suffix = choose_variant(
+        fullpath, request.headers.get("Accept-Encoding", "")
+    )
+    fullpath += suffix
+
+    response = FileResponse(
+        open(fullpath, "rb"), content_type=content_type or "application/octet-stream"
+    )
+    if encoding:
+        response["Content-Encoding"] = encoding
+    response["Vary"] = "Accept-Encoding"
+    if HASHED_NAME_RE.search(path):
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    else:
+        response["Cache-Control"] = DEFAULT_CACHE_CONTROL
+    return response
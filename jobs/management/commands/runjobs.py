@@ -0,0 +1,53 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs.worker import Worker
+
+
+def run_worker(options):
+    Worker(
+        lanes=options["lanes"],
+        batch_size=options["batch_size"],
+        poll_interval=options["poll_interval"],
+    ).run(once=options["once"])
+
+
+class Command(BaseCommand):
+    help = "ジョブキューのワーカーを起動する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1)
+        parser.add_argument(
+            "--lanes",
+            type=lambda value: [int(lane) for lane in value.split(",")],
+            default=None,
+            help="処理する優先度 (例: 0,1)。省略時はすべて",
+        )
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument(
+            "--once", action="store_true", help="キューが空になったら終了する"
+        )
+
+    def handle(self, *args, **options):
+        if options["processes"] <= 1:
+            run_worker(options)
+            return
+
+        # fork 前に接続を閉じて、子プロセスごとに接続を張り直させる
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(options,))
+            for _ in range(options["processes"])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+                process.join()
@@ -0,0 +1,49 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    class Status(models.TextChoices):
+        QUEUED = "queued"
+        RUNNING = "running"
+        FAILED = "failed"
+
+    # 数字が小さいほど先に処理する
+    class Priority(models.IntegerChoices):
+        HIGH = 0
+        NORMAL = 1
+        LOW = 2
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    priority = models.PositiveSmallIntegerField(
+        choices=Priority.choices, default=Priority.NORMAL
+    )
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.QUEUED
+    )
+    # 同じ内容のジョブが待ち行列にあれば 1 件にまとめる
+    dedupe_key = models.CharField(max_length=64)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    lease_token = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "priority", "run_at"], name="job_pick_idx"),
+            models.Index(fields=["lease_token"], name="job_lease_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dedupe_key"],
+                condition=models.Q(status="queued"),
+                name="job_queued_dedupe_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
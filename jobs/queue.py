@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import random
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 60 * 60
+DEFAULT_LEASE_SECONDS = 5 * 60
+
+
+@dataclass
+class Task:
+    name: str
+    func: object
+    priority: int
+    max_attempts: int
+    batch: bool
+
+    def enqueue(self, **payload):
+        return enqueue(self.name, payload)
+
+
+_registry = {}
+
+
+def task(name=None, priority=Job.Priority.NORMAL, max_attempts=5, batch=False):
+    # batch=True のタスクは、同時に取り出した同名ジョブの payload をリストで受け取る
+    def decorator(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        _registry[task_name] = Task(task_name, func, priority, max_attempts, batch)
+        func.enqueue = _registry[task_name].enqueue
+        return func
+
+    return decorator
+
+
+def get_task(name):
+    return _registry[name]
+
+
+def make_dedupe_key(name, payload):
+    raw = json.dumps([name, payload], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def enqueue(name, payload=None, priority=None, delay=None):
+    registered = get_task(name)
+    payload = payload or {}
+    if settings.JOBS_EAGER:
+        # テストなどでは登録せずにその場で実行する
+        call(registered, [payload])
+        return None
+
+    job = Job(
+        name=name,
+        payload=payload,
+        priority=registered.priority if priority is None else priority,
+        max_attempts=registered.max_attempts,
+        dedupe_key=make_dedupe_key(name, payload),
+        run_at=timezone.now() + (delay or timedelta()),
+    )
+    # 同じジョブが既に待っていれば一意制約で弾かれ、1 件にまとまる
+    Job.objects.bulk_create([job], ignore_conflicts=True)
+    return job
+
+
+def call(registered, payloads):
+    if registered.batch:
+        registered.func(payloads)
+    else:
+        for payload in payloads:
+            registered.func(**payload)
+
+
+def claim(limit, lanes=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+    # 実行可能なジョブを取り出し、lease_token を書き込んだものだけを自分の分とする。
+    # 期限切れのリースは落ちたワーカーの分なので取り直す (at-least-once)
+    now = timezone.now()
+    claimable = Q(status=Job.Status.QUEUED, run_at__lte=now) | Q(
+        status=Job.Status.RUNNING, locked_until__lt=now
+    )
+    candidates = Job.objects.filter(claimable)
+    if lanes is not None:
+        candidates = candidates.filter(priority__in=lanes)
+    ids = list(
+        candidates.order_by("priority", "run_at", "pk").values_list("pk", flat=True)[
+            :limit
+        ]
+    )
+    if not ids:
+        return []
+
+    # 選んでから書き込むまでに他のワーカーが取ったり、失敗して run_at を
+    # 先に延ばしたりしたものは取らないよう、同じ条件をもう一度付ける
+    token = uuid.uuid4().hex
+    Job.objects.filter(claimable, pk__in=ids).update(
+        status=Job.Status.RUNNING,
+        lease_token=token,
+        locked_until=now + timedelta(seconds=lease_seconds),
+        attempts=F("attempts") + 1,
+    )
+    return list(Job.objects.filter(lease_token=token).order_by("priority", "pk"))
+
+
+def backoff(attempts):
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def retry_or_fail(job, error):
+    fields = {"last_error": error, "lease_token": "", "locked_until": None}
+    if job.attempts >= job.max_attempts:
+        fields["status"] = Job.Status.FAILED
+    else:
+        fields["status"] = Job.Status.QUEUED
+        fields["run_at"] = timezone.now() + backoff(job.attempts)
+    # リースが切れて他のワーカーが取り直したジョブには書き込まない
+    owned = Job.objects.filter(pk=job.pk, lease_token=job.lease_token)
+    try:
+        with transaction.atomic():
+            updated = owned.update(**fields)
+    except IntegrityError:
+        # 同じ内容のジョブが新しく積まれているので、そちらに任せる
+        updated, _ = owned.delete()
+    if not updated:
+        logger.warning("job %s lost its lease before it was rescheduled", job.pk)
+    for name, value in fields.items():
+        setattr(job, name, value)
+
+
+def execute(jobs):
+    # 同じタスクのジョブはまとめて処理する
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.name, []).append(job)
+
+    for name, group in groups.items():
+        try:
+            registered = get_task(name)
+        except KeyError:
+            for job in group:
+                retry_or_fail(job, f"unknown task: {name}")
+            continue
+
+        batches = [group] if registered.batch else [[job] for job in group]
+        for batch in batches:
+            try:
+                with transaction.atomic():
+                    call(registered, [job.payload for job in batch])
+            except Exception as e:
+                logger.exception("job %s failed", name)
+                for job in batch:
+                    retry_or_fail(job, repr(e))
+            else:
+                finish(batch)
+
+
+def finish(batch):
+    # 同じ claim で取ったジョブは同じ lease_token を持つ。リースが切れて
+    # 他のワーカーが取り直したものは、そちらが終わらせる
+    ids = [job.pk for job in batch]
+    deleted, _ = Job.objects.filter(
+        pk__in=ids, lease_token=batch[0].lease_token
+    ).delete()
+    if deleted < len(ids):
+        logger.warning(
+            "%d of %d jobs lost their lease before they finished",
+            len(ids) - deleted,
+            len(ids),
+        )
+
+
+def run_pending(limit=100, lanes=None):
+    # 待ち行列が空になるまでこのプロセスで実行する (テストや管理コマンド用)
+    processed = 0
+    while True:
+        jobs = claim(limit, lanes=lanes)
+        if not jobs:
+            return processed
+        execute(jobs)
+        processed += len(jobs)
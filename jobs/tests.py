@@ -0,0 +1,139 @@
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import claim, enqueue, execute, run_pending, task
+
+calls = []
+
+
+@task(name="test.record")
+def record(value):
+    calls.append(value)
+
+
+@task(name="test.record_batch", batch=True)
+def record_batch(payloads):
+    calls.append(sorted(payload["value"] for payload in payloads))
+
+
+@task(name="test.fail", max_attempts=2)
+def fail():
+    raise ValueError("boom")
+
+
+@task(name="test.urgent", priority=Job.Priority.HIGH)
+def urgent(value):
+    calls.append(value)
+
+
+class TestJobQueue(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_success_enqueue_and_run(self):
+        record.enqueue(value=1)
+        self.assertEqual(calls, [])
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    def test_identical_jobs_are_coalesced(self):
+        record.enqueue(value=1)
+        record.enqueue(value=1)
+        record.enqueue(value=2)
+        self.assertEqual(Job.objects.count(), 2)
+        run_pending()
+        self.assertEqual(sorted(calls), [1, 2])
+
+    def test_batch_task_receives_payload_list(self):
+        for value in (3, 1, 2):
+            record_batch.enqueue(value=value)
+        run_pending()
+        self.assertEqual(calls, [[1, 2, 3]])
+
+    def test_high_priority_lane_runs_first(self):
+        record.enqueue(value="normal")
+        urgent.enqueue(value="urgent")
+        run_pending(limit=1)
+        self.assertEqual(calls, ["urgent", "normal"])
+
+    def test_lanes_filter(self):
+        record.enqueue(value="normal")
+        urgent.enqueue(value="urgent")
+        run_pending(lanes=[Job.Priority.NORMAL])
+        self.assertEqual(calls, ["normal"])
+        self.assertTrue(Job.objects.filter(name="test.urgent").exists())
+
+    def test_failed_job_is_retried_with_backoff(self):
+        fail.enqueue()
+        run_pending()
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.Status.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("boom", job.last_error)
+
+        Job.objects.update(run_at=timezone.now())
+        run_pending()
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_expired_lease_is_claimed_again(self):
+        record.enqueue(value=1)
+        claimed = claim(10)
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(claim(10), [])
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        run_pending()
+        self.assertEqual(calls, [1])
+
+    def test_claim_skips_job_rescheduled_after_select(self):
+        record.enqueue(value=1)
+        later = timezone.now() + timedelta(minutes=5)
+        token = uuid.uuid4()
+
+        def reschedule():
+            # 候補を選んだ後・書き込む前に、別のワーカーが run_at を延ばした
+            Job.objects.update(run_at=later)
+            return token
+
+        with mock.patch("jobs.queue.uuid.uuid4", side_effect=reschedule):
+            self.assertEqual(claim(10), [])
+        self.assertEqual(Job.objects.get().status, Job.Status.QUEUED)
+
+    def test_expired_lease_is_not_finished_by_previous_worker(self):
+        record.enqueue(value=1)
+        stale = claim(10)
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        # 遅れていたワーカーが終わる前に、別のワーカーが取り直した
+        fresh = claim(10)
+        with self.assertLogs("jobs.queue", "WARNING"):
+            execute(stale)
+        job = Job.objects.get()
+        self.assertEqual(job.lease_token, fresh[0].lease_token)
+        self.assertEqual(job.status, Job.Status.RUNNING)
+
+    def test_expired_lease_is_not_rescheduled_by_previous_worker(self):
+        fail.enqueue()
+        stale = claim(10)
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        fresh = claim(10)
+        with self.assertLogs("jobs.queue", "WARNING"):
+            execute(stale)
+        job = Job.objects.get()
+        self.assertEqual(job.lease_token, fresh[0].lease_token)
+        self.assertEqual(job.status, Job.Status.RUNNING)
+        self.assertEqual(job.last_error, "")
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_mode_runs_immediately(self):
+        enqueue("test.record", {"value": 1})
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
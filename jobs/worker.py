@@ -0,0 +1,36 @@
+import logging
+import signal
+import time
+
+from django.db import close_old_connections
+
+from core import invalidation
+
+from .queue import claim, execute
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    def __init__(self, lanes=None, batch_size=50, poll_interval=1.0):
+        self.lanes = lanes
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.stopping = False
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self, once=False):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopping:
+            close_old_connections()
+            invalidation.poll()
+            jobs = claim(self.batch_size, lanes=self.lanes)
+            if jobs:
+                execute(jobs)
+                continue
+            if once:
+                break
+            time.sleep(self.poll_interval)
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# 表示回数のバッファを定期的に、またプロセスの終了時に DB へ流す
+from tweets import impressions  # noqa: E402
+
+impressions.start_flusher()
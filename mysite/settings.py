@@ -40,6 +40,11 @@ INSTALLED_APPS = [
     "accounts.apps.AccountsConfig",
     "tweets.apps.TweetsConfig",
     "welcome.apps.WelcomeConfig",
+    "core.apps.CoreConfig",
+    "jobs.apps.JobsConfig",
+    "notifications.apps.NotificationsConfig",
+    "analytics.apps.AnalyticsConfig",
+    "outbox.apps.OutboxConfig",
 ]
 
 MIDDLEWARE = [
@@ -50,6 +55,10 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.ratelimit.RateLimitMiddleware",
+    "core.invalidation.InvalidationMiddleware",
+    "core.overload.OverloadMiddleware",
+    "core.profiling.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "mysite.urls"
@@ -80,10 +89,30 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+    },
+    # ツイートのシャードを試す用。TWEET_SHARDS に入れたときだけ使われる
+    "shard1": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "shard1.sqlite3",
+    },
 }
 
 
+# 古いツイートの移動先。別の SQLite ファイルに分けるときは DATABASES に
+# "archive" を追加してここを "archive" にする
+TWEET_ARCHIVE_DATABASE = "default"
+TWEET_ARCHIVE_AFTER_DAYS = 365
+
+# ツイート・いいね・リツイートを置く DB (tweets.shards)。ユーザーは全シャードに複製される。
+# ローカルで試すときは ["default", "shard1"] にして migrate --database shard1 も流す
+TWEET_SHARDS = ["default"]
+TWEET_SHARD_BUCKETS = 1024
+# シャードを増やしたときに動かしたバケツだけ書く {バケツ番号: DB}
+TWEET_SHARD_MAP = {}
+
+DATABASE_ROUTERS = ["tweets.routers.ArchiveRouter", "tweets.routers.ShardRouter"]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -120,6 +149,13 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+STATICFILES_DIRS = [BASE_DIR / "static"]
+
+STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# collectstatic でハッシュ付きファイル名と .gz / .br を作る
+STATICFILES_STORAGE = "core.staticfiles.CompressedManifestStaticFilesStorage"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -131,6 +167,157 @@ LOGIN_URL = "accounts:login"
 LOGIN_REDIRECT_URL = "accounts:home"
 LOGOUT_REDIRECT_URL = "accounts:login"
 
+# フォロー/フォロワー一覧を StreamingHttpResponse で分割して返す
+FRIENDSHIP_LIST_STREAMING = True
+FRIENDSHIP_LIST_CHUNK_SIZE = 500
+# データの書き出し (zip) で 1 回に読む件数
+DATA_EXPORT_CHUNK_SIZE = 1000
+
+# True にするとジョブをキューに積まずにその場で実行する (テスト用)
+JOBS_EAGER = False
+
+# 通知はこの秒数ごとの時間帯で 1 件にまとめる
+NOTIFICATION_BUCKET_SECONDS = 60 * 60
+# 通知ごとに覚えておく最近の actor の数。これより前の人がまた来ると 2 回数えてしまう
+NOTIFICATION_RECENT_ACTORS = 1000
+NOTIFICATION_PAGE_SIZE = 20
+
+# URL ごとの上限 (トークンバケツ)。"回数/s|m|h|d"
+# 既定では書き込み系のメソッドだけを数え、"methods" で変えられる
+RATELIMITS = {
+    "tweets:create": {"user": "30/m", "ip": "60/m"},
+    "tweets:reply": {"user": "30/m", "ip": "60/m"},
+    "tweets:schedule": {"user": "30/m", "ip": "60/m"},
+    "tweets:like": {"user": "120/m", "ip": "240/m"},
+    "tweets:unlike": {"user": "120/m", "ip": "240/m"},
+    "tweets:retweet": {"user": "60/m", "ip": "120/m"},
+    "tweets:unretweet": {"user": "60/m", "ip": "120/m"},
+    "accounts:follow": {"user": "60/m", "ip": "120/m"},
+    "accounts:unfollow": {"user": "60/m", "ip": "120/m"},
+    "accounts:block": {"user": "60/m", "ip": "120/m"},
+    "accounts:unblock": {"user": "60/m", "ip": "120/m"},
+    "accounts:mute": {"user": "60/m", "ip": "120/m"},
+    "accounts:unmute": {"user": "60/m", "ip": "120/m"},
+    "accounts:data_export": {"user": "3/h", "ip": "10/h", "methods": ["GET"]},
+}
+# 複数プロセスで上限を共有するなら "core.ratelimit.CacheStore"
+RATELIMIT_STORE = "core.ratelimit.LocalMemoryStore"
+
+PROFILE_TWEETS_PER_PAGE = 20
+
+# フォロー・ブロック・ミュート関係のプロセス内キャッシュ
+RELATIONSHIP_CACHE_TTL = 60
+RELATIONSHIP_CACHE_MAX_ENTRIES = 10_000
+
+# プロフィールの件数 (ツイート数・フォロー数など) をキャッシュする秒数
+PROFILE_STATS_CACHE_TTL = 5 * 60
+
+# ホームの「おすすめ順」。候補の件数・1 ページの件数・並びをキャッシュする秒数
+FEED_CANDIDATE_LIMIT = 1000
+FEED_PAGE_SIZE = 20
+FEED_RANK_CACHE_TTL = 30
+
+# ブロック・ミュートした人のツイートは取ってから落とすので、その分多めに読む倍率
+TIMELINE_OVERFETCH_FACTOR = 3
+
+# 投稿時の重複・スパム判定。直近 TWEET_FINGERPRINT_INDEX_SIZE 件と比べる
+# TWEET_DUPLICATE_ACTION: "flag" (印を付けて投稿) / "reject" (投稿させない) /
+# "ratelimit" (重複した投稿だけ TWEET_DUPLICATE_RATE で制限する)
+TWEET_DUPLICATE_ACTION = "flag"
+TWEET_DUPLICATE_RATE = "3/h"
+TWEET_FINGERPRINT_INDEX_SIZE = 100_000
+TWEET_FINGERPRINT_MIN_LENGTH = 20
+TWEET_NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# 集計で直近この秒数の分は次回に回す (コミット待ちの行を取りこぼさないため)
+ANALYTICS_ROLLUP_LAG_SECONDS = 60
+ANALYTICS_ROLLUP_BATCH_SIZE = 1000
+
+# 管理画面の一覧で数える件数の上限と、一括操作を 1 ジョブにまとめる件数
+ADMIN_COUNT_LIMIT = 10_000
+ADMIN_ACTION_BATCH_SIZE = 500
+
+# ツイート詳細で一度に出す返信の深さと件数。それより深い・多い返信は JSON で後から読む
+TWEET_REPLY_INLINE_DEPTH = 2
+TWEET_REPLY_PAGE_SIZE = 50
+# ブロック・ミュートで隠れた返信が続くとき、1 ページのために読み足す回数の上限
+TWEET_REPLY_MAX_SCANS = 5
+
+# 予約投稿 (tweets.scheduling)。dispatcher は LOOKAHEAD 秒先までの予約を最大 PREFETCH 件
+# 読んでおき、REFRESH 秒ごとに読み直す。同じ時刻の分は BATCH_SIZE 件ずつ投稿する
+SCHEDULED_TWEET_LOOKAHEAD_SECONDS = 60
+SCHEDULED_TWEET_PREFETCH = 5000
+SCHEDULED_TWEET_REFRESH_SECONDS = 10
+SCHEDULED_TWEET_BATCH_SIZE = 500
+
+# ツイート・いいね・フォロー・リツイートの主キー (core.snowflake)。
+# ワーカー番号 (0 - 1023) は各プロセスが起動後に DB から SNOWFLAKE_LEASE_SECONDS ずつ借りる。
+# SNOWFLAKE_WORKER_ID は全プロセスで同じ値になるので、1 プロセスだけで動かすとき以外は None のまま
+SNOWFLAKE_EPOCH_MS = 1_640_995_200_000  # 2022-01-01T00:00:00Z
+SNOWFLAKE_WORKER_ID = None
+SNOWFLAKE_LEASE_SECONDS = 10 * 60
+
+# 表示回数 (tweets.impressions)。この件数か秒数を超えたらジョブで DB にマージする。
+# 秒数は Web サーバーのプロセスでは表示がなくても別スレッドが見て流す
+IMPRESSION_BUFFER_EVENTS = 10_000
+IMPRESSION_FLUSH_SECONDS = 30
+
+# プロセス内キャッシュの無効化を他のワーカーに伝える方法。
+# "core.invalidation.DatabaseTransport" (共有テーブルを読みに行く) か
+# "core.invalidation.CacheTransport" (memcached / Redis などの共有キャッシュ)
+INVALIDATION_TRANSPORT = "core.invalidation.DatabaseTransport"
+INVALIDATION_POLL_SECONDS = 1
+INVALIDATION_READ_LIMIT = 500
+# 抜けた番号をこの秒数待っても届かなければ、キャッシュを全部捨てる
+INVALIDATION_GAP_SECONDS = 5
+# この秒数読めていなかったワーカーは、何を逃したか分からないので全部捨てる
+INVALIDATION_MAX_LAG_SECONDS = 60
+# 送った無効化を残しておく秒数 (INVALIDATION_MAX_LAG_SECONDS より長くする)
+INVALIDATION_RETENTION_SECONDS = 60 * 60
+
+# ツイート・いいね・フォローの変更イベント (outbox) の送り先。名前ごとにどこまで送ったかを持つ
+# "class" は write(events) を持つクラス。受け取れないときは outbox.sinks.Backpressure を投げる
+OUTBOX_SINKS = {
+    "ndjson": {
+        "class": "outbox.sinks.NDJSONSink",
+        "options": {"directory": BASE_DIR / "outbox_events"},
+    },
+}
+OUTBOX_BATCH_SIZE = 500
+# 1 回の送信で 1 つの DB から送る最大バッチ数 (他の DB を待たせない)
+OUTBOX_MAX_BATCHES = 10
+# id の抜けがあれば、この秒数はコミット待ちとみなして先に進まない
+OUTBOX_GAP_SECONDS = 30
+OUTBOX_POLL_SECONDS = 1
+
+# 重いビューの上限 (core.overload)。処理中の件数か、1 リクエストの DB 時間
+# (指数移動平均, ミリ秒) が超えたら、ホームは少し前のページを返し、他は 503 で断る。
+# 書き込み系はここに書かないので、重いビューが詰まっても削られない
+OVERLOAD_VIEWS = {
+    "accounts:home": {"max_in_flight": 8, "max_db_ms": 1000},
+    "accounts:user_profile": {"max_in_flight": 8, "max_db_ms": 1000},
+    "tweets:detail": {"max_in_flight": 8, "max_db_ms": 1000},
+}
+OVERLOAD_LATENCY_ALPHA = 0.2
+# DB が遅いと判断している間も、この秒数に 1 件は通して測り直す
+OVERLOAD_PROBE_SECONDS = 1
+OVERLOAD_RETRY_AFTER = 5
+# 過負荷のときに返す古いページを残しておく秒数と、作り直しを頼む間隔
+OVERLOAD_STALE_TTL = 15 * 60
+OVERLOAD_REFRESH_LOCK_SECONDS = 30
+
+# リクエストのプロファイル (core.profiling)。有効にすると PROFILING_VIEWS の URL 名、
+# PROFILING_HEADER を付けたスタッフのリクエスト、それ以外は PROFILING_SAMPLE_RATE の
+# 割合で測る。"cprofile" は .pstats、"sampler" はスタックを PROFILING_SAMPLE_INTERVAL 秒
+# ごとに数えた .collapsed を書く。まとめて見るには manage.py profile_report
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_VIEWS = []
+PROFILING_HEADER = "X-Profile"
+PROFILING_MODE = "sampler"
+PROFILING_SAMPLE_INTERVAL = 0.005
+PROFILING_DIRECTORY = BASE_DIR / "profiles"
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -16,9 +16,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from core.views import serve_static
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('accounts.urls')),
     path('tweets/', include('tweets.urls')),
+    path('notifications/', include('notifications.urls')),
     path('', include('welcome.urls')),
+    path('static/<path:path>', serve_static, name='static'),
 ]
@@ -0,0 +1,187 @@
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from tweets import shards
+from tweets.models import Tweet
+
+from .models import Notification, UnreadCounter
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def bucket_for(when):
+    # NOTIFICATION_BUCKET_SECONDS ごとに区切った時間帯の開始時刻
+    size = settings.NOTIFICATION_BUCKET_SECONDS
+    seconds = int((when - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % size)
+
+
+def aggregate(events):
+    # {(recipient_id, verb, tweet_id): [actor_id, ...]} にまとめる
+    # actor は重複なしで、最後が一番新しい人
+    groups = OrderedDict()
+    for event in events:
+        key = (event["recipient_id"], event["verb"], event.get("tweet_id"))
+        actors = groups.setdefault(key, [])
+        if event["actor_id"] in actors:
+            actors.remove(event["actor_id"])
+        actors.append(event["actor_id"])
+    return groups
+
+
+def record(events, now=None):
+    now = now or timezone.now()
+    bucket = bucket_for(now)
+    newly_unread = {}
+    for (recipient_id, verb, tweet_id), actor_ids in aggregate(events).items():
+        if upsert(recipient_id, verb, tweet_id, bucket, actor_ids, now):
+            newly_unread[recipient_id] = newly_unread.get(recipient_id, 0) + 1
+    for recipient_id, count in newly_unread.items():
+        increment_unread(recipient_id, count)
+
+
+def upsert(recipient_id, verb, tweet_id, bucket, actor_ids, now):
+    # 既存の行にまだ数えていない actor を足す。未読の行が増えたときだけ True を返す
+    limit = settings.NOTIFICATION_RECENT_ACTORS
+    group = Notification.objects.filter(
+        recipient_id=recipient_id, verb=verb, target_tweet_id=tweet_id, bucket=bucket
+    )
+    with transaction.atomic():
+        notification = group.select_for_update().first()
+        if notification is not None:
+            stored = notification.actor_ids
+            new = [actor_id for actor_id in actor_ids if actor_id not in stored]
+            if not new:
+                # 同じ人のいいねの付け直しなどは知らせ直さない
+                return False
+            was_read = notification.is_read
+            notification.actor_count += len(new)
+            recent = [actor_id for actor_id in stored if actor_id not in actor_ids]
+            notification.actor_ids = (recent + actor_ids)[-limit:]
+            notification.last_actor_id = actor_ids[-1]
+            notification.is_read = False
+            notification.updated_at = now
+            notification.save(
+                update_fields=[
+                    "actor_count",
+                    "actor_ids",
+                    "last_actor",
+                    "is_read",
+                    "updated_at",
+                ]
+            )
+            return was_read
+    try:
+        with transaction.atomic():
+            Notification.objects.create(
+                recipient_id=recipient_id,
+                verb=verb,
+                target_tweet_id=tweet_id,
+                bucket=bucket,
+                actor_count=len(actor_ids),
+                actor_ids=actor_ids[-limit:],
+                last_actor_id=actor_ids[-1],
+                updated_at=now,
+            )
+    except IntegrityError:
+        # 同時に作られていたら、そちらに足し直す
+        return upsert(recipient_id, verb, tweet_id, bucket, actor_ids, now)
+    return True
+
+
+def increment_unread(user_id, count):
+    if UnreadCounter.objects.filter(user_id=user_id).update(count=F("count") + count):
+        return
+    try:
+        with transaction.atomic():
+            UnreadCounter.objects.create(user_id=user_id, count=count)
+    except IntegrityError:
+        UnreadCounter.objects.filter(user_id=user_id).update(count=F("count") + count)
+
+
+def unread_count(user):
+    counter = UnreadCounter.objects.filter(user=user).values_list("count", flat=True)
+    return counter.first() or 0
+
+
+def mark_all_read(user):
+    with transaction.atomic():
+        Notification.objects.filter(recipient=user, is_read=False).update(is_read=True)
+        UnreadCounter.objects.filter(user=user).update(count=0)
+
+
+def delete_in_batches(notifications, batch_size):
+    # 消した未読の件数だけ未読カウンタを減らす
+    total = 0
+    while True:
+        rows = list(
+            notifications.values_list("pk", "recipient_id", "is_read")[:batch_size]
+        )
+        if not rows:
+            return total
+        unread = Counter(
+            recipient_id for _, recipient_id, is_read in rows if not is_read
+        )
+        with transaction.atomic():
+            Notification.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+            for recipient_id, count in unread.items():
+                UnreadCounter.objects.filter(user_id=recipient_id).update(
+                    count=Greatest(F("count") - count, 0)
+                )
+        total += len(rows)
+
+
+def encode_cursor(notification):
+    micros = (notification.updated_at - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}_{notification.pk}"
+
+
+def decode_cursor(cursor):
+    micros, pk = cursor.split("_")
+    return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+
+
+def page(user, cursor=None, size=None):
+    # (updated_at, id) のキーセットで 1 ページ分を 1 クエリで取る
+    size = size or settings.NOTIFICATION_PAGE_SIZE
+    notifications = (
+        Notification.objects.filter(recipient=user)
+        .select_related("last_actor")
+        .order_by("-updated_at", "-pk")
+    )
+    if not shards.is_sharded():
+        notifications = notifications.filter(
+            Q(target_tweet__isnull=True) | Q(target_tweet__deleted_at__isnull=True)
+        ).select_related("target_tweet")
+    if cursor:
+        updated_at, pk = decode_cursor(cursor)
+        notifications = notifications.filter(
+            Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, pk__lt=pk)
+        )
+    rows = list(notifications[: size + 1])
+    next_cursor = encode_cursor(rows[size - 1]) if len(rows) > size else None
+    rows = rows[:size]
+    if shards.is_sharded():
+        rows = attach_tweets(rows)
+    return rows, next_cursor
+
+
+def attach_tweets(notifications):
+    # ツイートは別のシャードにあるので後から引き、削除されたものは外す
+    ids = [n.target_tweet_id for n in notifications if n.target_tweet_id]
+    tweets = shards.in_bulk(Tweet.objects.all(), ids)
+    rows = []
+    for notification in notifications:
+        if notification.target_tweet_id:
+            if notification.target_tweet_id not in tweets:
+                continue
+            notification.target_tweet = tweets[notification.target_tweet_id]
+        rows.append(notification)
+    return rows
@@ -0,0 +1,20 @@
+# Generated by Django 4.0.10 on 2026-10-19 18:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0011_alter_tweet_parent'),
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='target_tweet',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='tweets.tweet'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.contrib.auth import get_user_model
+from django.db import models
+from django.utils import timezone
+
+from tweets.models import Tweet
+
+User = get_user_model()
+
+
+class Notification(models.Model):
+    # 同じ相手・種類・ツイート・時間帯のイベントは 1 行にまとめる
+    class Verb(models.TextChoices):
+        LIKE = "like", "いいね"
+        FOLLOW = "follow", "フォロー"
+
+    recipient = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="notifications"
+    )
+    verb = models.CharField(max_length=10, choices=Verb.choices)
+    # ツイートは別のシャードにあることがあるので DB の外部キー制約は付けない
+    target_tweet = models.ForeignKey(
+        Tweet, on_delete=models.CASCADE, null=True, blank=True, db_constraint=False
+    )
+    bucket = models.DateTimeField()
+    # 何人から来たか。actor_ids に最近の人を NOTIFICATION_RECENT_ACTORS 人まで持ち、
+    # 同じ人を 2 回数えない
+    actor_count = models.PositiveIntegerField(default=0)
+    actor_ids = models.JSONField(default=list, blank=True)
+    last_actor = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, related_name="+"
+    )
+    is_read = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["recipient", "verb", "target_tweet", "bucket"],
+                condition=models.Q(target_tweet__isnull=False),
+                name="notification_tweet_bucket_unique",
+            ),
+            models.UniqueConstraint(
+                fields=["recipient", "verb", "bucket"],
+                condition=models.Q(target_tweet__isnull=True),
+                name="notification_bucket_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["recipient", "-updated_at", "-id"],
+                name="notification_inbox_idx",
+            ),
+        ]
+
+    @property
+    def others_count(self):
+        return self.actor_count - 1
+
+
+class UnreadCounter(models.Model):
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="+"
+    )
+    count = models.PositiveIntegerField(default=0)
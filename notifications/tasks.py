@@ -0,0 +1,8 @@
+from jobs.queue import task
+
+from . import inbox
+
+
+@task(name="notifications.notify", batch=True)
+def notify(events):
+    inbox.record(events)
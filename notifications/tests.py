@@ -0,0 +1,145 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from jobs.queue import run_pending
+from tweets.models import Tweet
+
+from . import inbox
+from .models import Notification, UnreadCounter
+
+User = get_user_model()
+
+
+class TestNotificationAggregation(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.tweet = Tweet.objects.create(user=self.user, content="example_tweet")
+        self.fans = [
+            User.objects.create_user(username=f"fan{i}", email=f"fan{i}@example.com")
+            for i in range(3)
+        ]
+
+    def like_event(self, actor):
+        return {
+            "recipient_id": self.user.pk,
+            "verb": "like",
+            "tweet_id": self.tweet.pk,
+            "actor_id": actor.pk,
+        }
+
+    def test_likes_are_grouped_into_one_entry(self):
+        inbox.record([self.like_event(fan) for fan in self.fans])
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(notification.last_actor, self.fans[-1])
+        self.assertEqual(inbox.unread_count(self.user), 1)
+
+        inbox.record([self.like_event(self.fans[0])])
+        self.assertEqual(Notification.objects.get().actor_count, 3)
+        self.assertEqual(inbox.unread_count(self.user), 1)
+
+    def test_actors_are_counted_once(self):
+        fan = self.fans[0]
+        inbox.record([self.like_event(fan), self.like_event(fan)])
+        self.assertEqual(Notification.objects.get().actor_count, 1)
+        inbox.mark_all_read(self.user)
+        inbox.record([self.like_event(fan)])
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 1)
+        self.assertTrue(notification.is_read)
+        inbox.record([self.like_event(self.fans[1]), self.like_event(fan)])
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(notification.last_actor, fan)
+        self.assertEqual(inbox.unread_count(self.user), 1)
+
+    @override_settings(NOTIFICATION_RECENT_ACTORS=2)
+    def test_only_recent_actors_are_kept(self):
+        inbox.record([self.like_event(fan) for fan in self.fans])
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(notification.actor_ids, [self.fans[1].pk, self.fans[2].pk])
+
+    def test_new_bucket_creates_new_entry(self):
+        now = timezone.now()
+        inbox.record([self.like_event(self.fans[0])], now=now)
+        inbox.record([self.like_event(self.fans[1])], now=now + timedelta(days=1))
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(inbox.unread_count(self.user), 2)
+
+    def test_read_entry_becomes_unread_again(self):
+        inbox.record([self.like_event(self.fans[0])])
+        inbox.mark_all_read(self.user)
+        self.assertEqual(inbox.unread_count(self.user), 0)
+        inbox.record([self.like_event(self.fans[1])])
+        self.assertFalse(Notification.objects.get().is_read)
+        self.assertEqual(inbox.unread_count(self.user), 1)
+
+    @override_settings(NOTIFICATION_PAGE_SIZE=2)
+    def test_keyset_pagination(self):
+        now = timezone.now()
+        for i in range(5):
+            inbox.record([self.like_event(self.fans[0])], now=now - timedelta(days=i))
+        first, cursor = inbox.page(self.user)
+        second, cursor = inbox.page(self.user, cursor=cursor)
+        third, cursor = inbox.page(self.user, cursor=cursor)
+        self.assertIsNone(cursor)
+        pages = [n.pk for n in first + second + third]
+        expected = list(
+            Notification.objects.order_by("-updated_at").values_list("pk", flat=True)
+        )
+        self.assertEqual(pages, expected)
+
+
+class TestNotificationViews(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="sample2", email="sample2@example.com", password="testpassword2"
+        )
+        self.tweet = Tweet.objects.create(user=self.user, content="example_tweet")
+
+    def test_like_enqueues_notification(self):
+        self.client.force_login(self.user2)
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        self.assertFalse(Notification.objects.exists())
+        run_pending()
+        notification = Notification.objects.get()
+        self.assertEqual(notification.recipient, self.user)
+        self.assertEqual(notification.target_tweet, self.tweet)
+
+    def test_own_like_is_not_notified(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk}))
+        run_pending()
+        self.assertFalse(Notification.objects.exists())
+
+    @override_settings(JOBS_EAGER=True)
+    def test_follow_notification_in_inbox(self):
+        self.client.force_login(self.user2)
+        self.client.post(reverse("accounts:follow", kwargs={"username": "sample"}))
+        self.assertTrue(FriendShip.objects.exists())
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("notifications:inbox"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["unread_count"], 1)
+        self.assertContains(response, "sample2さん")
+
+        response = self.client.post(reverse("notifications:mark_all_read"))
+        self.assertRedirects(response, reverse("notifications:inbox"))
+        self.assertEqual(UnreadCounter.objects.get(user=self.user).count, 0)
+
+    def test_failure_get_with_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("notifications:inbox"), {"cursor": "x"})
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import views
+
+app_name = "notifications"
+urlpatterns = [
+    path("", views.InboxView.as_view(), name="inbox"),
+    path("read/", views.MarkAllReadView.as_view(), name="mark_all_read"),
+]
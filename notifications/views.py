@@ -0,0 +1,30 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404, HttpResponseRedirect
+from django.urls import reverse_lazy
+from django.views import View
+from django.views.generic import TemplateView
+
+from . import inbox
+
+
+class InboxView(LoginRequiredMixin, TemplateView):
+    template_name = "notifications/inbox.html"
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        try:
+            notifications, next_cursor = inbox.page(
+                self.request.user, cursor=self.request.GET.get("cursor")
+            )
+        except ValueError:
+            raise Http404
+        ctx["notifications"] = notifications
+        ctx["next_cursor"] = next_cursor
+        ctx["unread_count"] = inbox.unread_count(self.request.user)
+        return ctx
+
+
+class MarkAllReadView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        inbox.mark_all_read(request.user)
+        return HttpResponseRedirect(reverse_lazy("notifications:inbox"))
@@ -0,0 +1,23 @@
+from django.contrib import admin
+
+from core.admin import LargeTableAdmin
+
+from .models import Checkpoint, OutboxEvent
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(LargeTableAdmin):
+    list_display = ("id", "topic", "key", "created_at")
+    list_filter = ("topic",)
+    search_fields = ("=key",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Checkpoint)
+class CheckpointAdmin(admin.ModelAdmin):
+    list_display = ("consumer", "database", "last_id", "updated_at")
@@ -0,0 +1,86 @@
+from .models import OutboxEvent
+
+TWEET_CREATED = "tweet.created"
+TWEET_DELETED = "tweet.deleted"
+LIKE_CREATED = "like.created"
+LIKE_DELETED = "like.deleted"
+RETWEET_CREATED = "retweet.created"
+RETWEET_DELETED = "retweet.deleted"
+FOLLOW_CREATED = "follow.created"
+FOLLOW_DELETED = "follow.deleted"
+
+
+def record(topic, key, payload, using="default"):
+    # 呼ぶ側で transaction.atomic(using=using) に入れて、変更と一緒にコミットする
+    return OutboxEvent.objects.using(using).create(
+        topic=topic, key=key, payload=payload
+    )
+
+
+def tweet_changed(topic, tweet):
+    return record(
+        topic,
+        tweet.pk,
+        {
+            "user_id": tweet.user_id,
+            "content": tweet.content,
+            "parent_id": tweet.parent_id,
+            "created_at": tweet.created_at,
+            "deleted_at": tweet.deleted_at,
+        },
+        using=tweet._state.db,
+    )
+
+
+def like_changed(topic, like):
+    return record(
+        topic,
+        like.pk,
+        {"tweet_id": like.target_tweet_id, "user_id": like.user_id},
+        using=like._state.db,
+    )
+
+
+def retweet_changed(topic, retweet):
+    return record(
+        topic,
+        retweet.pk,
+        {"tweet_id": retweet.tweet_id, "user_id": retweet.user_id},
+        using=retweet._state.db,
+    )
+
+
+def follow_changed(topic, friendship):
+    return record(
+        topic,
+        friendship.pk,
+        {
+            "follower_id": friendship.follower_id,
+            "following_id": friendship.following_id,
+        },
+        using=friendship._state.db,
+    )
+
+
+def delete_each(queryset, topic, changed):
+    # 1 件ずつイベントを書いてから消す (呼ぶ側で transaction.atomic に入れる)
+    rows = list(queryset.select_for_update())
+    for row in rows:
+        changed(topic, row)
+    return queryset.filter(pk__in=[row.pk for row in rows]).delete()
+
+
+def delete_tweets(queryset):
+    return delete_each(queryset, TWEET_DELETED, tweet_changed)
+
+
+def delete_likes(queryset):
+    return delete_each(queryset, LIKE_DELETED, like_changed)
+
+
+def delete_retweets(queryset):
+    return delete_each(queryset, RETWEET_DELETED, retweet_changed)
+
+
+def delete_follows(queryset):
+    return delete_each(queryset, FOLLOW_DELETED, follow_changed)
@@ -0,0 +1,47 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from outbox import relay
+
+
+class Command(BaseCommand):
+    help = "outbox のイベントを OUTBOX_SINKS の送り先に順番に送る"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sink",
+            action="append",
+            dest="sinks",
+            help="送り先の名前 (複数指定可、既定はすべて)",
+        )
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument(
+            "--once", action="store_true", help="溜まっている分を送ったら終わる"
+        )
+        parser.add_argument(
+            "--prune", action="store_true", help="送り終えたイベントを消す"
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        relays = relay.relays(options["sinks"], options["batch_size"])
+        while not self.stopping:
+            close_old_connections()
+            sent = sum(r.run_once() for r in relays)
+            if options["prune"]:
+                relay.prune(options["batch_size"])
+            if sent:
+                self.stdout.write(f"{sent} 件送りました")
+                continue
+            if options["once"]:
+                break
+            time.sleep(settings.OUTBOX_POLL_SECONDS)
+
+    def stop(self, *args):
+        self.stopping = True
@@ -0,0 +1,28 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+
+
+class OutboxEvent(models.Model):
+    # 変更と同じ DB・同じトランザクションで書くイベント。
+    # ツイート・いいねは投稿者のシャードに、フォローは default に書くので、id の順番は DB ごと
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(max_length=50)  # "tweet.created" など
+    key = models.BigIntegerField()  # 変わったもの (ツイート・いいね・フォロー) の id
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+
+
+class Checkpoint(models.Model):
+    # 送り先 (consumer) ごと・DB ごとに、どこまで送ったか
+    consumer = models.CharField(max_length=50)
+    database = models.CharField(max_length=50)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["consumer", "database"], name="outbox_checkpoint_unique"
+            )
+        ]
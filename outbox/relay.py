@@ -0,0 +1,112 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+
+from tweets import shards
+
+from . import sinks
+from .models import Checkpoint, OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def databases():
+    # フォローは default、ツイート・いいねは各シャードに書かれる
+    return ["default", *(alias for alias in shards.aliases() if alias != "default")]
+
+
+def ready(events, after, now):
+    # id の抜けは、先に採番したトランザクションがまだコミットされていないだけかもしれない。
+    # 抜けの後ろのイベントが OUTBOX_GAP_SECONDS より新しければ、そこで止めて次回に回す
+    gap = timedelta(seconds=settings.OUTBOX_GAP_SECONDS)
+    expected = after + 1
+    for i, event in enumerate(events):
+        if event.id != expected and now - event.created_at < gap:
+            return events[:i]
+        expected = event.id + 1
+    return events
+
+
+class Relay:
+    # 1 つの送り先 (consumer) に、DB ごとの id 順でイベントを送る。
+    # 送ってからチェックポイントを進めるので、落ちたときは同じイベントをもう一度送ることがある
+    # (受け取る側は database と id で重複を捨てる)
+    def __init__(self, consumer, sink, batch_size=None, clock=timezone.now):
+        self.consumer = consumer
+        self.sink = sink
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+        self.clock = clock
+        self.paused_until = 0.0
+
+    def pump(self, database, max_batches=None):
+        checkpoint, _ = Checkpoint.objects.get_or_create(
+            consumer=self.consumer, database=database
+        )
+        sent = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            events = list(
+                OutboxEvent.objects.using(database)
+                .filter(id__gt=checkpoint.last_id)
+                .order_by("id")[: self.batch_size]
+            )
+            events = ready(events, checkpoint.last_id, self.clock())
+            if not events:
+                break
+            self.sink.write(events)
+            checkpoint.last_id = events[-1].id
+            checkpoint.save(update_fields=["last_id", "updated_at"])
+            sent += len(events)
+            batches += 1
+            if len(events) < self.batch_size:
+                break
+        return sent
+
+    def run_once(self):
+        # 1 つの DB が他を待たせないよう、DB ごとに OUTBOX_MAX_BATCHES 回まで送る。
+        # 送り先が Backpressure を投げたら、指定された秒数この consumer を止める
+        if time.monotonic() < self.paused_until:
+            return 0
+        sent = 0
+        for database in databases():
+            try:
+                sent += self.pump(database, settings.OUTBOX_MAX_BATCHES)
+            except sinks.Backpressure as e:
+                logger.info("%s: %s 秒待ちます", self.consumer, e.retry_after)
+                self.paused_until = time.monotonic() + e.retry_after
+                break
+        return sent
+
+
+def relays(names=None, batch_size=None):
+    return [
+        Relay(name, sinks.load(config), batch_size)
+        for name, config in settings.OUTBOX_SINKS.items()
+        if names is None or name in names
+    ]
+
+
+def prune(batch_size=None):
+    # 全ての送り先が送り終えたイベントを消す。チェックポイントの無い送り先があれば消さない
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    consumers = set(settings.OUTBOX_SINKS)
+    deleted = 0
+    for database in databases():
+        checkpoints = Checkpoint.objects.filter(
+            database=database, consumer__in=consumers
+        )
+        if checkpoints.count() < len(consumers):
+            continue
+        done = checkpoints.aggregate(last_id=Min("last_id"))["last_id"]
+        events = OutboxEvent.objects.using(database).filter(id__lte=done)
+        while True:
+            ids = list(events.order_by("id").values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+            OutboxEvent.objects.using(database).filter(id__in=ids).delete()
+            deleted += len(ids)
+    return deleted
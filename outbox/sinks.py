@@ -0,0 +1,59 @@
+import json
+import os
+from pathlib import Path
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+class Backpressure(Exception):
+    # 送り先が受け取れないとき sink が投げる。relay は retry_after 秒待ってから送り直す
+    def __init__(self, retry_after=1.0):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+def as_dict(event):
+    return {
+        "id": event.id,
+        "database": event._state.db,
+        "topic": event.topic,
+        "key": event.key,
+        "payload": event.payload,
+        "created_at": event.created_at,
+    }
+
+
+class NDJSONSink:
+    # 日付ごとのファイルに 1 行 1 イベントで追記する。書いたら fsync してから返す
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def path(self):
+        return self.directory / f"events-{timezone.now():%Y-%m-%d}.ndjson"
+
+    def write(self, events):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        lines = "".join(
+            json.dumps(as_dict(event), cls=DjangoJSONEncoder) + "\n" for event in events
+        )
+        with open(self.path(), "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class CallbackSink:
+    # callback (関数か "module.func" の文字列) にイベントの dict のリストを渡す
+    def __init__(self, callback):
+        self.callback = (
+            import_string(callback) if isinstance(callback, str) else callback
+        )
+
+    def write(self, events):
+        self.callback([as_dict(event) for event in events])
+
+
+def load(config):
+    return import_string(config["class"])(**config.get("options", {}))
@@ -0,0 +1,223 @@
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts import purge
+from accounts.models import FriendShip
+from accounts.tasks import delete_friendships
+from tweets.models import Like, Retweet, Tweet
+from tweets.tasks import delete_likes, soft_delete
+
+from . import events, relay, sinks
+from .models import Checkpoint, OutboxEvent
+
+User = get_user_model()
+
+
+class TestOutboxEvents(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.user2 = User.objects.create_user(
+            username="sample2", email="sample2@example.com", password="testpassword2"
+        )
+        self.client.force_login(self.user)
+
+    def topics(self):
+        return list(OutboxEvent.objects.order_by("id").values_list("topic", "key"))
+
+    def test_tweet_create_and_delete(self):
+        self.client.post(reverse("tweets:create"), {"content": "hello"})
+        tweet = Tweet.objects.get()
+        self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        self.assertEqual(
+            self.topics(),
+            [(events.TWEET_CREATED, tweet.pk), (events.TWEET_DELETED, tweet.pk)],
+        )
+        deleted = OutboxEvent.objects.get(topic=events.TWEET_DELETED)
+        self.assertEqual(deleted.payload["user_id"], self.user.pk)
+        self.assertIsNotNone(deleted.payload["deleted_at"])
+
+    def test_like_and_unlike(self):
+        tweet = Tweet.objects.create(user=self.user2, content="hello")
+        self.client.post(reverse("tweets:like", kwargs={"pk": tweet.pk}))
+        self.client.post(reverse("tweets:like", kwargs={"pk": tweet.pk}))
+        self.client.post(reverse("tweets:unlike", kwargs={"pk": tweet.pk}))
+        self.assertEqual(
+            [topic for topic, _ in self.topics()],
+            [events.LIKE_CREATED, events.LIKE_DELETED],
+        )
+        self.assertEqual(
+            OutboxEvent.objects.first().payload,
+            {"tweet_id": tweet.pk, "user_id": self.user.pk},
+        )
+
+    def test_follow_unfollow_and_block(self):
+        self.client.post(reverse("accounts:follow", kwargs={"username": "sample2"}))
+        self.client.post(reverse("accounts:unfollow", kwargs={"username": "sample2"}))
+        FriendShip.objects.create(follower=self.user2, following=self.user)
+        self.client.post(reverse("accounts:block", kwargs={"username": "sample2"}))
+        self.assertEqual(
+            [topic for topic, _ in self.topics()],
+            [events.FOLLOW_CREATED, events.FOLLOW_DELETED, events.FOLLOW_DELETED],
+        )
+
+    def test_retweet_and_unretweet(self):
+        tweet = Tweet.objects.create(user=self.user2, content="hello")
+        self.client.post(reverse("tweets:retweet", kwargs={"pk": tweet.pk}))
+        self.client.post(reverse("tweets:retweet", kwargs={"pk": tweet.pk}))
+        self.client.post(reverse("tweets:unretweet", kwargs={"pk": tweet.pk}))
+        self.assertEqual(
+            [topic for topic, _ in self.topics()],
+            [events.RETWEET_CREATED, events.RETWEET_DELETED],
+        )
+        self.assertEqual(
+            OutboxEvent.objects.first().payload,
+            {"tweet_id": tweet.pk, "user_id": self.user.pk},
+        )
+
+    @override_settings(JOBS_EAGER=True)
+    def test_admin_tasks(self):
+        tweet = Tweet.objects.create(user=self.user2, content="hello")
+        like = Like.objects.create(target_tweet=tweet, user=self.user)
+        friendship = FriendShip.objects.create(follower=self.user, following=self.user2)
+        soft_delete.enqueue(ids=[tweet.pk])
+        delete_likes.enqueue(ids=[like.pk])
+        delete_friendships.enqueue(ids=[friendship.pk])
+        self.assertEqual(
+            self.topics(),
+            [
+                (events.TWEET_DELETED, tweet.pk),
+                (events.LIKE_DELETED, like.pk),
+                (events.FOLLOW_DELETED, friendship.pk),
+            ],
+        )
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(FriendShip.objects.exists())
+
+    def test_purge_user(self):
+        tweet = Tweet.objects.create(user=self.user2, content="hello")
+        mine = Tweet.objects.create(user=self.user, content="mine")
+        like = Like.objects.create(target_tweet=mine, user=self.user2)
+        retweet = Retweet.objects.create(tweet=mine, user=self.user2)
+        friendship = FriendShip.objects.create(follower=self.user2, following=self.user)
+        purge.purge_user(self.user2, batch_size=10)
+        self.assertEqual(
+            self.topics(),
+            [
+                (events.LIKE_DELETED, like.pk),
+                (events.RETWEET_DELETED, retweet.pk),
+                (events.FOLLOW_DELETED, friendship.pk),
+                (events.TWEET_DELETED, tweet.pk),
+            ],
+        )
+
+    def test_change_is_rolled_back_with_event(self):
+        with mock.patch.object(events, "record", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse("tweets:create"), {"content": "hello"})
+        self.assertFalse(Tweet.objects.exists())
+
+    def test_retweet_is_rolled_back_with_event(self):
+        tweet = Tweet.objects.create(user=self.user2, content="hello")
+        with mock.patch.object(events, "record", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse("tweets:retweet", kwargs={"pk": tweet.pk}))
+        self.assertFalse(Retweet.objects.exists())
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.retweet_count, 0)
+
+
+@override_settings(OUTBOX_GAP_SECONDS=30, OUTBOX_BATCH_SIZE=2)
+class TestRelay(TestCase):
+    def setUp(self):
+        self.received = []
+        self.now = timezone.now()
+        self.relay = relay.Relay(
+            "test", sinks.CallbackSink(self.receive), clock=lambda: self.now
+        )
+
+    def receive(self, batch):
+        self.received.append([event["key"] for event in batch])
+
+    def event(self, key, **kwargs):
+        return OutboxEvent.objects.create(
+            topic="tweet.created", key=key, payload={}, **kwargs
+        )
+
+    def test_sends_in_order_and_checkpoints(self):
+        for key in range(5):
+            self.event(key)
+        self.assertEqual(self.relay.run_once(), 5)
+        self.assertEqual(self.received, [[0, 1], [2, 3], [4]])
+        self.assertEqual(self.relay.run_once(), 0)
+        checkpoint = Checkpoint.objects.get(consumer="test", database="default")
+        self.assertEqual(checkpoint.last_id, OutboxEvent.objects.last().id)
+
+    def test_waits_for_uncommitted_gap(self):
+        first = self.event(1)
+        self.event(3, id=first.id + 2)
+        self.relay.run_once()
+        self.assertEqual(self.received, [[1]])
+        # 抜けた id が後からコミットされた
+        self.event(2, id=first.id + 1)
+        self.relay.run_once()
+        self.assertEqual(self.received, [[1], [2, 3]])
+
+    def test_skips_gap_after_timeout(self):
+        first = self.event(1)
+        self.event(3, id=first.id + 2)
+        self.relay.run_once()
+        self.now += timedelta(seconds=31)
+        self.relay.run_once()
+        self.assertEqual(self.received, [[1], [3]])
+
+    def test_backpressure_keeps_checkpoint(self):
+        self.event(1)
+        self.relay.sink = sinks.CallbackSink(
+            mock.Mock(side_effect=sinks.Backpressure(retry_after=0))
+        )
+        self.assertEqual(self.relay.run_once(), 0)
+        self.relay.sink = sinks.CallbackSink(self.receive)
+        self.relay.run_once()
+        self.assertEqual(self.received, [[1]])
+
+
+class TestRelayCommand(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_writes_ndjson_and_prunes(self):
+        user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        tweet = Tweet.objects.create(user=user, content="hello")
+        events.tweet_changed(events.TWEET_CREATED, tweet)
+        config = {
+            "ndjson": {
+                "class": "outbox.sinks.NDJSONSink",
+                "options": {"directory": self.directory},
+            }
+        }
+        with override_settings(OUTBOX_SINKS=config):
+            call_command("relay_outbox", "--once", "--prune", stdout=StringIO())
+        path = sinks.NDJSONSink(self.directory).path()
+        lines = path.read_text().splitlines()
+        self.assertEqual(len(lines), 1)
+        event = json.loads(lines[0])
+        self.assertEqual(event["topic"], events.TWEET_CREATED)
+        self.assertEqual(event["key"], tweet.pk)
+        self.assertEqual(event["database"], "default")
+        self.assertFalse(OutboxEvent.objects.exists())
@@ -0,0 +1,82 @@
+// いいねボタンの処理
+// URL はテンプレート側で data-like-url / data-unlike-url に埋め込んでいる
+(() => {
+    // csrf対策用のもの
+    function getCookie(name) {
+        let cookieValue = null;
+        if (document.cookie && document.cookie !== '') {
+            const cookies = document.cookie.split(';');
+            for (let i = 0; i < cookies.length; i++) {
+                const cookie = cookies[i].trim();
+                // Does this cookie string begin with the name we want?
+                if (cookie.substring(0, name.length + 1) === (name + '=')) {
+                    cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+                    break;
+                }
+            }
+        }
+        return cookieValue;
+    }
+    const csrftoken = getCookie('csrftoken');
+
+    const changeStyles = (jsonResponse, el) => {
+        if (el.dataset.isLiked == "false") {
+            el.dataset.isLiked = "true"
+            el.innerHTML = '<i class="fa fa-heart" aria-hidden="false" style="color:red"></i>';
+        } else {
+            el.dataset.isLiked = "false"
+            el.innerHTML = '<i class="fa fa-heart-o" aria-hidden="true"></i>';
+        }
+
+        // id は 2^53 を超えるので JSON の数値ではなくボタンの data-tweet-id を使う
+        const counts = document.getElementsByName(el.dataset.tweetId + "_count")
+        counts[0].textContent = jsonResponse.like_count + "件のいいね";
+    }
+
+    //クリック時の処理
+    async function likeButtonClicked(event) {
+        event.preventDefault()
+
+        const element = event.currentTarget;
+        const url = element.dataset.isLiked == 'true' ? element.dataset.unlikeUrl : element.dataset.likeUrl
+
+        const postData = {
+            method: "POST",
+            headers: {
+                "Content-Type": "application/json",
+                "X-CSRFToken": csrftoken,
+            },
+        };
+
+        const response = await fetch(url, postData)
+        const json = await response.json();//json形式に変換
+        changeStyles(json, element)
+    };
+
+    document.querySelectorAll('[data-button="like"]').forEach(likeButton => {
+        likeButton.addEventListener("click", likeButtonClicked);
+    })
+
+    // リツイートボタンも同じ流れで切り替える
+    async function retweetButtonClicked(event) {
+        event.preventDefault()
+
+        const element = event.currentTarget;
+        const retweeted = element.dataset.isRetweeted == 'true'
+        const url = retweeted ? element.dataset.unretweetUrl : element.dataset.retweetUrl
+
+        const response = await fetch(url, {
+            method: "POST",
+            headers: {"X-CSRFToken": csrftoken},
+        })
+        const json = await response.json();
+        element.dataset.isRetweeted = retweeted ? "false" : "true"
+        element.firstElementChild.style.color = retweeted ? "" : "green"
+        const counts = document.getElementsByName(element.dataset.tweetId + "_retweet_count")
+        counts[0].textContent = json.retweet_count + "件のリツイート";
+    };
+
+    document.querySelectorAll('[data-button="retweet"]').forEach(retweetButton => {
+        retweetButton.addEventListener("click", retweetButtonClicked);
+    })
+})();
@@ -0,0 +1,53 @@
+// 深い返信や続きのページを JSON で読み込んで、ボタンの位置に差し込む
+// data-indent は差し込む行の字下げ (ボタンを囲む要素からの相対)
+(() => {
+    const renderReply = (reply, indent) => {
+        const row = document.createElement('div');
+        row.style.marginLeft = (indent + reply.indent) + 'em';
+
+        const p = document.createElement('p');
+        const user = document.createElement('a');
+        user.href = reply.user_url;
+        user.textContent = reply.username;
+        const content = document.createElement('a');
+        content.href = reply.url;
+        content.textContent = reply.content;
+        p.append(user, ': ', content);
+        row.appendChild(p);
+
+        if (reply.replies_url) {
+            row.appendChild(makeButton(reply.replies_url, reply.reply_count + '件の返信を見る', 1));
+        }
+        return row;
+    };
+
+    const makeButton = (url, label, indent) => {
+        const button = document.createElement('button');
+        button.dataset.button = 'replies';
+        button.dataset.repliesUrl = url;
+        button.dataset.indent = indent;
+        button.textContent = label;
+        button.addEventListener('click', loadReplies);
+        return button;
+    };
+
+    async function loadReplies(event) {
+        event.preventDefault();
+        const button = event.currentTarget;
+        const indent = Number(button.dataset.indent || 0);
+        const response = await fetch(button.dataset.repliesUrl);
+        const json = await response.json();
+
+        const rows = json.replies.map(reply => renderReply(reply, indent));
+        if (json.next) {
+            const url = new URL(button.dataset.repliesUrl, location.href);
+            url.searchParams.set('cursor', json.next);
+            rows.push(makeButton(url.toString(), 'もっと見る', indent));
+        }
+        button.replaceWith(...rows);
+    }
+
+    document.querySelectorAll('[data-button="replies"]').forEach(button => {
+        button.addEventListener('click', loadReplies);
+    });
+})();
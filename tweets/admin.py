@@ -1,7 +1,96 @@
 from django.contrib import admin
 
-from .models import Like, Tweet
+from core.admin import LargeTableAdmin
+from jobs.actions import batched_action
+
+from . import shards, tasks
+from .models import Like, ScheduledTweet, Tweet
 
-admin.site.register(Tweet)
-admin.site.register(Like)
 # 　管理画面からツイートを見れるように
+
+
+class ShardFilter(admin.SimpleListFilter):
+    # 一覧は 1 つのシャードずつ見る (既定は最初のシャード)
+    title = "シャード"
+    parameter_name = "shard"
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shards.aliases()]
+
+    def alias(self):
+        value = self.value()
+        return value if value in shards.aliases() else shards.aliases()[0]
+
+    def choices(self, changelist):
+        for alias, title in self.lookup_choices:
+            yield {
+                "selected": self.alias() == alias,
+                "query_string": changelist.get_query_string(
+                    {self.parameter_name: alias}
+                ),
+                "display": title,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.alias())
+
+
+class ShardedAdmin(LargeTableAdmin):
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if shards.is_sharded():
+            list_filter = (ShardFilter, *list_filter)
+        return list_filter
+
+    def get_object(self, request, object_id, from_field=None):
+        # 変更画面には一覧で選んだシャードが渡らないので、全シャードから探す
+        queryset = self.get_queryset(request)
+        try:
+            return shards.get(queryset, pk=int(object_id))
+        except (ValueError, queryset.model.DoesNotExist):
+            return None
+
+
+@admin.register(Tweet)
+class TweetAdmin(ShardedAdmin):
+    list_display = ("id", "user", "content", "created_at", "is_flagged", "deleted_at")
+    list_filter = ("is_flagged",)
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
+    search_fields = ("=user__username",)
+    date_hierarchy = "created_at"
+    actions = [
+        batched_action(tasks.soft_delete, "soft_delete", "選択したツイートを削除"),
+        batched_action(
+            tasks.set_flagged, "flag", "選択したツイートに印を付ける", flagged=True
+        ),
+        batched_action(
+            tasks.set_flagged, "unflag", "選択したツイートの印を外す", flagged=False
+        ),
+    ]
+
+    def get_queryset(self, request):
+        # 削除済みのツイートも見られるようにする
+        return Tweet.all_objects.all()
+
+
+@admin.register(Like)
+class LikeAdmin(ShardedAdmin):
+    list_display = ("id", "user", "target_tweet_id", "created_at")
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
+    raw_id_fields = ("target_tweet",)
+    search_fields = ("=user__username",)
+    date_hierarchy = "created_at"
+    actions = [
+        batched_action(tasks.delete_likes, "delete_likes", "選択したいいねを削除"),
+    ]
+
+
+@admin.register(ScheduledTweet)
+class ScheduledTweetAdmin(LargeTableAdmin):
+    list_display = ("id", "user", "content", "due_at", "tweet_id", "published_at")
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
+    search_fields = ("=user__username",)
+    date_hierarchy = "due_at"
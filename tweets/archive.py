@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from notifications import inbox
+from notifications.models import Notification
+
+from . import shards
+from .models import ArchivedLike, ArchivedRetweet, ArchivedTweet, Like, Retweet, Tweet
+
+
+def archive_chunk(cutoff, chunk_size):
+    # cutoff より古いツイートを、シャードごとに chunk_size 件ずつアーカイブへ移す。
+    # 書き込みは ignore_conflicts なので、途中で止まっても再実行すればよい
+    return sum(
+        archive_shard_chunk(alias, cutoff, chunk_size) for alias in shards.aliases()
+    )
+
+
+def copy_in_batches(queryset, model, to_archived, chunk_size):
+    # queryset の行を to_archived で model に作り直し、chunk_size 件ずつアーカイブに書く
+    archived = model.objects.using(settings.TWEET_ARCHIVE_DATABASE)
+    batch = []
+    for row in queryset.order_by("pk").iterator(chunk_size=chunk_size):
+        batch.append(to_archived(row))
+        if len(batch) >= chunk_size:
+            archived.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    archived.bulk_create(batch, ignore_conflicts=True)
+
+
+def archive_shard_chunk(alias, cutoff, chunk_size):
+    # いいね・リツイートは対象のツイートと同じシャードにあるので、
+    # 読むのも消すのも alias だけでよい
+    tweets = list(
+        Tweet.objects.using(alias)
+        .filter(created_at__lt=cutoff)
+        .order_by("pk")
+        .annotate(num_likes=Count("like"))[:chunk_size]
+    )
+    if not tweets:
+        return 0
+
+    tweet_ids = [tweet.pk for tweet in tweets]
+    ArchivedTweet.objects.using(settings.TWEET_ARCHIVE_DATABASE).bulk_create(
+        [
+            ArchivedTweet(
+                id=tweet.pk,
+                user_id=tweet.user_id,
+                content=tweet.content,
+                created_at=tweet.created_at,
+                parent_id=tweet.parent_id,
+                root_id=tweet.root_id,
+                path=tweet.path,
+                depth=tweet.depth,
+                like_count=tweet.num_likes,
+                reply_count=tweet.reply_count,
+                retweet_count=tweet.retweet_count,
+                period=tweet.created_at.strftime("%Y-%m"),
+            )
+            for tweet in tweets
+        ],
+        ignore_conflicts=True,
+    )
+    likes = Like.objects.using(alias).filter(target_tweet_id__in=tweet_ids)
+    copy_in_batches(
+        likes,
+        ArchivedLike,
+        lambda like: ArchivedLike(
+            id=like.pk,
+            target_tweet_id=like.target_tweet_id,
+            user_id=like.user_id,
+            created_at=like.created_at,
+        ),
+        chunk_size,
+    )
+    retweets = Retweet.objects.using(alias).filter(tweet_id__in=tweet_ids)
+    copy_in_batches(
+        retweets,
+        ArchivedRetweet,
+        lambda retweet: ArchivedRetweet(
+            id=retweet.pk,
+            tweet_id=retweet.tweet_id,
+            user_id=retweet.user_id,
+            created_at=retweet.created_at,
+        ),
+        chunk_size,
+    )
+    # 通知はアーカイブしたツイートを開けないので消す (未読の数も戻す)
+    inbox.delete_in_batches(
+        Notification.objects.filter(target_tweet_id__in=tweet_ids), chunk_size
+    )
+
+    # アーカイブへの書き込みが済んでから元の行を消す。
+    # 返信は parent と path を持ったまま残り、祖先はアーカイブから引ける
+    with transaction.atomic(using=alias):
+        likes.delete()
+        retweets.delete()
+        Tweet.objects.using(alias).filter(pk__in=tweet_ids).delete()
+    return len(tweets)
+
+
+class UserTimeline:
+    # あるユーザーのツイートを新しい順に、通常のテーブル -> アーカイブの順でつなげる。
+    # アーカイブには古いものしか入らないので、つなげても順番は崩れない。
+    # Paginator に渡せるよう count() とスライスだけ実装している
+    def __init__(self, user):
+        self.hot = (
+            Tweet.objects.using(shards.for_user(user.pk))
+            .select_related("user")
+            .filter(user=user)
+            .order_by("-pk")
+        )
+        self.archived = (
+            ArchivedTweet.objects.prefetch_related("user")
+            .filter(user=user)
+            .order_by("-pk")
+        )
+        self._hot_count = None
+
+    @property
+    def hot_count(self):
+        if self._hot_count is None:
+            self._hot_count = self.hot.count()
+        return self._hot_count
+
+    def count(self):
+        return self.hot_count + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index : index + 1][0]
+        start, stop = index.start or 0, index.stop
+        rows = list(self.hot[start:stop]) if start < self.hot_count else []
+        if stop is None or stop > self.hot_count:
+            archived_start = max(start - self.hot_count, 0)
+            archived_stop = None if stop is None else stop - self.hot_count
+            rows += list(self.archived[archived_start:archived_stop])
+        return rows
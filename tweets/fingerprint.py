@@ -0,0 +1,154 @@
+import re
+import struct
+import threading
+import unicodedata
+from collections import deque
+from hashlib import blake2b
+from typing import NamedTuple
+from zlib import crc32
+
+from django.conf import settings
+
+from core.ratelimit import LocalMemoryStore
+
+SHINGLE = 3  # 日本語は単語で区切れないので文字 3-gram を使う
+SLOTS = 32
+ROWS_PER_BAND = 4
+EMPTY = 0xFFFFFFFF
+SIGNATURE_STRUCT = struct.Struct(f"<{SLOTS}I")
+
+# URL と記号・空白を落として、表記ゆれだけの違いを同じものとみなす
+STRIP_RE = re.compile(r"https?://\S+|[\W_]+")
+
+
+class Fingerprint(NamedTuple):
+    exact: int
+    signature: tuple
+
+
+def normalize(text):
+    return STRIP_RE.sub("", unicodedata.normalize("NFKC", text).casefold())
+
+
+def signature(normalized):
+    # One Permutation Hashing の MinHash。3-gram の crc32 を下位ビットで
+    # SLOTS 個に振り分け、それぞれの最小値を取る (1 回なめるだけで済む)
+    mins = [EMPTY] * SLOTS
+    for i in range(len(normalized) - SHINGLE + 1):
+        h = crc32(normalized[i : i + SHINGLE].encode())
+        slot = h & (SLOTS - 1)
+        if h < mins[slot]:
+            mins[slot] = h
+    return tuple(mins)
+
+
+def fingerprint(text):
+    # 短すぎる文 (「おはよう」など) は重複していて当然なので対象外
+    normalized = normalize(text)
+    if len(normalized) < settings.TWEET_FINGERPRINT_MIN_LENGTH:
+        return None
+    exact = blake2b(normalized.encode(), digest_size=8).digest()
+    return Fingerprint(int.from_bytes(exact, "little"), signature(normalized))
+
+
+def pack(sig):
+    return SIGNATURE_STRUCT.pack(*sig)
+
+
+def unpack(packed):
+    return SIGNATURE_STRUCT.unpack(packed)
+
+
+def similarity(a, b):
+    # 両方とも空のスロットを除いて、最小値が一致する割合
+    matched = used = 0
+    for x, y in zip(a, b):
+        if x == EMPTY and y == EMPTY:
+            continue
+        used += 1
+        if x == y:
+            matched += 1
+    return matched / used if used else 0.0
+
+
+def band_keys(sig):
+    # ROWS_PER_BAND 個ずつまとめたバンドのハッシュ。空のバンドは使わない
+    for band in range(0, SLOTS, ROWS_PER_BAND):
+        rows = sig[band : band + ROWS_PER_BAND]
+        if rows.count(EMPTY) < ROWS_PER_BAND:
+            yield hash((band,) + rows)
+
+
+class RecentContentIndex:
+    # 直近 capacity 件の指紋を持つ LSH インデックス。古いものから捨てる。
+    # メモリを抑えるため、バンドごとに最後に入った 1 件だけを覚え、署名は bytes で持つ
+    def __init__(self, capacity, threshold):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.entries = deque()
+        self.signatures = {}
+        self.exact = {}
+        self.buckets = {}
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def find(self, fp):
+        # 完全一致なら 1.0、似ているものがあればその類似度、なければ 0.0
+        with self.lock:
+            if fp.exact in self.exact:
+                return 1.0
+            seen = set()
+            for key in band_keys(fp.signature):
+                seq = self.buckets.get(key)
+                if seq is None or seq in seen:
+                    continue
+                seen.add(seq)
+                value = similarity(fp.signature, unpack(self.signatures[seq]))
+                if value >= self.threshold:
+                    return value
+            return 0.0
+
+    def add(self, fp):
+        with self.lock:
+            self.seq += 1
+            keys = tuple(band_keys(fp.signature))
+            self.entries.append((self.seq, fp.exact, keys))
+            self.signatures[self.seq] = pack(fp.signature)
+            self.exact[fp.exact] = self.exact.get(fp.exact, 0) + 1
+            for key in keys:
+                self.buckets[key] = self.seq
+            while len(self.entries) > self.capacity:
+                self.evict()
+
+    def evict(self):
+        seq, exact, keys = self.entries.popleft()
+        del self.signatures[seq]
+        if self.exact[exact] == 1:
+            del self.exact[exact]
+        else:
+            self.exact[exact] -= 1
+        for key in keys:
+            if self.buckets.get(key) == seq:
+                del self.buckets[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+_index = None
+duplicate_limiter = LocalMemoryStore()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        _index = RecentContentIndex(
+            settings.TWEET_FINGERPRINT_INDEX_SIZE,
+            settings.TWEET_NEAR_DUPLICATE_THRESHOLD,
+        )
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
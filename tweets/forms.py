@@ -1,9 +1,23 @@
 from django import forms
+from django.utils import timezone
 
-from .models import Tweet
+from .models import ScheduledTweet, Tweet
 
 
 class TweetForm(forms.ModelForm):
     class Meta:
         model = Tweet
         fields = ("content",)
+
+
+class ScheduledTweetForm(forms.ModelForm):
+    class Meta:
+        model = ScheduledTweet
+        fields = ("content", "due_at")
+        widgets = {"due_at": forms.DateTimeInput(attrs={"type": "datetime-local"})}
+
+    def clean_due_at(self):
+        due_at = self.cleaned_data["due_at"]
+        if due_at <= timezone.now():
+            raise forms.ValidationError("未来の日時を指定してください。")
+        return due_at
@@ -0,0 +1,176 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from jobs.queue import enqueue
+
+from . import hll
+from .models import ImpressionSketch
+
+logger = logging.getLogger(__name__)
+
+# 表示回数 (見た人数) の集計。1 回ずつ行を書くのではなく、プロセス内で
+# HyperLogLog のレジスタの更新分だけを溜めて、ときどきジョブで DB の sketch にマージする
+
+
+class ImpressionBuffer:
+    def __init__(self, precision=hll.DEFAULT_PRECISION):
+        self.precision = precision
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.events = 0
+        self.started = time.monotonic()
+
+    def add(self, tweet_id, viewer_id, day):
+        # 日ごとの sketch に入れるので、見た日 (day) ごとに分けて溜める
+        index, rank = hll.register_for(viewer_id, self.precision)
+        with self.lock:
+            registers = self.pending.setdefault((tweet_id, day), {})
+            if registers.get(index, 0) < rank:
+                registers[index] = rank
+            self.events += 1
+
+    def due(self, now):
+        return self.events >= settings.IMPRESSION_BUFFER_EVENTS or (
+            self.pending and now - self.started >= settings.IMPRESSION_FLUSH_SECONDS
+        )
+
+    def drain(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.events = 0
+            self.started = time.monotonic()
+        return pending
+
+
+class Flusher:
+    # 表示が途切れても溜まった分が残らないよう、別のスレッドから
+    # IMPRESSION_FLUSH_SECONDS ごとに見て flush() する。プロセスの終了時にも flush() する。
+    # スレッドは fork 後の最初の record() で作る (fork 前に作ったスレッドは子に引き継がれない)
+    def __init__(self):
+        self.enabled = False
+        self.pid = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def enable(self):
+        self.enabled = True
+        atexit.register(self.stop)
+
+    def ensure_started(self):
+        if not self.enabled or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stopping = threading.Event()
+            threading.Thread(
+                target=self.run, args=(self.stopping,), daemon=True
+            ).start()
+
+    def run(self, stopping):
+        while not stopping.wait(settings.IMPRESSION_FLUSH_SECONDS):
+            self.tick(time.monotonic())
+            connections.close_all()
+
+    def tick(self, now):
+        if not buffer.due(now):
+            return
+        try:
+            flush()
+        except DatabaseError:
+            logger.exception("表示回数をマージするジョブを積めませんでした")
+
+    def stop(self):
+        self.stopping.set()
+        self.tick(float("inf"))
+
+
+buffer = ImpressionBuffer()
+flusher = Flusher()
+
+
+def start_flusher():
+    # Web サーバーのプロセス (wsgi.py / asgi.py) から呼ぶ
+    flusher.enable()
+
+
+def record(tweet_ids, viewer_id):
+    flusher.ensure_started()
+    day = timezone.localdate()
+    for tweet_id in tweet_ids:
+        buffer.add(tweet_id, viewer_id, day)
+    if buffer.due(time.monotonic()):
+        flush()
+
+
+def flush():
+    # 日をまたいで溜まっていても、見た日ごとに 1 つのジョブにする
+    by_day = {}
+    for (tweet_id, day), registers in buffer.drain().items():
+        by_day.setdefault(day, {})[str(tweet_id)] = sorted(registers.items())
+    for day, updates in sorted(by_day.items()):
+        enqueue(
+            "tweets.merge_impressions", {"day": day.isoformat(), "updates": updates}
+        )
+
+
+def merge(day, updates):
+    # updates: {tweet_id: [(レジスタの番号, 値), ...]} をその日の行と全期間の行に反映する
+    with transaction.atomic():
+        rows = {
+            (row.tweet_id, row.day): row
+            for row in ImpressionSketch.objects.select_for_update().filter(
+                Q(day=day) | Q(day__isnull=True), tweet_id__in=list(updates)
+            )
+        }
+        created, changed = [], []
+        for tweet_id, pairs in updates.items():
+            for bucket in (day, None):
+                row = rows.get((tweet_id, bucket))
+                if row is None:
+                    sketch = hll.HyperLogLog()
+                    row = ImpressionSketch(tweet_id=tweet_id, day=bucket)
+                    created.append(row)
+                else:
+                    sketch = hll.HyperLogLog.from_bytes(bytes(row.registers))
+                    changed.append(row)
+                sketch.update(pairs)
+                row.registers = sketch.to_bytes()
+                row.estimate = sketch.count()
+        ImpressionSketch.objects.bulk_create(created)
+        ImpressionSketch.objects.bulk_update(changed, ["registers", "estimate"])
+
+
+def counts(tweet_ids):
+    return dict(
+        ImpressionSketch.objects.filter(
+            tweet_id__in=tweet_ids, day__isnull=True
+        ).values_list("tweet_id", "estimate")
+    )
+
+
+def attach_counts(tweets):
+    found = counts([tweet.pk for tweet in tweets])
+    for tweet in tweets:
+        tweet.impression_count = found.get(tweet.pk, 0)
+    return tweets
+
+
+def distinct_between(tweet_id, start, end):
+    # 期間内に見た人数 (日ごとの sketch をマージする。同じ人は 1 回だけ数える)
+    sketch = hll.HyperLogLog()
+    rows = ImpressionSketch.objects.filter(
+        tweet_id=tweet_id, day__gte=start, day__lte=end
+    ).values_list("registers", flat=True)
+    for registers in rows:
+        sketch.merge(hll.HyperLogLog.from_bytes(bytes(registers)))
+    return sketch.count()
@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tweets.archive import archive_chunk
+
+
+class Command(BaseCommand):
+    help = "古いツイートといいねをアーカイブ用のテーブルへ移す"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days", type=int, default=settings.TWEET_ARCHIVE_AFTER_DAYS
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--max-chunks",
+            type=int,
+            default=None,
+            help="この回数で打ち切る (次回続きから)",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["older_than_days"])
+        total = 0
+        chunks = 0
+        while options["max_chunks"] is None or chunks < options["max_chunks"]:
+            moved = archive_chunk(cutoff, options["chunk_size"])
+            if not moved:
+                break
+            total += moved
+            chunks += 1
+            self.stdout.write(f"{total} 件をアーカイブしました")
+        self.stdout.write(self.style.SUCCESS(f"完了: {total} 件"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from tweets.scheduling import Dispatcher
+
+
+class Command(BaseCommand):
+    help = "予約投稿を期限の時刻に投稿する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="期限の来ている分を投稿したら終わる"
+        )
+
+    def handle(self, *args, **options):
+        Dispatcher().run(once=options["once"])
@@ -0,0 +1,45 @@
+# Generated by Django 4.0.10 on 2026-10-19 17:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tweets', '0003_like_like_like_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTweet',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('content', models.CharField(max_length=140)),
+                ('created_at', models.DateTimeField()),
+                ('like_count', models.PositiveIntegerField(default=0)),
+                ('period', models.CharField(max_length=7)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedLike',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('target_tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='likes', to='tweets.archivedtweet')),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedtweet',
+            index=models.Index(fields=['user', '-created_at'], name='archived_tweet_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtweet',
+            index=models.Index(fields=['period'], name='archived_tweet_period_idx'),
+        ),
+    ]
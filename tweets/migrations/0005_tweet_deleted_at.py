@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0004_archivedtweet_archivedlike_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-19 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0005_tweet_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='is_flagged',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.10 on 2026-10-19 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0007_like_like_created_idx_tweet_tweet_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tweets.tweet'),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='path',
+            field=models.CharField(blank=True, default='', max_length=240),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tweet',
+            name='root_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['root_id', 'path'], name='tweet_thread_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.0.10 on 2026-10-19 17:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tweets', '0008_tweet_depth_tweet_parent_tweet_path_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='retweet_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Retweet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('tweet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tweets.tweet')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='retweet',
+            index=models.Index(fields=['user', '-created_at'], name='retweet_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='retweet',
+            index=models.Index(fields=['-created_at'], name='retweet_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='retweet',
+            constraint=models.UniqueConstraint(fields=('tweet', 'user'), name='retweet_unique'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.0.10 on 2026-10-19 17:59
+
+import core.snowflake
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0009_tweet_retweet_count_retweet_retweet_retweet_user_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='archivedtweet',
+            name='archived_tweet_user_idx',
+        ),
+        migrations.AlterField(
+            model_name='like',
+            name='id',
+            field=models.BigIntegerField(default=core.snowflake.next_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='retweet',
+            name='id',
+            field=models.BigIntegerField(default=core.snowflake.next_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='tweet',
+            name='id',
+            field=models.BigIntegerField(default=core.snowflake.next_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtweet',
+            index=models.Index(fields=['user', '-id'], name='archived_tweet_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tweet',
+            index=models.Index(fields=['user', '-id'], name='tweet_user_idx'),
+        ),
+    ]
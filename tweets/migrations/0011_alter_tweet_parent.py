@@ -0,0 +1,19 @@
+# Generated by Django 4.0.10 on 2026-10-19 18:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0010_remove_archivedtweet_archived_tweet_user_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tweet',
+            name='parent',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='tweets.tweet'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.10 on 2026-10-19 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0011_alter_tweet_parent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImpressionSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tweet_id', models.BigIntegerField()),
+                ('day', models.DateField(blank=True, null=True)),
+                ('registers', models.BinaryField()),
+                ('estimate', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='impressionsketch',
+            constraint=models.UniqueConstraint(condition=models.Q(('day__isnull', False)), fields=('tweet_id', 'day'), name='impression_day_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='impressionsketch',
+            constraint=models.UniqueConstraint(condition=models.Q(('day__isnull', True)), fields=('tweet_id',), name='impression_total_unique'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.10 on 2026-10-19 18:24
+
+import core.snowflake
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tweets', '0012_impressionsketch_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledTweet',
+            fields=[
+                ('id', models.BigIntegerField(default=core.snowflake.next_id, editable=False, primary_key=True, serialize=False)),
+                ('content', models.CharField(max_length=140)),
+                ('due_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('tweet_id', models.BigIntegerField(blank=True, null=True)),
+                ('published_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='scheduledtweet',
+            index=models.Index(condition=models.Q(('published_at__isnull', True)), fields=['due_at'], name='scheduled_due_idx'),
+        ),
+    ]
@@ -1,23 +1,250 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.snowflake import next_id
+
+from . import shards
 
 User = get_user_model()
 
+# 返信の path は祖先 (ルートを除く) と自分の id を 16 桁の 16 進数で並べたもの。
+# path 順に並べるとスレッドを深さ優先でたどった順になる
+PATH_SEGMENT_WIDTH = 16
+
+
+def path_segment(pk):
+    return format(pk, f"0{PATH_SEGMENT_WIDTH}x")
+
+
+def use_tweet_shard(instance, field_name, kwargs):
+    # ツイートが読み込まれていればそのシャードに書く (無ければ渡された using のまま)
+    field = instance._meta.get_field(field_name)
+    if field.is_cached(instance):
+        kwargs["using"] = shards.for_user(field.get_cached_value(instance).user_id)
+
+
+class AliveTweetManager(models.Manager):
+    # 削除済みのツイートと、退会したユーザーのツイートは見せない
+    def get_queryset(self):
+        return (
+            super()
+            .get_queryset()
+            .filter(deleted_at__isnull=True, user__deleted_at__isnull=True)
+        )
+
 
 class Tweet(models.Model):
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.CharField(max_length=140)
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # 最近の投稿と同じ・よく似た内容だったもの (TWEET_DUPLICATE_ACTION = "flag")
+    is_flagged = models.BooleanField(default=False)
+    # 返信。ルートのツイートは parent / root_id が空で path が ""
+    # 返信は親と別のシャードに入ることがあるので DB の外部キー制約は付けない。
+    # 親がアーカイブに移ったり消えたりしても、返信の parent と path はそのまま残す
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.DO_NOTHING,
+        null=True,
+        blank=True,
+        related_name="+",
+        db_constraint=False,
+    )
+    root_id = models.BigIntegerField(null=True, blank=True)
+    path = models.CharField(max_length=240, blank=True, default="")
+    depth = models.PositiveSmallIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+    retweet_count = models.PositiveIntegerField(default=0)
+
+    objects = AliveTweetManager()
+    all_objects = models.Manager()
+
+    is_archived = False
+
+    MAX_DEPTH = 240 // PATH_SEGMENT_WIDTH
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="tweet_created_idx"),
+            models.Index(fields=["user", "-id"], name="tweet_user_idx"),
+            models.Index(fields=["root_id", "path"], name="tweet_thread_idx"),
+        ]
+
+    @property
+    def thread_root_id(self):
+        return self.root_id or self.pk
+
+    def save(self, *args, **kwargs):
+        # Tweet.objects.create() などが using を決めてしまうので、ここで投稿者のシャードに直す
+        kwargs["using"] = shards.for_user(self.user_id)
+        if not (self._state.adding and self.parent_id):
+            return super().save(*args, **kwargs)
+        # id は保存前に決まっているので、path もここで埋められる
+        with transaction.atomic(using=kwargs["using"]):
+            parent = self.parent
+            if parent.depth >= self.MAX_DEPTH:
+                # これ以上深くできないので、親と同じ階層にぶら下げる
+                parent = shards.get(Tweet.all_objects, pk=parent.parent_id)
+                self.parent = parent
+            self.root_id = parent.thread_root_id
+            self.depth = parent.depth + 1
+            self.path = parent.path + path_segment(self.pk)
+            super().save(*args, **kwargs)
+            Tweet.all_objects.using(parent._state.db).filter(pk=parent.pk).update(
+                reply_count=F("reply_count") + 1
+            )
+
+    def soft_delete(self):
+        # いいねなどは purge_deleted コマンドが後でまとめて消す
+        self.deleted_at = timezone.now()
+        self.save(update_fields=["deleted_at"])
+        if self.parent_id:
+            for tweets in shards.scatter(Tweet.all_objects.all()):
+                tweets.filter(pk=self.parent_id, reply_count__gt=0).update(
+                    reply_count=F("reply_count") - 1
+                )
 
 
 class Like(models.Model):
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
     target_tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        # 対象のツイートと同じシャードに置く
+        use_tweet_shard(self, "target_tweet", kwargs)
+        super().save(*args, **kwargs)
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=["target_tweet", "user"], name="like_unique"
             ),
         ]
+        indexes = [models.Index(fields=["created_at"], name="like_created_idx")]
+
+
+class Retweet(models.Model):
+    # 元のツイートを指すだけ。同じ人が同じツイートを 2 回リツイートすることはできない
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        use_tweet_shard(self, "tweet", kwargs)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tweet", "user"], name="retweet_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-created_at"], name="retweet_user_idx"),
+            models.Index(fields=["-created_at"], name="retweet_created_idx"),
+        ]
+
+
+class ScheduledTweet(models.Model):
+    # 予約投稿。default の DB に置き、due_at を過ぎたら dispatch_scheduled_tweets が
+    # 普通の投稿と同じ道 (tweets.posting) で投稿する。tweet_id は投稿するときに振る
+    # id で、投稿し終えたら published_at が入る
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    content = models.CharField(max_length=140)
+    due_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    tweet_id = models.BigIntegerField(null=True, blank=True)
+    published_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # まだ投稿していない分だけの部分インデックス
+            models.Index(
+                fields=["due_at"],
+                condition=models.Q(published_at__isnull=True),
+                name="scheduled_due_idx",
+            ),
+        ]
+
+
+class ImpressionSketch(models.Model):
+    # ツイートを見た人数の HyperLogLog (tweets.hll)。day が空の行は全期間の分
+    tweet_id = models.BigIntegerField()
+    day = models.DateField(null=True, blank=True)
+    registers = models.BinaryField()
+    estimate = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tweet_id", "day"],
+                condition=models.Q(day__isnull=False),
+                name="impression_day_unique",
+            ),
+            models.UniqueConstraint(
+                fields=["tweet_id"],
+                condition=models.Q(day__isnull=True),
+                name="impression_total_unique",
+            ),
+        ]
+
+
+class ArchivedTweet(models.Model):
+    # 古いツイートの保存先。id は元の Tweet.id をそのまま使う
+    # 別の DB に置けるよう User への外部キー制約は張らない。
+    # 件数とスレッドの位置は移したときの値のまま持つ (親は通常のテーブルにいることもある)
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    content = models.CharField(max_length=140)
+    created_at = models.DateTimeField()
+    parent_id = models.BigIntegerField(null=True, blank=True)
+    root_id = models.BigIntegerField(null=True, blank=True)
+    path = models.CharField(max_length=240, blank=True, default="")
+    depth = models.PositiveSmallIntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+    retweet_count = models.PositiveIntegerField(default=0)
+    period = models.CharField(max_length=7)  # "2022-08" のような年月
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    is_archived = True
+
+    @property
+    def thread_root_id(self):
+        return self.root_id or self.pk
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-id"], name="archived_tweet_user_idx"),
+            models.Index(fields=["period"], name="archived_tweet_period_idx"),
+        ]
+
+
+class ArchivedLike(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    target_tweet = models.ForeignKey(
+        ArchivedTweet, on_delete=models.CASCADE, related_name="likes"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    created_at = models.DateTimeField()
+
+
+class ArchivedRetweet(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    tweet = models.ForeignKey(
+        ArchivedTweet, on_delete=models.CASCADE, related_name="retweets"
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    created_at = models.DateTimeField()
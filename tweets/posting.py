@@ -0,0 +1,43 @@
+from functools import partial
+
+from django.db import transaction
+
+from core import invalidation
+from outbox import events
+
+from . import fingerprint, shards
+
+
+def publish(tweets, check_duplicates=False, fingerprints=None):
+    # 投稿の画面と予約投稿が共通で通る道。同じシャードのツイートは
+    # 1 トランザクションにまとめ、outbox のイベントと一緒に書く。
+    # check_duplicates=True なら最近の投稿と重なるものに印を付ける
+    # (予約投稿は本人がその場にいないので、断らずに "flag" と同じ扱いにする)
+    # fingerprints は呼ぶ側で計算済みなら tweets と同じ順で渡す
+    if fingerprints is None:
+        fingerprints = [fingerprint.fingerprint(tweet.content) for tweet in tweets]
+    index = fingerprint.get_index()
+    if check_duplicates:
+        # インデックスに入るのはコミットの後なので、同じバッチの中の重複はここで見る
+        batch = fingerprint.RecentContentIndex(len(tweets), index.threshold)
+        for tweet, fp in zip(tweets, fingerprints):
+            if fp is None:
+                continue
+            if index.find(fp) or batch.find(fp):
+                tweet.is_flagged = True
+            batch.add(fp)
+
+    by_shard = {}
+    for tweet, fp in zip(tweets, fingerprints):
+        by_shard.setdefault(shards.for_user(tweet.user_id), []).append((tweet, fp))
+    # 投稿した人ごとのキャッシュの無効化も 1 つにまとめて送る
+    with invalidation.get_bus().batch():
+        for alias, group in by_shard.items():
+            with transaction.atomic(using=alias):
+                for tweet, fp in group:
+                    tweet.save()
+                    events.tweet_changed(events.TWEET_CREATED, tweet)
+                    # ロールバックされた投稿で、後の投稿が重複扱いされないように
+                    if fp is not None:
+                        transaction.on_commit(partial(index.add, fp), using=alias)
+    return tweets
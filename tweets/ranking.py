@@ -0,0 +1,143 @@
+import math
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from accounts import graph, visibility
+from core import invalidation
+
+from . import shards
+from .models import Like, Tweet
+
+try:
+    import numpy
+except ImportError:  # numpy は任意。無ければ同じ式を Python で計算する
+    numpy = None
+
+CHRONOLOGICAL = "chronological"
+RANKED = "ranked"
+ORDERS = (CHRONOLOGICAL, RANKED)
+
+GRAVITY = 1.5
+AFFINITY_WEIGHT = 0.5
+
+# clear() で上げると、それより前にキャッシュした並びは読まれなくなる
+generation = 0
+
+
+def score(age_hours, like_counts, affinities):
+    # 新しく、いいねが多く、よくいいねしている相手のツイートほど高くなる
+    if numpy is not None:
+        age_hours = numpy.asarray(age_hours, dtype=float)
+        like_counts = numpy.asarray(like_counts, dtype=float)
+        affinities = numpy.asarray(affinities, dtype=float)
+        return (
+            (like_counts + 1)
+            * (1 + AFFINITY_WEIGHT * numpy.log1p(affinities))
+            / (age_hours + 2) ** GRAVITY
+        ).tolist()
+    return [
+        (likes + 1)
+        * (1 + AFFINITY_WEIGHT * math.log1p(affinity))
+        / (age + 2) ** GRAVITY
+        for age, likes, affinity in zip(age_hours, like_counts, affinities)
+    ]
+
+
+def candidates(viewer):
+    # フォローしている人と自分の新しいツイートを FEED_CANDIDATE_LIMIT 件まで
+    # 作者ごとのシャードに分けて引き、新しい順にマージする
+    # ブロック・ミュートした人は候補の作者から外しておく
+    hidden = visibility.for_viewer(viewer.pk)
+    authors = {
+        user_id
+        for user_id in graph.followings.get(viewer.pk) | {viewer.pk}
+        if user_id not in hidden
+    }
+    limit = settings.FEED_CANDIDATE_LIMIT
+    return shards.merge(
+        [
+            Tweet.objects.using(alias)
+            .filter(user_id__in=user_ids)
+            .order_by("-pk")
+            .values_list("pk", "user_id", "created_at")[:limit]
+            for alias, user_ids in shards.group_by_shard(authors).items()
+        ],
+        key=itemgetter(0),
+        reverse=True,
+        limit=limit,
+    )
+
+
+def features(viewer, rows, now):
+    tweet_ids = [pk for pk, _, _ in rows]
+    # いいねはツイートと同じシャードにあるので、作者のシャードごとに数える
+    tweet_ids_by_shard = {}
+    for pk, user_id, _ in rows:
+        tweet_ids_by_shard.setdefault(shards.for_user(user_id), []).append(pk)
+    like_counts = {}
+    for alias, ids in tweet_ids_by_shard.items():
+        like_counts.update(
+            Like.objects.using(alias)
+            .filter(target_tweet_id__in=ids)
+            .values("target_tweet_id")
+            .annotate(n=Count("pk"))
+            .values_list("target_tweet_id", "n")
+        )
+    # 閲覧者が各作者のツイートにいいねした回数
+    affinity = {}
+    authors = {user_id for _, user_id, _ in rows}
+    for alias, user_ids in shards.group_by_shard(authors).items():
+        affinity.update(
+            Like.objects.using(alias)
+            .filter(user=viewer, target_tweet__user_id__in=user_ids)
+            .values("target_tweet__user_id")
+            .annotate(n=Count("pk"))
+            .values_list("target_tweet__user_id", "n")
+        )
+    return (
+        [(now - created_at).total_seconds() / 3600 for _, _, created_at in rows],
+        [like_counts.get(pk, 0) for pk in tweet_ids],
+        [affinity.get(user_id, 0) for _, user_id, _ in rows],
+    )
+
+
+def cache_key(viewer_id):
+    return f"feed_rank:{generation}:{viewer_id}"
+
+
+def evict(*viewer_ids):
+    cache.delete_many([cache_key(viewer_id) for viewer_id in viewer_ids])
+
+
+def clear():
+    global generation
+    generation += 1
+
+
+def invalidate(*viewer_ids):
+    invalidation.publish("ranking", *viewer_ids)
+
+
+def ranked_ids(viewer):
+    key = cache_key(viewer.pk)
+    ids = cache.get(key)
+    if ids is None:
+        rows = candidates(viewer)
+        scores = score(*features(viewer, rows, timezone.now()))
+        ids = [pk for _, (pk, _, _) in sorted(zip(scores, rows), key=lambda x: -x[0])]
+        cache.set(key, ids, settings.FEED_RANK_CACHE_TTL)
+    return ids
+
+
+def ranked_page(viewer, page=1):
+    size = settings.FEED_PAGE_SIZE
+    ids = ranked_ids(viewer)[(page - 1) * size : page * size]
+    tweets = shards.in_bulk(Tweet.objects.select_related("user"), ids)
+    return [tweets[pk] for pk in ids if pk in tweets]
+
+
+invalidation.subscribe("ranking", evict, clear)
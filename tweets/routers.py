@@ -0,0 +1,73 @@
+from django.conf import settings
+
+from . import shards
+
+ARCHIVE_MODELS = {"archivedtweet", "archivedlike", "archivedretweet"}
+
+
+def is_archive_model(model_name):
+    return model_name in ARCHIVE_MODELS
+
+
+class ArchiveRouter:
+    # アーカイブ用のモデルだけ settings.TWEET_ARCHIVE_DATABASE に置く
+    def db_for_read(self, model, **hints):
+        if is_archive_model(model._meta.model_name):
+            return settings.TWEET_ARCHIVE_DATABASE
+        # アーカイブ側からたどったユーザーなどは通常の DB から読む
+        instance = hints.get("instance")
+        if instance is not None and is_archive_model(instance._meta.model_name):
+            return "default"
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_archive_model(obj1._meta.model_name) or is_archive_model(
+            obj2._meta.model_name
+        ):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        archive_db = settings.TWEET_ARCHIVE_DATABASE
+        if archive_db == "default":
+            return None
+        if model_name is not None and is_archive_model(model_name):
+            return db == archive_db
+        if db == archive_db:
+            return False
+        return None
+
+
+SHARDED_MODELS = {"tweet", "like", "retweet"}
+
+
+class ShardRouter:
+    # ツイートは投稿者のシャードへ、いいね・リツイートは対象ツイートのシャードへ書く。
+    # instance が分からないクエリは何もしない (= default)。別のシャードは .using() で明示する
+    def db_for_write(self, model, **hints):
+        instance = hints.get("instance")
+        if instance is None or model._meta.model_name not in SHARDED_MODELS:
+            return None
+        # instance は保存するもの自身か、tweet.like_set などのたどり元
+        name = instance._meta.model_name
+        if name == "tweet":
+            return shards.for_user(instance.user_id)
+        if name in ("like", "retweet"):
+            field = instance._meta.get_field(
+                "target_tweet" if name == "like" else "tweet"
+            )
+            if field.is_cached(instance):
+                return shards.for_user(field.get_cached_value(instance).user_id)
+            return instance._state.db
+        return None
+
+    db_for_read = db_for_write
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # ユーザーは全シャードに複製しているので、シャードをまたいでも関連付けてよい
+        names = {obj1._meta.model_name, obj2._meta.model_name}
+        if names & SHARDED_MODELS:
+            return True
+        return None
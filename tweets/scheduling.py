@@ -0,0 +1,134 @@
+import heapq
+import logging
+import signal
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from core import invalidation
+from core.snowflake import next_id
+
+from . import posting, shards
+from .models import ScheduledTweet, Tweet
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch(ids, now):
+    # ids のうち期限が来ていてまだ投稿していないものを投稿する。複数の dispatcher が
+    # 動いていても、行ロック (skip_locked) で同じ予約を同時に扱わない。
+    # ツイートはシャードに、予約は default に書くので、先に tweet_id だけ決めて
+    # コミットしておき、途中で止まっても次は同じ id で出し直す (作成済みなら作らない)
+    pending = ScheduledTweet.objects.select_for_update(skip_locked=True).filter(
+        pk__in=ids, published_at__isnull=True, due_at__lte=now
+    )
+    with transaction.atomic():
+        unassigned = list(pending.filter(tweet_id__isnull=True))
+        for item in unassigned:
+            item.tweet_id = next_id()
+        ScheduledTweet.objects.bulk_update(unassigned, ["tweet_id"])
+
+    with transaction.atomic():
+        items = list(pending.select_related("user"))
+        # 退会した人の予約は投稿せずに捨てる
+        withdrawn = [item.pk for item in items if item.user.deleted_at is not None]
+        if withdrawn:
+            ScheduledTweet.objects.filter(pk__in=withdrawn).delete()
+            items = [item for item in items if item.user.deleted_at is None]
+        if not items:
+            return 0
+        created = shards.values(
+            Tweet.all_objects.filter(pk__in=[item.tweet_id for item in items]), "pk"
+        )
+        tweets = [
+            Tweet(id=item.tweet_id, user=item.user, content=item.content)
+            for item in items
+            if item.tweet_id not in created
+        ]
+        posting.publish(tweets, check_duplicates=True)
+        for item in items:
+            item.published_at = now
+        ScheduledTweet.objects.bulk_update(items, ["published_at"])
+    return len(tweets)
+
+
+class Dispatcher:
+    # 予約投稿を期限の時刻に投稿する。SCHEDULED_TWEET_LOOKAHEAD_SECONDS 先までの予約を
+    # due_at の部分インデックスから読んでヒープに入れ、一番早いものの時刻まで眠る。
+    # 新しい予約は SCHEDULED_TWEET_REFRESH_SECONDS ごとに読み直して拾う。
+    # 同じ時刻に大量にあっても SCHEDULED_TWEET_BATCH_SIZE 件ずつ投稿する
+    def __init__(self):
+        self.heap = []  # (due_at, id)
+        self.queued = set()
+        self.loaded_at = None
+        self.more = False  # 読んだ件数が上限に達していた (まだ続きがある)
+        self.stopping = False
+        self.wakeup = threading.Event()
+
+    def stop(self, *args):
+        self.stopping = True
+        self.wakeup.set()
+
+    def should_load(self, now):
+        if self.loaded_at is None or (not self.heap and self.more):
+            return True
+        return now - self.loaded_at >= timedelta(
+            seconds=settings.SCHEDULED_TWEET_REFRESH_SECONDS
+        )
+
+    def load(self, now):
+        horizon = now + timedelta(seconds=settings.SCHEDULED_TWEET_LOOKAHEAD_SECONDS)
+        limit = settings.SCHEDULED_TWEET_PREFETCH
+        rows = list(
+            ScheduledTweet.objects.filter(
+                published_at__isnull=True, due_at__lte=horizon
+            )
+            .order_by("due_at")
+            .values_list("due_at", "pk")[:limit]
+        )
+        for due_at, pk in rows:
+            if pk not in self.queued:
+                self.queued.add(pk)
+                heapq.heappush(self.heap, (due_at, pk))
+        self.loaded_at = now
+        self.more = len(rows) == limit
+
+    def step(self, now):
+        # 期限が来た分を 1 バッチ投稿し、(投稿した件数, 次に起きるまでの秒数) を返す
+        if self.should_load(now):
+            self.load(now)
+        if self.heap and self.heap[0][0] <= now:
+            ids = []
+            while (
+                self.heap
+                and self.heap[0][0] <= now
+                and len(ids) < settings.SCHEDULED_TWEET_BATCH_SIZE
+            ):
+                _, pk = heapq.heappop(self.heap)
+                self.queued.discard(pk)
+                ids.append(pk)
+            return dispatch(ids, now), 0
+        wake = self.loaded_at + timedelta(
+            seconds=settings.SCHEDULED_TWEET_REFRESH_SECONDS
+        )
+        if self.heap:
+            wake = min(wake, self.heap[0][0])
+        return 0, max((wake - now).total_seconds(), 0)
+
+    def run(self, once=False):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopping:
+            close_old_connections()
+            invalidation.poll()
+            published, wait = self.step(timezone.now())
+            if published:
+                logger.info("予約投稿を %d 件投稿しました", published)
+            if wait == 0:
+                continue
+            if once:
+                break
+            self.wakeup.wait(wait)
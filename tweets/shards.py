@@ -0,0 +1,83 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.http import Http404
+
+# ツイート・いいね・リツイートのシャードの割り当て。
+# ツイートは投稿者の user_id で、いいね・リツイートは対象のツイートと同じシャードに置く。
+# user_id を TWEET_SHARD_BUCKETS 個のバケツに分け、バケツごとに DB を決める
+# (TWEET_SHARD_MAP に書いたバケツはそちらが優先。シャードを増やすときに一部だけ動かせる)
+
+
+def aliases():
+    return list(settings.TWEET_SHARDS)
+
+
+def is_sharded():
+    return len(settings.TWEET_SHARDS) > 1
+
+
+def bucket_for(user_id):
+    return user_id % settings.TWEET_SHARD_BUCKETS
+
+
+def for_user(user_id):
+    bucket = bucket_for(user_id)
+    shards = settings.TWEET_SHARDS
+    return settings.TWEET_SHARD_MAP.get(bucket, shards[bucket % len(shards)])
+
+
+def group_by_shard(user_ids):
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(for_user(user_id), []).append(user_id)
+    return groups
+
+
+def scatter(queryset):
+    # 同じクエリを全シャードに向けたもの
+    return [queryset.using(alias) for alias in aliases()]
+
+
+def get(queryset, **lookup):
+    # id だけではシャードが分からないので、順に探す
+    for shard_queryset in scatter(queryset):
+        obj = shard_queryset.filter(**lookup).first()
+        if obj is not None:
+            return obj
+    raise queryset.model.DoesNotExist
+
+
+def get_or_404(queryset, **lookup):
+    try:
+        return get(queryset, **lookup)
+    except queryset.model.DoesNotExist:
+        raise Http404
+
+
+def in_bulk(queryset, ids):
+    found = {}
+    for shard_queryset in scatter(queryset):
+        missing = [pk for pk in ids if pk not in found]
+        if not missing:
+            break
+        found.update(shard_queryset.in_bulk(missing))
+    return found
+
+
+def values(queryset, field):
+    return {
+        value for qs in scatter(queryset) for value in qs.values_list(field, flat=True)
+    }
+
+
+def merge(querysets, key, reverse=False, limit=None, chunk_size=100, keep=None):
+    # 同じ順に並んだシャードごとのクエリセットを k-way のヒープマージで 1 本にする。
+    # 各シャードは chunk_size 件ずつ読むので、limit 件取ったところで読むのをやめられる。
+    # keep を渡すと keep(row) が真の行だけを limit 件まで数える
+    cursors = [queryset.iterator(chunk_size=chunk_size) for queryset in querysets]
+    merged = heapq.merge(*cursors, key=key, reverse=reverse)
+    if keep is not None:
+        merged = filter(keep, merged)
+    return list(islice(merged, limit))
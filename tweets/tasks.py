@@ -0,0 +1,43 @@
+from datetime import date
+
+from django.db import transaction
+
+from jobs.models import Job
+from jobs.queue import task
+from outbox import events
+
+from . import impressions, shards
+from .models import Like, Tweet
+
+# 管理画面の一括操作から積まれるジョブ。id だけではシャードが分からないので全シャードに流す
+
+
+@task(name="tweets.soft_delete", priority=Job.Priority.LOW)
+def soft_delete(ids):
+    for tweets in shards.scatter(Tweet.all_objects.filter(pk__in=ids)):
+        for tweet in tweets.filter(deleted_at__isnull=True):
+            with transaction.atomic(using=tweets.db):
+                tweet.soft_delete()
+                events.tweet_changed(events.TWEET_DELETED, tweet)
+
+
+@task(name="tweets.set_flagged", priority=Job.Priority.LOW)
+def set_flagged(ids, flagged):
+    for tweets in shards.scatter(Tweet.all_objects.filter(pk__in=ids)):
+        tweets.update(is_flagged=flagged)
+
+
+@task(name="tweets.delete_likes", priority=Job.Priority.LOW)
+def delete_likes(ids):
+    for likes in shards.scatter(Like.objects.filter(pk__in=ids)):
+        with transaction.atomic(using=likes.db):
+            events.delete_likes(likes)
+
+
+# tweets.impressions.flush() から積まれる
+@task(name="tweets.merge_impressions", priority=Job.Priority.LOW)
+def merge_impressions(day, updates):
+    impressions.merge(
+        date.fromisoformat(day),
+        {int(tweet_id): pairs for tweet_id, pairs in updates.items()},
+    )
@@ -1,8 +1,43 @@
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from accounts import visibility
+from accounts.models import FriendShip, Mute
+from notifications import inbox
+from notifications.models import Notification
+from outbox.models import OutboxEvent
 
-from .models import Like, Tweet
+from . import (
+    fingerprint,
+    hll,
+    impressions,
+    ranking,
+    scheduling,
+    shards,
+    threads,
+    timeline,
+)
+from .models import (
+    ArchivedLike,
+    ArchivedTweet,
+    ImpressionSketch,
+    Like,
+    Retweet,
+    ScheduledTweet,
+    Tweet,
+)
 
 User = get_user_model()
 
@@ -119,6 +154,13 @@ class TestFavoriteView(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Like.objects.filter(target_tweet=self.tweet).exists())
 
+    def test_ids_are_sent_as_strings(self):
+        # snowflake の id は 2^53 を超えるので、JS の数値では丸められてしまう
+        self.assertGreater(self.tweet.pk, 2**53)
+        for name in ("tweets:like", "tweets:unlike", "tweets:retweet"):
+            response = self.client.post(reverse(name, kwargs={"pk": self.tweet.pk}))
+            self.assertEqual(response.json()["tweet_pk"], str(self.tweet.pk))
+
     def test_failure_post_with_not_exist_tweet(self):
         response = self.client.post(reverse("tweets:like", kwargs={"pk": 0}))
         self.assertEqual(response.status_code, 404)
@@ -161,3 +203,777 @@ class TestUnfavoriteView(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertFalse(Like.objects.filter(target_tweet=self.tweet).exists())
+
+
+class TestArchiveTweets(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="test", email="test@email.com", password="testpass"
+        )
+        self.user2 = User.objects.create_user(
+            username="test2", email="test2@email.com", password="testpass2"
+        )
+        self.client.force_login(self.user)
+        self.old_tweets = []
+        for i in range(3):
+            tweet = Tweet.objects.create(user=self.user, content=f"old tweet {i}")
+            self.old_tweets.append(tweet)
+        Like.objects.create(target_tweet=self.old_tweets[0], user=self.user)
+        Like.objects.create(target_tweet=self.old_tweets[0], user=self.user2)
+        Tweet.objects.filter(pk__in=[t.pk for t in self.old_tweets]).update(
+            created_at=timezone.now() - timedelta(days=400)
+        )
+        self.new_tweet = Tweet.objects.create(user=self.user, content="new tweet")
+
+    def test_old_tweets_are_moved_in_chunks(self):
+        call_command("archive_tweets", chunk_size=2, max_chunks=1, stdout=None)
+        self.assertEqual(ArchivedTweet.objects.count(), 2)
+        call_command("archive_tweets", chunk_size=2, stdout=None)
+        self.assertEqual(ArchivedTweet.objects.count(), 3)
+        self.assertEqual(list(Tweet.objects.all()), [self.new_tweet])
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(ArchivedLike.objects.count(), 2)
+        archived = ArchivedTweet.objects.get(pk=self.old_tweets[0].pk)
+        self.assertEqual(archived.like_count, 2)
+        self.assertEqual(archived.content, "old tweet 0")
+
+    def test_retweets_replies_and_notifications(self):
+        old = self.old_tweets[0]
+        self.client.post(reverse("tweets:retweet", kwargs={"pk": old.pk}))
+        reply = Tweet.objects.create(user=self.user2, content="reply", parent=old)
+        inbox.record(
+            [
+                {
+                    "recipient_id": self.user2.pk,
+                    "verb": "like",
+                    "tweet_id": old.pk,
+                    "actor_id": self.user.pk,
+                }
+            ]
+        )
+        call_command("archive_tweets", stdout=None)
+
+        archived = ArchivedTweet.objects.get(pk=old.pk)
+        self.assertEqual((archived.retweet_count, archived.reply_count), (1, 1))
+        self.assertFalse(Retweet.objects.exists())
+        self.assertEqual(archived.retweets.get().user_id, self.user.pk)
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(inbox.unread_count(self.user2), 0)
+        reply.refresh_from_db()
+        self.assertEqual(reply.parent_id, old.pk)
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": reply.pk}))
+        self.assertEqual(response.context["ancestors"], [archived])
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": old.pk}))
+        self.assertContains(response, "1件のリツイート")
+
+    def test_detail_falls_through_to_archive(self):
+        call_command("archive_tweets", stdout=None)
+        response = self.client.get(
+            reverse("tweets:detail", kwargs={"pk": self.old_tweets[0].pk})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["tweet"].is_archived)
+        self.assertContains(response, "2件のいいね")
+
+    @override_settings(PROFILE_TWEETS_PER_PAGE=3)
+    def test_profile_pages_continue_into_archive(self):
+        call_command("archive_tweets", stdout=None)
+        url = reverse("accounts:user_profile", args=[self.user.pk])
+        response = self.client.get(url)
+        self.assertEqual(
+            [tweet.content for tweet in response.context["tweets"]],
+            ["new tweet", "old tweet 2", "old tweet 1"],
+        )
+        response = self.client.get(url, {"page": 2})
+        self.assertEqual(
+            [tweet.content for tweet in response.context["tweets"]], ["old tweet 0"]
+        )
+
+
+class TestFeedRanking(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="test", email="test@email.com", password="testpass"
+        )
+        self.friend = User.objects.create_user(
+            username="friend", email="friend@email.com", password="testpass"
+        )
+        self.stranger = User.objects.create_user(
+            username="stranger", email="stranger@email.com", password="testpass"
+        )
+        FriendShip.objects.create(follower=self.user, following=self.friend)
+        self.quiet = Tweet.objects.create(user=self.friend, content="quiet")
+        self.popular = Tweet.objects.create(user=self.friend, content="popular")
+        self.own = Tweet.objects.create(user=self.user, content="own")
+        self.other = Tweet.objects.create(user=self.stranger, content="other")
+        for user in (self.user, self.stranger):
+            Like.objects.create(target_tweet=self.popular, user=user)
+        Tweet.objects.filter(pk=self.popular.pk).update(
+            created_at=timezone.now() - timedelta(hours=1)
+        )
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_score_prefers_fresh_and_liked(self):
+        fresh, old, liked = ranking.score([0, 48, 48], [0, 0, 50], [0, 0, 0])
+        self.assertGreater(fresh, old)
+        self.assertGreater(liked, old)
+
+    def test_ranked_feed(self):
+        response = self.client.get(reverse("accounts:home"), {"order": "ranked"})
+        self.assertEqual(response.status_code, 200)
+        # friend のツイートにいいねしているので quiet が own より上に来る
+        self.assertEqual(
+            [tweet.content for tweet in response.context["tweets"]],
+            ["popular", "quiet", "own"],
+        )
+        self.assertEqual(self.client.session["feed_order"], "ranked")
+
+        # 並び順はセッションに残り、短い間はキャッシュから返す
+        Tweet.objects.create(user=self.friend, content="newer")
+        response = self.client.get(reverse("accounts:home"))
+        self.assertEqual(response.context["feed_order"], "ranked")
+        self.assertEqual(len(response.context["tweets"]), 3)
+
+    def test_chronological_feed_is_default(self):
+        response = self.client.get(reverse("accounts:home"))
+        self.assertEqual(response.context["feed_order"], "chronological")
+        self.assertEqual(len(response.context["tweets"]), 4)
+
+
+class TestTweetFingerprint(TestCase):
+    spam = "今だけ限定！こちらのリンクから登録するだけで10万円もらえます https://example.com/a"
+
+    def setUp(self):
+        fingerprint.reset_index()
+        self.user = User.objects.create_user(
+            username="test", email="test@email.com", password="testpass"
+        )
+        self.client.force_login(self.user)
+        self.url = reverse("tweets:create")
+
+    def post(self, content):
+        # 指紋はコミットの後でインデックスに入る
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, {"content": content})
+
+    def test_normalized_duplicates_match_exactly(self):
+        a = fingerprint.fingerprint(self.spam)
+        b = fingerprint.fingerprint(self.spam.replace("！", "!") + "  https://x.example/b")
+        self.assertEqual(a.exact, b.exact)
+
+    def test_near_duplicate_is_found(self):
+        index = fingerprint.RecentContentIndex(capacity=10, threshold=0.8)
+        index.add(fingerprint.fingerprint(self.spam))
+        near = fingerprint.fingerprint(self.spam.replace("10万円", "10万円以上"))
+        other = fingerprint.fingerprint("今日は天気が良いので近所の公園まで散歩に行ってきました")
+        self.assertGreaterEqual(index.find(near), 0.8)
+        self.assertEqual(index.find(other), 0.0)
+
+    def test_index_is_bounded(self):
+        index = fingerprint.RecentContentIndex(capacity=2, threshold=0.8)
+        first = fingerprint.fingerprint(self.spam)
+        index.add(first)
+        index.add(fingerprint.fingerprint("今日は天気が良いので近所の公園まで散歩に行ってきました"))
+        index.add(fingerprint.fingerprint("明日は朝から会議があるので早めに寝ることにします。おやすみなさい"))
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.find(first), 0.0)
+
+    def test_short_content_is_ignored(self):
+        self.assertIsNone(fingerprint.fingerprint("おはよう"))
+
+    def test_duplicate_is_flagged(self):
+        self.post(self.spam)
+        self.post(self.spam)
+        self.assertEqual(
+            list(Tweet.objects.order_by("pk").values_list("is_flagged", flat=True)),
+            [False, True],
+        )
+
+    @override_settings(TWEET_DUPLICATE_ACTION="reject")
+    def test_duplicate_is_rejected(self):
+        self.post(self.spam)
+        response = self.post(self.spam)
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response, "form", "content", "同じ内容のツイートが最近投稿されています。"
+        )
+        self.assertEqual(Tweet.objects.count(), 1)
+
+    @override_settings(TWEET_DUPLICATE_ACTION="ratelimit", TWEET_DUPLICATE_RATE="1/h")
+    def test_duplicate_is_rate_limited(self):
+        fingerprint.duplicate_limiter.buckets.clear()
+        for _ in range(2):
+            response = self.post(self.spam)
+            self.assertEqual(response.status_code, 302)
+        response = self.post(self.spam)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(Tweet.objects.count(), 2)
+
+    def test_content_is_fingerprinted_once(self):
+        with mock.patch(
+            "tweets.fingerprint.fingerprint", wraps=fingerprint.fingerprint
+        ) as fingerprinted:
+            self.post(self.spam)
+        self.assertEqual(fingerprinted.call_count, 1)
+        self.assertEqual(len(fingerprint.get_index()), 1)
+
+    def test_rolled_back_tweet_is_not_indexed(self):
+        with mock.patch("outbox.events.record", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.post(self.spam)
+        self.assertEqual(len(fingerprint.get_index()), 0)
+        self.post(self.spam)
+        self.assertFalse(Tweet.objects.get().is_flagged)
+
+
+@override_settings(JOBS_EAGER=True, ADMIN_ACTION_BATCH_SIZE=2)
+class TestTweetAdmin(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="testpassword"
+        )
+        self.client.login(username="admin", password="testpassword")
+        self.tweets = [
+            Tweet.objects.create(user=self.admin, content=f"tweet{i}") for i in range(5)
+        ]
+        self.url = reverse("admin:tweets_tweet_changelist")
+
+    def test_changelist(self):
+        self.tweets[0].soft_delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["cl"].result_count, 5)
+
+    # 途中でキャッシュの無効化を読みに行くとクエリ数が変わるので止めておく
+    @override_settings(INVALIDATION_POLL_SECONDS=60 * 60)
+    def test_changelist_query_count_does_not_grow(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        for i in range(5):
+            user = User.objects.create_user(
+                username=f"user{i}", email=f"user{i}@example.com"
+            )
+            Tweet.objects.create(user=user, content="more")
+        with self.assertNumQueries(len(few)):
+            self.client.get(self.url)
+
+    def test_bulk_action_runs_as_batched_jobs(self):
+        response = self.client.post(
+            self.url,
+            {
+                "action": "soft_delete",
+                "_selected_action": [tweet.pk for tweet in self.tweets],
+            },
+            follow=True,
+        )
+        self.assertContains(response, "5 件を 3 個のジョブに分けて登録しました")
+        self.assertFalse(Tweet.objects.exists())
+        self.assertEqual(Tweet.all_objects.count(), 5)
+
+    def test_flag_action(self):
+        self.client.post(
+            self.url,
+            {"action": "flag", "_selected_action": [self.tweets[0].pk]},
+        )
+        self.assertTrue(Tweet.all_objects.get(pk=self.tweets[0].pk).is_flagged)
+
+
+class TestTweetReplies(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.client.login(username="sample", password="testpassword")
+        self.root = Tweet.objects.create(user=self.user, content="root")
+
+    def reply(self, parent, content="reply"):
+        return Tweet.objects.create(user=self.user, content=content, parent=parent)
+
+    def test_reply_stores_thread_position(self):
+        child = self.reply(self.root)
+        grandchild = self.reply(child)
+        self.assertEqual(grandchild.root_id, self.root.pk)
+        self.assertEqual(grandchild.depth, 2)
+        self.assertTrue(grandchild.path.startswith(child.path))
+        self.assertEqual(threads.ancestor_ids(grandchild), [self.root.pk, child.pk])
+        self.root.refresh_from_db()
+        self.assertEqual(self.root.reply_count, 1)
+
+        grandchild.soft_delete()
+        child.refresh_from_db()
+        self.assertEqual(child.reply_count, 0)
+
+    def test_thread_is_read_depth_first_in_one_query(self):
+        a = self.reply(self.root, "a")
+        b = self.reply(self.root, "b")
+        a1 = self.reply(a, "a1")
+        a1x = self.reply(a1, "a1x")
+        with self.assertNumQueries(1):
+            replies, cursor = threads.replies(self.root)
+            names = [reply.content for reply in replies]
+        self.assertEqual(names, ["a", "a1", "b"])
+        self.assertIsNone(cursor)
+        self.assertTrue(replies[1].has_more)
+
+        subtree, _ = threads.replies(a1)
+        self.assertEqual([reply.pk for reply in subtree], [a1x.pk])
+        self.assertEqual(b.depth, 1)
+
+    @override_settings(TWEET_REPLY_PAGE_SIZE=2)
+    def test_replies_json_is_paginated(self):
+        for i in range(3):
+            self.reply(self.root, f"reply{i}")
+        url = reverse("tweets:replies", kwargs={"pk": self.root.pk})
+        first = self.client.get(url).json()
+        self.assertEqual([r["content"] for r in first["replies"]], ["reply0", "reply1"])
+        second = self.client.get(url, {"cursor": first["next"]}).json()
+        self.assertEqual([r["content"] for r in second["replies"]], ["reply2"])
+        self.assertIsNone(second["next"])
+
+    @override_settings(TWEET_REPLY_PAGE_SIZE=5)
+    def test_hidden_replies_do_not_end_pagination(self):
+        muted = User.objects.create_user(
+            username="muted", email="muted@example.com", password="testpassword"
+        )
+        for i in range(30):
+            Tweet.objects.create(user=muted, content=f"muted{i}", parent=self.root)
+        for i in range(4):
+            self.reply(self.root, f"visible{i}")
+        Mute.objects.create(muter=self.user, muted=muted)
+        viewer_filter = visibility.for_viewer(self.user.pk)
+
+        replies, cursor = threads.replies(self.root, viewer_filter=viewer_filter)
+        self.assertEqual(
+            [r.content for r in replies], [f"visible{i}" for i in range(4)]
+        )
+        self.assertIsNone(cursor)
+
+        # 読み足す回数を使い切ったら、読んだところから続きを返す
+        url = reverse("tweets:replies", kwargs={"pk": self.root.pk})
+        contents = []
+        params = {}
+        with override_settings(TWEET_REPLY_MAX_SCANS=1):
+            for _ in range(10):
+                page = self.client.get(url, params).json()
+                contents += [r["content"] for r in page["replies"]]
+                if page["next"] is None:
+                    break
+                params = {"cursor": page["next"]}
+        self.assertEqual(contents, [f"visible{i}" for i in range(4)])
+
+    def test_reply_view_and_detail(self):
+        response = self.client.post(
+            reverse("tweets:reply", kwargs={"pk": self.root.pk}),
+            {"content": "thanks"},
+        )
+        self.assertRedirects(
+            response, reverse("tweets:detail", kwargs={"pk": self.root.pk})
+        )
+        reply = Tweet.objects.get(parent=self.root)
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": reply.pk}))
+        self.assertEqual(response.context["ancestors"], [self.root])
+        response = self.client.get(
+            reverse("tweets:detail", kwargs={"pk": self.root.pk})
+        )
+        self.assertContains(response, "thanks")
+
+    def test_reply_view_checks_login_first(self):
+        self.client.logout()
+        response = self.client.post(
+            reverse("tweets:reply", kwargs={"pk": 0}), {"content": "thanks"}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("tweets:reply", settings.RATELIMITS)
+
+    def test_depth_is_capped(self):
+        tweet = self.root
+        for _ in range(Tweet.MAX_DEPTH + 2):
+            tweet = self.reply(tweet)
+        self.assertEqual(tweet.depth, Tweet.MAX_DEPTH)
+        self.assertLessEqual(len(tweet.path), 240)
+
+
+class TestRetweet(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.fans = [
+            User.objects.create_user(username=f"fan{i}", email=f"fan{i}@example.com")
+            for i in range(4)
+        ]
+        self.tweet = Tweet.objects.create(user=self.author, content="example_tweet")
+        self.client.force_login(self.fans[0])
+
+    def test_retweet_and_unretweet(self):
+        url = reverse("tweets:retweet", kwargs={"pk": self.tweet.pk})
+        self.assertEqual(self.client.post(url).json()["retweet_count"], 1)
+        self.assertEqual(self.client.post(url).json()["retweet_count"], 1)
+        self.assertEqual(Retweet.objects.count(), 1)
+        response = self.client.post(
+            reverse("tweets:unretweet", kwargs={"pk": self.tweet.pk})
+        )
+        self.assertEqual(response.json()["retweet_count"], 0)
+        self.assertFalse(Retweet.objects.exists())
+
+    def test_retweets_are_collapsed_into_one_entry(self):
+        newer = Tweet.objects.create(user=self.author, content="newer")
+        for fan in self.fans:
+            Retweet.objects.create(user=fan, tweet=self.tweet)
+        entries = timeline.home()
+        self.assertEqual([entry.pk for entry in entries], [self.tweet.pk, newer.pk])
+        self.assertEqual(entries[0].retweeted_by, self.fans[::-1])
+
+        response = self.client.get(reverse("accounts:home"))
+        self.assertContains(response, "fan3さんと他3人がリツイート", count=1)
+
+    def test_profile_shows_own_retweets(self):
+        other = Tweet.objects.create(user=self.fans[1], content="from fan1")
+        own = Tweet.objects.create(user=self.fans[0], content="own tweet")
+        Retweet.objects.create(user=self.fans[0], tweet=other)
+        Retweet.objects.create(user=self.fans[0], tweet=own)
+        response = self.client.get(
+            reverse("accounts:user_profile", kwargs={"pk": self.fans[0].pk})
+        )
+        self.assertEqual(
+            [tweet.pk for tweet in response.context["tweets"]], [own.pk, other.pk]
+        )
+        self.assertContains(response, "fan0さんがリツイート", count=2)
+
+    @override_settings(PROFILE_TWEETS_PER_PAGE=1)
+    def test_profile_pages_split_retweets_by_time(self):
+        first = Tweet.objects.create(user=self.fans[0], content="first")
+        Retweet.objects.create(user=self.fans[0], tweet=self.tweet)
+        Tweet.objects.create(user=self.fans[0], content="second")
+        url = reverse("accounts:user_profile", kwargs={"pk": self.fans[0].pk})
+        page1 = self.client.get(url).context["tweets"]
+        page2 = self.client.get(url, {"page": 2}).context["tweets"]
+        self.assertEqual(len(page1), 1)
+        self.assertEqual([tweet.pk for tweet in page2], [self.tweet.pk, first.pk])
+
+    def test_purged_user_retweets_are_uncounted(self):
+        for fan in self.fans[:2]:
+            self.client.force_login(fan)
+            self.client.post(reverse("tweets:retweet", kwargs={"pk": self.tweet.pk}))
+        self.fans[0].soft_delete()
+        call_command("purge_deleted", stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.retweet_count, 1)
+
+
+@override_settings(TWEET_SHARDS=["default", "shard1"], TWEET_SHARD_BUCKETS=2)
+class TestTweetSharding(TestCase):
+    databases = {"default", "shard1"}
+
+    def setUp(self):
+        # user_id が偶数なら default、奇数なら shard1
+        users = [
+            User.objects.create_user(
+                username=f"user{i}", email=f"user{i}@example.com", password="pw"
+            )
+            for i in range(2)
+        ]
+        self.even, self.odd = sorted(users, key=lambda user: user.pk % 2)
+        self.client.force_login(self.even)
+
+    def test_users_are_replicated(self):
+        self.assertTrue(User.objects.using("shard1").filter(pk=self.odd.pk).exists())
+
+    def test_tweets_and_likes_follow_the_author(self):
+        tweet = Tweet.objects.create(user=self.odd, content="on shard1")
+        self.assertEqual(tweet._state.db, "shard1")
+        self.assertFalse(Tweet.objects.using("default").filter(pk=tweet.pk).exists())
+
+        self.client.post(reverse("tweets:like", kwargs={"pk": tweet.pk}))
+        self.assertEqual(Like.objects.using("shard1").count(), 1)
+        self.assertEqual(Like.objects.using("default").count(), 0)
+
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": tweet.pk}))
+        self.assertEqual(response.context["tweet"], tweet)
+        self.assertIn(tweet.pk, response.context["liked_list"])
+
+    def test_create_view_writes_to_author_shard(self):
+        self.client.force_login(self.odd)
+        self.client.post(reverse("tweets:create"), {"content": "hello"})
+        self.assertEqual(Tweet.objects.using("shard1").get().content, "hello")
+
+    def test_home_timeline_merges_shards(self):
+        tweets = [
+            Tweet.objects.create(user=user, content=f"tweet{i}")
+            for i, user in enumerate([self.even, self.odd, self.even, self.odd])
+        ]
+        Retweet.objects.create(user=self.even, tweet=tweets[1])
+        entries = timeline.home()
+        self.assertEqual(entries, [tweets[1], tweets[3], tweets[2], tweets[0]])
+
+        merged = shards.merge(
+            [qs.order_by("-pk") for qs in shards.scatter(Tweet.objects.all())],
+            key=lambda tweet: tweet.pk,
+            reverse=True,
+            limit=3,
+        )
+        self.assertEqual(merged, tweets[:0:-1])
+
+    def test_profile_and_stats_read_author_shard(self):
+        tweet = Tweet.objects.create(user=self.odd, content="on shard1")
+        Like.objects.create(user=self.even, target_tweet=tweet)
+        FriendShip.objects.create(follower=self.even, following=self.odd)
+        response = self.client.get(
+            reverse("accounts:user_profile", kwargs={"pk": self.odd.pk})
+        )
+        self.assertEqual(list(response.context["tweets"]), [tweet])
+        self.assertEqual(response.context["stats"]["tweet_count"], 1)
+        self.assertEqual(response.context["stats"]["likes_received"], 1)
+        self.assertEqual(response.context["stats"]["follower_count"], 1)
+
+    def test_replies_across_shards(self):
+        root = Tweet.objects.create(user=self.even, content="root")
+        reply = Tweet.objects.create(user=self.odd, content="reply", parent=root)
+        self.assertEqual(reply._state.db, "shard1")
+        root.refresh_from_db()
+        self.assertEqual(root.reply_count, 1)
+        replies, _ = threads.replies(root)
+        self.assertEqual(replies, [reply])
+        self.assertEqual(threads.ancestors(reply), [root])
+
+    def test_archive_reads_every_shard(self):
+        old = Tweet.objects.create(user=self.odd, content="old")
+        Like.objects.create(user=self.even, target_tweet=old)
+        Tweet.all_objects.using("shard1").filter(pk=old.pk).update(
+            created_at=timezone.now() - timedelta(days=400)
+        )
+        call_command("archive_tweets", stdout=None)
+        self.assertFalse(Tweet.all_objects.using("shard1").exists())
+        self.assertFalse(Like.objects.using("shard1").exists())
+        self.assertEqual(ArchivedTweet.objects.get().like_count, 1)
+
+    def test_purge_deletes_rows_on_every_shard(self):
+        tweet = Tweet.objects.create(user=self.odd, content="on shard1")
+        Like.objects.create(user=self.even, target_tweet=tweet)
+        Retweet.objects.create(user=self.even, tweet=tweet)
+        Tweet.all_objects.using("shard1").filter(pk=tweet.pk).update(retweet_count=1)
+        gone = Tweet.objects.create(user=self.odd, content="deleted")
+        gone.soft_delete()
+        self.even.soft_delete()
+        call_command("purge_deleted", stdout=StringIO())
+        self.assertFalse(Tweet.all_objects.using("shard1").filter(pk=gone.pk).exists())
+        self.assertFalse(Like.objects.using("shard1").exists())
+        self.assertFalse(Retweet.objects.using("shard1").exists())
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.retweet_count, 0)
+        self.assertFalse(User.objects.using("shard1").filter(pk=self.even.pk).exists())
+
+    @override_settings(JOBS_EAGER=True)
+    def test_admin_lists_one_shard_at_a_time(self):
+        User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="testpassword"
+        )
+        self.client.login(username="admin", password="testpassword")
+        tweet = Tweet.objects.create(user=self.odd, content="on shard1")
+        url = reverse("admin:tweets_tweet_changelist")
+        response = self.client.get(url)
+        self.assertEqual(response.context["cl"].result_count, 0)
+        response = self.client.get(url, {"shard": "shard1"})
+        self.assertEqual(list(response.context["cl"].result_list), [tweet])
+        response = self.client.get(
+            reverse("admin:tweets_tweet_change", args=[tweet.pk])
+        )
+        self.assertContains(response, "on shard1")
+        self.client.post(
+            f"{url}?shard=shard1", {"action": "flag", "_selected_action": [tweet.pk]}
+        )
+        tweet.refresh_from_db()
+        self.assertTrue(tweet.is_flagged)
+
+
+class TestHyperLogLog(TestCase):
+    def test_estimate_is_close(self):
+        sketch = hll.HyperLogLog()
+        for i in range(20_000):
+            sketch.add(f"user{i}")
+        self.assertAlmostEqual(sketch.count(), 20_000, delta=20_000 * 0.03)
+        self.assertEqual(hll.HyperLogLog().count(), 0)
+
+    def test_merge_counts_union(self):
+        a, b = hll.HyperLogLog(), hll.HyperLogLog()
+        for i in range(1000):
+            a.add(i)
+            b.add(i + 500)
+        merged = hll.HyperLogLog.from_bytes(a.to_bytes()).merge(b)
+        self.assertAlmostEqual(merged.count(), 1500, delta=1500 * 0.03)
+        self.assertLess(len(a.to_bytes()), len(a.registers))
+
+
+@override_settings(JOBS_EAGER=True, IMPRESSION_BUFFER_EVENTS=3)
+class TestImpressions(TestCase):
+    def setUp(self):
+        impressions.buffer.drain()
+        self.user = User.objects.create_user(
+            username="sample", email="sample@example.com", password="testpassword"
+        )
+        self.tweet = Tweet.objects.create(user=self.user, content="example_tweet")
+
+    def test_views_are_buffered_then_merged(self):
+        impressions.record([self.tweet.pk], 1)
+        impressions.record([self.tweet.pk], 1)
+        self.assertFalse(ImpressionSketch.objects.exists())
+        impressions.record([self.tweet.pk], 2)
+        self.assertEqual(impressions.counts([self.tweet.pk]), {self.tweet.pk: 2})
+        self.assertEqual(ImpressionSketch.objects.count(), 2)
+
+        impressions.record([self.tweet.pk], 3)
+        impressions.flush()
+        self.assertEqual(impressions.counts([self.tweet.pk]), {self.tweet.pk: 3})
+        self.assertEqual(ImpressionSketch.objects.count(), 2)
+
+    def test_day_buckets_merge_distinct_viewers(self):
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        pairs = [hll.register_for(viewer) for viewer in (1, 2)]
+        impressions.merge(yesterday, {self.tweet.pk: pairs})
+        impressions.merge(today, {self.tweet.pk: pairs[:1]})
+        self.assertEqual(
+            impressions.distinct_between(self.tweet.pk, yesterday, today), 2
+        )
+        self.assertEqual(impressions.counts([self.tweet.pk]), {self.tweet.pk: 2})
+
+    def test_flusher_merges_buffer_when_due(self):
+        flusher = impressions.Flusher()
+        impressions.record([self.tweet.pk], 1)
+        flusher.tick(time.monotonic())
+        self.assertFalse(ImpressionSketch.objects.exists())
+        flusher.tick(time.monotonic() + 60)
+        self.assertEqual(impressions.counts([self.tweet.pk]), {self.tweet.pk: 1})
+
+    def test_flusher_flushes_at_stop(self):
+        flusher = impressions.Flusher()
+        impressions.record([self.tweet.pk], 1)
+        flusher.stop()
+        self.assertEqual(impressions.counts([self.tweet.pk]), {self.tweet.pk: 1})
+
+    def test_flusher_thread_is_started_once_per_process(self):
+        flusher = impressions.Flusher()
+        with mock.patch("tweets.impressions.threading.Thread") as thread:
+            flusher.ensure_started()
+            thread.assert_not_called()
+            with mock.patch("tweets.impressions.atexit.register") as register:
+                flusher.enable()
+            register.assert_called_once_with(flusher.stop)
+            flusher.ensure_started()
+            flusher.ensure_started()
+            self.assertEqual(thread.call_count, 1)
+            with mock.patch("tweets.impressions.os.getpid", return_value=-1):
+                flusher.ensure_started()
+            self.assertEqual(thread.call_count, 2)
+
+    def test_flush_keeps_the_day_of_each_view(self):
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        impressions.buffer.add(self.tweet.pk, 1, yesterday)
+        impressions.buffer.add(self.tweet.pk, 2, today)
+        impressions.flush()
+        days = ImpressionSketch.objects.filter(day__isnull=False)
+        self.assertEqual(
+            dict(days.values_list("day", "estimate")), {yesterday: 1, today: 1}
+        )
+        self.assertEqual(impressions.counts([self.tweet.pk]), {self.tweet.pk: 2})
+
+    def test_detail_shows_count(self):
+        self.client.force_login(self.user)
+        url = reverse("tweets:detail", kwargs={"pk": self.tweet.pk})
+        for _ in range(3):
+            self.client.get(url)
+        response = self.client.get(url)
+        self.assertContains(response, "1人が表示")
+
+
+class TestScheduledTweets(TestCase):
+    spam = "今だけ限定！こちらのリンクから登録するだけで10万円もらえます https://example.com/a"
+
+    def setUp(self):
+        fingerprint.reset_index()
+        self.user = User.objects.create_user(
+            username="test", email="test@email.com", password="testpass"
+        )
+        self.client.force_login(self.user)
+        self.url = reverse("tweets:schedule")
+
+    def schedule(self, content, seconds):
+        return ScheduledTweet.objects.create(
+            user=self.user,
+            content=content,
+            due_at=timezone.now() + timedelta(seconds=seconds),
+        )
+
+    def test_schedule_and_cancel(self):
+        due_at = timezone.localtime() + timedelta(hours=1)
+        response = self.client.post(
+            self.url,
+            {"content": "later", "due_at": due_at.strftime("%Y-%m-%dT%H:%M")},
+        )
+        self.assertRedirects(response, self.url)
+        scheduled = ScheduledTweet.objects.get()
+        self.assertEqual(scheduled.user, self.user)
+        self.assertContains(self.client.get(self.url), "later")
+
+        past = timezone.localtime() - timedelta(hours=1)
+        response = self.client.post(
+            self.url,
+            {"content": "past", "due_at": past.strftime("%Y-%m-%dT%H:%M")},
+        )
+        self.assertFormError(
+            response, "form", "due_at", "未来の日時を指定してください。"
+        )
+
+        self.client.post(reverse("tweets:cancel_scheduled", args=[scheduled.pk]))
+        self.assertFalse(ScheduledTweet.objects.exists())
+        self.assertFalse(Tweet.objects.exists())
+
+    @override_settings(SCHEDULED_TWEET_BATCH_SIZE=2)
+    def test_dispatcher_publishes_due_tweets_in_batches(self):
+        for i in range(3):
+            self.schedule(f"scheduled {i}", -60)
+        later = self.schedule("later", 30)
+        dispatcher = scheduling.Dispatcher()
+        now = timezone.now()
+
+        self.assertEqual(dispatcher.step(now), (2, 0))
+        self.assertEqual(dispatcher.step(now), (1, 0))
+        published, wait = dispatcher.step(now)
+        self.assertEqual(published, 0)
+        self.assertAlmostEqual(wait, 10, delta=1)  # 次の読み直し
+
+        self.assertEqual(
+            sorted(Tweet.objects.values_list("content", flat=True)),
+            ["scheduled 0", "scheduled 1", "scheduled 2"],
+        )
+        self.assertEqual(OutboxEvent.objects.filter(topic="tweet.created").count(), 3)
+        done = ScheduledTweet.objects.filter(published_at__isnull=False)
+        self.assertEqual(
+            set(done.values_list("tweet_id", flat=True)),
+            set(Tweet.objects.values_list("pk", flat=True)),
+        )
+
+        # 期限が来たら投稿する
+        self.assertEqual(dispatcher.step(later.due_at), (1, 0))
+        self.assertTrue(Tweet.objects.filter(content="later").exists())
+
+    def test_dispatch_is_idempotent(self):
+        scheduled = self.schedule("hello", -60)
+        # 前回 tweet_id を振って投稿したところで止まった
+        scheduled.tweet_id = Tweet.objects.create(user=self.user, content="hello").pk
+        scheduled.save()
+        self.assertEqual(scheduling.dispatch([scheduled.pk], timezone.now()), 0)
+        self.assertEqual(Tweet.objects.count(), 1)
+        scheduled.refresh_from_db()
+        self.assertIsNotNone(scheduled.published_at)
+
+    def test_duplicates_are_flagged(self):
+        ids = [self.schedule(self.spam, -60).pk for _ in range(2)]
+        self.assertEqual(scheduling.dispatch(ids, timezone.now()), 2)
+        self.assertEqual(
+            list(Tweet.objects.order_by("pk").values_list("is_flagged", flat=True)),
+            [False, True],
+        )
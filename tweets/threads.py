@@ -0,0 +1,79 @@
+import heapq
+from operator import attrgetter
+
+from django.conf import settings
+
+from . import shards
+from .models import PATH_SEGMENT_WIDTH, ArchivedTweet, Tweet
+
+
+def ancestor_ids(tweet):
+    # path からルートまでの祖先の id を取り出す (ルート側から順に)
+    if not tweet.root_id:
+        return []
+    segments = [
+        tweet.path[i : i + PATH_SEGMENT_WIDTH]
+        for i in range(0, len(tweet.path) - PATH_SEGMENT_WIDTH, PATH_SEGMENT_WIDTH)
+    ]
+    return [tweet.root_id] + [int(segment, 16) for segment in segments]
+
+
+def ancestors(tweet):
+    # 古い祖先はアーカイブに移っていることがあるので、見つからない分はそちらを探す
+    ids = ancestor_ids(tweet)
+    found = shards.in_bulk(Tweet.objects.select_related("user"), ids)
+    missing = [pk for pk in ids if pk not in found]
+    if missing:
+        found.update(ArchivedTweet.objects.prefetch_related("user").in_bulk(missing))
+    return [found[pk] for pk in ids if pk in found]
+
+
+def replies(tweet, cursor=None, size=None, viewer_filter=None):
+    # tweet の下の返信を path 順に 1 ページ分取る。
+    # 各シャードで (root_id, path) の索引の範囲検索で済み、深すぎる返信は後から別に読む。
+    # viewer_filter があればブロック・ミュートした人の返信を除き、その分を読み足す
+    size = size or settings.TWEET_REPLY_PAGE_SIZE
+    keep = viewer_filter.keep_tweet if viewer_filter else None
+    fetch = size + 1
+    if keep is not None:
+        fetch *= settings.TIMELINE_OVERFETCH_FACTOR
+    queryset = (
+        Tweet.objects.filter(
+            root_id=tweet.thread_root_id,
+            path__startswith=tweet.path,
+            depth__lte=tweet.depth + settings.TWEET_REPLY_INLINE_DEPTH,
+        )
+        .select_related("user")
+        .order_by("path")
+    )
+    rows = []
+    after = cursor or tweet.path
+    for _ in range(settings.TWEET_REPLY_MAX_SCANS):
+        windows = [
+            list(qs.filter(path__gt=after)[:fetch]) for qs in shards.scatter(queryset)
+        ]
+        # fetch 件読み切ったシャードはその先が分からないので、その最小の path までが読み終えた範囲
+        full = [window[-1].path for window in windows if len(window) == fetch]
+        scanned = min(full) if full else None
+        for reply in heapq.merge(*windows, key=attrgetter("path")):
+            if scanned is not None and reply.path > scanned:
+                break
+            if keep is None or keep(reply):
+                rows.append(reply)
+                if len(rows) > size:
+                    break
+        if len(rows) > size or scanned is None:
+            break
+        after = scanned
+
+    for reply in rows:
+        reply.indent = reply.depth - tweet.depth - 1
+        # 表示しない深さに返信があれば「続き」から読む
+        reply.has_more = (
+            reply.reply_count > 0
+            and reply.depth == tweet.depth + settings.TWEET_REPLY_INLINE_DEPTH
+        )
+    if len(rows) > size:
+        return rows[:size], rows[size - 1].path
+    # 隠れた返信ばかりで読み切れなかったときは、読んだところから続ける
+    return rows, scanned
@@ -0,0 +1,83 @@
+import heapq
+from operator import attrgetter, itemgetter
+
+from django.conf import settings
+
+from . import shards
+from .models import Retweet, Tweet
+
+
+def alive_retweets():
+    return Retweet.objects.select_related("user", "tweet__user").filter(
+        user__deleted_at__isnull=True,
+        tweet__deleted_at__isnull=True,
+        tweet__user__deleted_at__isnull=True,
+    )
+
+
+def collapse(tweets, retweets):
+    # 新しい順のツイートとリツイートを 1 回なめて、同じ元ツイートを 1 件にまとめる。
+    # 最初に出てきた (一番新しい) 位置に置き、リツイートした人を retweeted_by に集める
+    entries = {}
+    events = heapq.merge(
+        ((tweet.created_at, tweet, None) for tweet in tweets),
+        ((retweet.created_at, retweet.tweet, retweet.user) for retweet in retweets),
+        key=itemgetter(0),
+        reverse=True,
+    )
+    for at, tweet, retweeter in events:
+        entry = entries.get(tweet.pk)
+        if entry is None:
+            entry = entries[tweet.pk] = tweet
+            entry.activity_at = at
+            entry.retweeted_by = []
+        if retweeter is not None:
+            entry.retweeted_by.append(retweeter)
+    return list(entries.values())
+
+
+def newest(queryset, key, limit, keep=None):
+    # 全シャードから新しい順に limit 件 (シャードごとのカーソルをヒープでマージ)。
+    # keep で落とす行がある分は、各シャード limit * TIMELINE_OVERFETCH_FACTOR 件まで
+    # 読み足して件数を埋める
+    fetch = limit if keep is None else limit * settings.TIMELINE_OVERFETCH_FACTOR
+    return shards.merge(
+        [qs[:fetch] for qs in shards.scatter(queryset)],
+        key=key,
+        reverse=True,
+        limit=limit,
+        keep=keep,
+    )
+
+
+def home(limit=None, viewer_filter=None):
+    # 新しいツイートとリツイートを FEED_CANDIDATE_LIMIT 件ずつ取ってまとめる。
+    # viewer_filter があれば、ブロック・ミュートした人の分を除いて数える
+    limit = limit or settings.FEED_CANDIDATE_LIMIT
+    keep_tweet = keep_retweet = None
+    if viewer_filter:
+        keep_tweet = viewer_filter.keep_tweet
+        keep_retweet = viewer_filter.keep_retweet
+    tweets = Tweet.objects.select_related("user").order_by("-pk")
+    retweets = alive_retweets().order_by("-created_at", "-pk")
+    return collapse(
+        newest(tweets, attrgetter("pk"), limit, keep_tweet),
+        newest(retweets, attrgetter("created_at", "pk"), limit, keep_retweet),
+    )
+
+
+def with_retweets(user, tweets, newer_than=None, older_than=None, viewer_filter=None):
+    # プロフィールの 1 ページ分に、同じ期間の本人のリツイートを差し込む
+    keep = viewer_filter.keep_retweet if viewer_filter else None
+    retweets = alive_retweets().filter(user=user)
+    if newer_than is not None:
+        retweets = retweets.filter(created_at__gte=newer_than)
+    if older_than is not None:
+        retweets = retweets.filter(created_at__lt=older_than)
+    retweets = newest(
+        retweets.order_by("-created_at", "-pk"),
+        attrgetter("created_at", "pk"),
+        settings.FEED_CANDIDATE_LIMIT,
+        keep,
+    )
+    return collapse(tweets, retweets)
@@ -5,8 +5,18 @@ from . import views
 app_name = "tweets"
 urlpatterns = [
     path("create/", views.TweetCreateView.as_view(), name="create"),
+    path("schedule/", views.ScheduledTweetView.as_view(), name="schedule"),
+    path(
+        "schedule/<int:pk>/cancel/",
+        views.CancelScheduledTweetView.as_view(),
+        name="cancel_scheduled",
+    ),
     path("<int:pk>/", views.TweetDetailView.as_view(), name="detail"),
+    path("<int:pk>/reply/", views.ReplyCreateView.as_view(), name="reply"),
+    path("<int:pk>/replies/", views.ReplyListView.as_view(), name="replies"),
     path("<int:pk>/delete/", views.TweetDeleteView.as_view(), name="delete"),
     path("<int:pk>/like/", views.LikeView.as_view(), name="like"),
     path("<int:pk>/unlike/", views.UnlikeView.as_view(), name="unlike"),
+    path("<int:pk>/retweet/", views.RetweetView.as_view(), name="retweet"),
+    path("<int:pk>/unretweet/", views.UnretweetView.as_view(), name="unretweet"),
 ]
@@ -1,12 +1,25 @@
+import math
+import time
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.http import JsonResponse
+from django.db import transaction
+from django.db.models import F
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils.functional import cached_property
 from django.views import View
 from django.views.generic import CreateView, DeleteView, DetailView
 
-from .forms import TweetForm
-from .models import Like, Tweet
+from accounts import visibility
+from core.ratelimit import parse_rate
+from notifications.tasks import notify
+from outbox import events
+
+from . import fingerprint, impressions, posting, shards, threads
+from .forms import ScheduledTweetForm, TweetForm
+from .models import ArchivedTweet, Like, Retweet, ScheduledTweet, Tweet
 
 
 class TweetCreateView(LoginRequiredMixin, CreateView):
@@ -15,9 +28,76 @@ class TweetCreateView(LoginRequiredMixin, CreateView):
     success_url = reverse_lazy("accounts:home")
 
     def form_valid(self, form):  # これで投稿者を紐づけてる
+        form.instance.user = self.request.user
+        fp = fingerprint.fingerprint(form.cleaned_data["content"])
+        if fp is not None and fingerprint.get_index().find(fp):
+            response = self.handle_duplicate(form)
+            if response is not None:
+                return response
+        self.object = posting.publish([form.instance], fingerprints=[fp])[0]
+        return HttpResponseRedirect(self.get_success_url())
+
+    def handle_duplicate(self, form):
+        # 最近の投稿と同じ・よく似た内容だったときの扱い
+        action = settings.TWEET_DUPLICATE_ACTION
+        if action == "reject":
+            form.add_error("content", "同じ内容のツイートが最近投稿されています。")
+            return self.form_invalid(form)
+        if action == "ratelimit":
+            capacity, refill_rate = parse_rate(settings.TWEET_DUPLICATE_RATE)
+            wait = fingerprint.duplicate_limiter.consume(
+                f"duplicate:{self.request.user.pk}",
+                capacity,
+                refill_rate,
+                time.monotonic(),
+            )
+            if wait:
+                response = HttpResponse("同じ内容の投稿が多すぎます。", status=429)
+                response["Retry-After"] = str(math.ceil(wait))
+                return response
+        form.instance.is_flagged = True
+        return None
+
+
+class ReplyCreateView(TweetCreateView):
+    # 親は使うときに引く (ログインの確認より前に全シャードを探さない)
+    @cached_property
+    def parent(self):
+        return shards.get_or_404(Tweet.objects, pk=self.kwargs["pk"])
+
+    def form_valid(self, form):
+        form.instance.parent = self.parent
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse("tweets:detail", kwargs={"pk": self.parent.pk})
+
+
+class ScheduledTweetView(LoginRequiredMixin, CreateView):
+    # 予約投稿の登録と、まだ投稿されていない予約の一覧
+    template_name = "tweets/tweets_schedule.html"
+    form_class = ScheduledTweetForm
+    success_url = reverse_lazy("tweets:schedule")
+
+    def form_valid(self, form):
         form.instance.user = self.request.user
         return super().form_valid(form)
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["scheduled_list"] = ScheduledTweet.objects.filter(
+            user=self.request.user, published_at__isnull=True
+        ).order_by("due_at")
+        return context
+
+
+class CancelScheduledTweetView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        ScheduledTweet.objects.filter(
+            pk=kwargs["pk"], user=request.user, published_at__isnull=True
+        ).delete()
+        return HttpResponseRedirect(reverse("tweets:schedule"))
+
 
 class TweetDetailView(DetailView):
     template_name = "tweets/tweet_detail.html"
@@ -25,34 +105,114 @@ class TweetDetailView(DetailView):
     context_object_name = "tweet"
     # その場で入力されたオブジェクトの名前をつけて、詳細表示できるようにしている
 
+    def get_object(self, queryset=None):
+        # 見つからなければアーカイブを探す
+        try:
+            tweet = shards.get_or_404(Tweet.objects, pk=self.kwargs["pk"])
+        except Http404:
+            tweet = get_object_or_404(
+                ArchivedTweet.objects.prefetch_related("user"), pk=self.kwargs["pk"]
+            )
+        # ブロックしている (されている) 人のツイートは無いものとして扱う
+        if visibility.is_blocked(self.request.user.pk, tweet.user_id):
+            raise Http404
+        return tweet
+
     # 以下、tweet_detailでいいねの県巣を管理できるようにデータをとってきている
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["liked_list"] = self.request.user.like_set.values_list(
-            "target_tweet", flat=True
-        )  # fllatでリスト化している
+        # いいね・リツイートはツイートのシャードにあるので、全シャードから集める
+        user = self.request.user
+        context["liked_list"] = shards.values(
+            Like.objects.filter(user=user), "target_tweet"
+        )
+        context["retweeted_list"] = shards.values(
+            Retweet.objects.filter(user=user), "tweet"
+        )
+        context["ancestors"] = threads.ancestors(self.object)
+        if not self.object.is_archived:
+            impressions.record([self.object.pk], user.pk)
+            impressions.attach_counts([self.object])
+            context["replies"], context["replies_next"] = threads.replies(
+                self.object, viewer_filter=visibility.for_viewer(user.pk)
+            )
+            context["reply_form"] = TweetForm()
         return context
 
 
+class ReplyListView(View):
+    # 深い返信や 2 ページ目以降を JSON で返す (?cursor= は前のページの "next")
+    def get(self, request, *args, **kwargs):
+        tweet = shards.get_or_404(Tweet.objects, pk=kwargs["pk"])
+        viewer_filter = visibility.for_viewer(request.user.pk)
+        if viewer_filter.is_blocked(tweet.user_id):
+            raise Http404
+        replies, next_cursor = threads.replies(
+            tweet, cursor=request.GET.get("cursor"), viewer_filter=viewer_filter
+        )
+        context = {
+            "replies": [
+                {
+                    "id": str(reply.pk),
+                    "username": reply.user.username,
+                    "user_url": reverse("accounts:user_profile", args=[reply.user_id]),
+                    "content": reply.content,
+                    "created_at": reply.created_at,
+                    "indent": reply.indent,
+                    "reply_count": reply.reply_count,
+                    "url": reverse("tweets:detail", args=[reply.pk]),
+                    "replies_url": (
+                        reverse("tweets:replies", args=[reply.pk])
+                        if reply.has_more
+                        else None
+                    ),
+                }
+                for reply in replies
+            ],
+            "next": next_cursor,
+        }
+        return JsonResponse(context)
+
+
 class TweetDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     template_name = "tweets/tweet_delete.html"
     model = Tweet
     success_url = reverse_lazy("accounts:home")
 
+    def get_object(self, queryset=None):
+        return shards.get_or_404(Tweet.objects, pk=self.kwargs["pk"])
+
     def test_func(self):
         current_user = self.request.user
         tweet_user = self.get_object().user
         return current_user.pk == tweet_user.pk
 
+    def form_valid(self, form):
+        # いいねの削除は purge_deleted コマンドに任せて、ここでは印を付けるだけ
+        with transaction.atomic(using=self.object._state.db):
+            self.object.soft_delete()
+            events.tweet_changed(events.TWEET_DELETED, self.object)
+        return HttpResponseRedirect(self.get_success_url())
+
 
 class LikeView(LoginRequiredMixin, View):
     def post(self, request, *arg, **kwargs):
         user = request.user
-        tweet = get_object_or_404(Tweet, pk=kwargs["pk"])
-        Like.objects.get_or_create(user=user, target_tweet=tweet)
+        tweet = shards.get_or_404(Tweet.objects, pk=kwargs["pk"])
+        with transaction.atomic(using=tweet._state.db):
+            like, created = tweet.like_set.get_or_create(user=user)
+            if created:
+                events.like_changed(events.LIKE_CREATED, like)
+        if created and tweet.user_id != user.pk:
+            notify.enqueue(
+                recipient_id=tweet.user_id,
+                verb="like",
+                tweet_id=tweet.pk,
+                actor_id=user.pk,
+            )
         context = {
             "like_count": tweet.like_set.count(),
-            "tweet_pk": tweet.pk,
+            "tweet_pk": str(tweet.pk),
         }
 
         return JsonResponse(context)
@@ -61,10 +221,46 @@ class LikeView(LoginRequiredMixin, View):
 class UnlikeView(LoginRequiredMixin, View):
     def post(self, request, *arg, **kwargs):
         user = request.user
-        tweet = get_object_or_404(Tweet, pk=kwargs["pk"])
-        Like.objects.filter(target_tweet=tweet, user=user).delete()
+        tweet = shards.get_or_404(Tweet.objects, pk=kwargs["pk"])
+        with transaction.atomic(using=tweet._state.db):
+            for like in tweet.like_set.filter(user=user).select_for_update():
+                events.like_changed(events.LIKE_DELETED, like)
+                like.delete()
         context = {
             "like_count": tweet.like_set.count(),
-            "tweet_pk": tweet.pk,
+            "tweet_pk": str(tweet.pk),
         }
         return JsonResponse(context)
+
+
+class RetweetView(LoginRequiredMixin, View):
+    def post(self, request, *arg, **kwargs):
+        tweet = shards.get_or_404(Tweet.objects, pk=kwargs["pk"])
+        with transaction.atomic(using=tweet._state.db):
+            retweet, created = tweet.retweet_set.get_or_create(user=request.user)
+            if created:
+                Tweet.all_objects.using(tweet._state.db).filter(pk=tweet.pk).update(
+                    retweet_count=F("retweet_count") + 1
+                )
+                events.retweet_changed(events.RETWEET_CREATED, retweet)
+        tweet.refresh_from_db(fields=["retweet_count"])
+        return JsonResponse(
+            {"retweet_count": tweet.retweet_count, "tweet_pk": str(tweet.pk)}
+        )
+
+
+class UnretweetView(LoginRequiredMixin, View):
+    def post(self, request, *arg, **kwargs):
+        tweet = shards.get_or_404(Tweet.objects, pk=kwargs["pk"])
+        with transaction.atomic(using=tweet._state.db):
+            deleted, _ = events.delete_retweets(
+                tweet.retweet_set.filter(user=request.user)
+            )
+            if deleted:
+                Tweet.all_objects.using(tweet._state.db).filter(
+                    pk=tweet.pk, retweet_count__gt=0
+                ).update(retweet_count=F("retweet_count") - 1)
+        tweet.refresh_from_db(fields=["retweet_count"])
+        return JsonResponse(
+            {"retweet_count": tweet.retweet_count, "tweet_pk": str(tweet.pk)}
+        )